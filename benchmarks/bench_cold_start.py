@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+云函数入口（python-service/main.py）冷启动耗时
+
+每个场景在全新的 `python -X importtime` 子进程中运行，统计：
+- wall_ms：子进程内各阶段耗时（导入入口、initializer、首个请求）
+- import_ms：importtime 报告的顶层导入累计耗时
+- heavy：本场景实际导入了哪些重型模块（rembg、onnxruntime、cv2 等）
+
+场景：
+- health：导入入口 + 健康检查，不应导入任何重型模块
+- ocr-lazy：PRELOAD_MODELS 为空，首个 /ocr 请求承担导入和模型加载
+- ocr-init：先调用 main.initializer（PRELOAD_MODELS=ocr），再处理首个 /ocr 请求
+
+用法：python benchmarks/bench_cold_start.py [--repeat 3] [--scenarios health,ocr-lazy,ocr-init] [--json]
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python-service')
+HEAVY_MODULES = ('rembg', 'onnxruntime', 'cv2', 'rapidocr_onnxruntime', 'numba', 'pymatting', 'scipy', 'numpy', 'PIL', 'fastapi')
+
+CHILD_CODE = r'''
+import io, sys, json, time, base64
+start = time.perf_counter()
+import main
+timings = {"import_main": time.perf_counter() - start}
+scenario = sys.argv[1]
+if scenario == "ocr-init":
+    t = time.perf_counter()
+    main.initializer(None)
+    timings["initializer"] = time.perf_counter() - t
+if scenario == "health":
+    t = time.perf_counter()
+    response = main.handler({"httpMethod": "GET", "path": "/health"}, None)
+    timings["first_request"] = time.perf_counter() - t
+else:
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (240, 60), "white")
+    ImageDraw.Draw(image).text((10, 20), "cold start 123", fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    event = {"httpMethod": "POST", "path": "/ocr", "headers": {"content-type": "image/png"},
+             "isBase64Encoded": True, "body": base64.b64encode(buffer.getvalue()).decode("ascii")}
+    t = time.perf_counter()
+    response = main.handler(event, None)
+    timings["first_request"] = time.perf_counter() - t
+assert response["statusCode"] == 200, response
+print(json.dumps({k: round(v * 1000, 1) for k, v in timings.items()}))
+'''
+
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def parse_importtime(stderr: str):
+    """返回 (顶层导入累计毫秒, 已导入的重型模块, 顶层导入耗时前 5 名)"""
+    total_us = 0
+    top_level = []
+    modules = set()
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        modules.add(name.split('.')[0])
+        # 缩进为一个空格的是顶层导入，其累计时间已包含所有子模块
+        if len(indent) == 1:
+            total_us += cumulative
+            top_level.append((cumulative, name))
+    heavy = sorted(m for m in HEAVY_MODULES if m in modules)
+    slowest = [f"{name} {us / 1000:.0f}ms" for us, name in sorted(top_level, reverse=True)[:5]]
+    return total_us / 1000, heavy, slowest
+
+
+def run_scenario(scenario: str) -> dict:
+    env = dict(os.environ)
+    env['PRELOAD_MODELS'] = 'ocr' if scenario == 'ocr-init' else ''
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD_CODE, scenario],
+        cwd=SERVICE_DIR, env=env, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{scenario} failed:\n{completed.stderr[-2000:]}")
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    import_ms, heavy, slowest = parse_importtime(completed.stderr)
+    return {**timings, "import_ms": round(import_ms, 1), "heavy": heavy, "slowest_imports": slowest}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="云函数入口冷启动耗时")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scenarios', default='health,ocr-lazy,ocr-init')
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    results = []
+    for scenario in args.scenarios.split(','):
+        runs = [run_scenario(scenario) for _ in range(args.repeat)]
+        summary = {"scenario": scenario}
+        for key in ('import_main', 'initializer', 'first_request', 'import_ms'):
+            values = [run[key] for run in runs if key in run]
+            if values:
+                summary[key] = round(statistics.median(values), 1)
+        summary["heavy"] = runs[-1]["heavy"]
+        summary["slowest_imports"] = runs[-1]["slowest_imports"]
+        results.append(summary)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'scenario':>10} {'import main':>12} {'initializer':>12} {'1st request':>12} {'imports ms':>11}  heavy modules")
+    for r in results:
+        print(f"{r['scenario']:>10} {r.get('import_main', '-'):>12} {r.get('initializer', '-'):>12} "
+              f"{r.get('first_request', '-'):>12} {r['import_ms']:>11}  {', '.join(r['heavy']) or '-'}")
+    for r in results:
+        print(f"  {r['scenario']}: {'; '.join(r['slowest_imports'])}", file=sys.stderr)
+    print(f"(median of {args.repeat} runs, milliseconds)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+换背景合成阶段耗时：PIL（Image.new + Image.composite）、逐背景 NumPy uint16 分块混合（旧实现）
+与 python-service/compositor.py（OpenCV 三通道乘加、多背景一次合成）的对比
+
+合成图是随机纹理前景 + 圆形软边蒙版，不依赖 rembg 模型。另外测量渐变、背景图，
+以及 refine_edges / decontaminate 两个可选步骤的额外开销。
+
+用法：python benchmarks/bench_composite.py [--size 4000x3000] [--colors 4] [--repeat 3] [--json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+from PIL import Image
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python-service')
+sys.path.insert(0, SERVICE_DIR)
+
+PALETTE = [(255, 255, 255), (67, 142, 219), (216, 0, 15), (0, 0, 0), (240, 240, 240), (128, 128, 128)]
+
+
+def make_input(width: int, height: int):
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    yy, xx = np.mgrid[0:height, 0:width]
+    radius = min(width, height) / 3
+    alpha = np.clip(255 - (np.hypot(yy - height / 2, xx - width / 2) - radius) * 4, 0, 255).astype(np.uint8)
+    return rgb, alpha
+
+
+def pil_composite(rgb, alpha, colors):
+    image, mask = Image.fromarray(rgb), Image.fromarray(alpha)
+    return [np.asarray(Image.composite(image, Image.new('RGB', image.size, color), mask)) for color in colors]
+
+
+def numpy_composite(rgb, alpha, colors, rows_per_strip=512):
+    outputs = []
+    for color in colors:
+        bg_rgb = np.array(color, dtype=np.uint16)
+        output = np.empty_like(rgb)
+        for top in range(0, rgb.shape[0], rows_per_strip):
+            rows = slice(top, top + rows_per_strip)
+            a = alpha[rows].astype(np.uint16)[..., None]
+            output[rows] = (rgb[rows].astype(np.uint16) * a + bg_rgb * (255 - a) + 127) // 255
+        outputs.append(output)
+    return outputs
+
+
+def timed(fn, repeat: int):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    import compositor
+
+    parser = argparse.ArgumentParser(description="换背景合成耗时")
+    parser.add_argument('--size', default='4000x3000', help="图片尺寸 WxH")
+    parser.add_argument('--colors', type=int, default=4, help="背景色数量（variants 场景）")
+    parser.add_argument('--repeat', type=int, default=3, help="每项重复次数，取最快一次")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    rgb, alpha = make_input(width, height)
+    colors = [PALETTE[i % len(PALETTE)] for i in range(args.colors)]
+    background_image = Image.fromarray(np.random.default_rng(1).integers(0, 256, (900, 1600, 3), dtype=np.uint8))
+
+    cases = [
+        ('pil', lambda: pil_composite(rgb, alpha, colors)),
+        ('numpy-per-color', lambda: numpy_composite(rgb, alpha, colors)),
+        ('compositor', lambda: compositor.composite(rgb, alpha, colors)),
+        ('compositor-1-color', lambda: compositor.composite(rgb, alpha, colors[:1])),
+        ('gradient', lambda: compositor.composite(rgb, alpha, ['linear-gradient(180deg, #FFFFFF, #438EDB)'])),
+        ('image', lambda: compositor.composite(rgb, alpha, [background_image])),
+        ('refine_edges', lambda: compositor.composite(rgb, alpha, colors[:1], refine_edges=True)),
+        ('decontaminate', lambda: compositor.composite(rgb, alpha, colors[:1], decontaminate=True)),
+    ]
+    results, reference = [], None
+    for name, fn in cases:
+        ms, outputs = timed(fn, args.repeat)
+        if name == 'pil':
+            reference = outputs
+        row = {"case": name, "ms": round(ms, 1)}
+        if name in ('numpy-per-color', 'compositor'):
+            row["speedup_vs_pil"] = round(results[0]['ms'] / ms, 2)
+            row["max_diff_vs_pil"] = max(int(np.abs(a.astype(np.int16) - b).max()) for a, b in zip(reference, outputs))
+        results.append(row)
+
+    if args.json:
+        print(json.dumps({"size": [width, height], "colors": args.colors, "results": results}, indent=2))
+        return
+
+    print(f"{'case':<20} {'ms':>8} {'vs pil':>7} {'max diff':>8}")
+    for r in results:
+        print(f"{r['case']:<20} {r['ms']:>8} {r.get('speedup_vs_pil', '-'):>7} {r.get('max_diff_vs_pil', '-'):>8}")
+    print(f"({width}x{height}, {args.colors} colors for pil / numpy-per-color / compositor, best of {args.repeat})",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+压缩引擎（python-service/compress.py）与朴素实现的对比
+
+朴素实现：完整解码 → 每个输出单独 LANCZOS 缩放（无 reducing_gap）→ 逐个串行编码。
+压缩引擎：JPEG draft() 缩小解码 → 每种尺寸缩放一次（reducing_gap）→ 并行编码。
+输入为合成的相机尺寸 JPEG（默认 4000x3000），输出为一组常见的多尺寸多格式组合。
+同时报告两者输出的 PSNR 差异，确认提速没有明显损失画质。
+--targets 另外测试 targetBytes 模式：每个字节预算下的编码次数、最终质量/尺寸和耗时。
+
+用法：python benchmarks/bench_compress.py [--size 4000x3000] [--repeat 5] [--targets 500KB,200KB,50KB] [--json]
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python-service')
+sys.path.insert(0, SERVICE_DIR)
+
+OUTPUTS = [
+    {'format': 'jpeg', 'quality': 0.8, 'maxWidth': 1920},
+    {'format': 'webp', 'quality': 0.75, 'maxWidth': 1920},
+    {'format': 'jpeg', 'quality': 0.7, 'maxWidth': 800},
+    {'format': 'webp', 'quality': 0.7, 'maxWidth': 320},
+]
+
+
+def make_photo(width: int, height: int) -> bytes:
+    """渐变 + 色块 + 噪声的照片类 JPEG"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[:height, :width]
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    pixels[(x // 400 + y // 400) % 2 == 0] //= 2
+    pixels = (pixels + rng.integers(-12, 12, pixels.shape)).clip(0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=92)
+    return buffer.getvalue()
+
+
+def naive(image_bytes: bytes, outputs: list) -> list:
+    from PIL import Image, ImageOps
+    from compress import target_size, encode
+
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+    image.load()
+    results = []
+    for output in outputs:
+        resized = image.resize(target_size(image.size, output), Image.LANCZOS)
+        results.append(encode(resized, output['format'], output['quality'], output['effort']))
+    return results
+
+
+def psnr(a: bytes, b: bytes) -> float:
+    import numpy as np
+    from PIL import Image
+
+    x = np.asarray(Image.open(io.BytesIO(a)).convert('RGB'), dtype=np.float64)
+    y = np.asarray(Image.open(io.BytesIO(b)).convert('RGB'), dtype=np.float64)
+    mse = np.mean((x - y) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def timed(fn, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), result
+
+
+def main():
+    from compress import parse_output, process
+
+    parser = argparse.ArgumentParser(description="压缩引擎与朴素实现对比")
+    parser.add_argument('--size', default='4000x3000')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--targets', default='500KB,200KB,50KB,10KB', help="targetBytes 模式的字节预算，逗号分隔")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.split('x'))
+    image_bytes = make_photo(width, height)
+    outputs = [parse_output(o) for o in OUTPUTS]
+
+    naive_ms, naive_results = timed(lambda: naive(image_bytes, outputs), args.repeat)
+    engine_ms, engine_result = timed(lambda: process(image_bytes, outputs), args.repeat)
+    rows = []
+    for output, reference, produced in zip(outputs, naive_results, engine_result['outputs']):
+        rows.append({
+            'output': f"{output['format']} {produced['width']}x{produced['height']} q{output['quality']}",
+            'naive_bytes': len(reference),
+            'engine_bytes': produced['size'],
+            'psnr_vs_naive_db': round(psnr(reference, produced['data']), 1),
+        })
+    summary = {'input': f"{width}x{height} JPEG {len(image_bytes)} bytes", 'naive_ms': round(naive_ms, 1),
+               'engine_ms': round(engine_ms, 1), 'speedup': round(naive_ms / engine_ms, 2), 'outputs': rows}
+
+    targets = []
+    for budget in (v for v in args.targets.split(',') if v.strip()):
+        for fmt in ('jpeg', 'webp'):
+            output = parse_output({'format': fmt, 'targetBytes': budget, 'maxWidth': 1920})
+            ms, result = timed(lambda: process(image_bytes, [output]), 1)
+            produced = result['outputs'][0]
+            targets.append({'target': budget, 'format': fmt, 'passes': produced['passes'],
+                            'quality': produced['quality'], 'size': produced['size'],
+                            'dimensions': f"{produced['width']}x{produced['height']}",
+                            'met': produced['target_met'], 'ms': round(ms, 1)})
+    summary['targets'] = targets
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"{summary['input']}: naive {summary['naive_ms']} ms, engine {summary['engine_ms']} ms "
+          f"({summary['speedup']}x)")
+    print(f"{'output':>26} {'naive bytes':>12} {'engine bytes':>12} {'PSNR dB':>8}")
+    for row in rows:
+        print(f"{row['output']:>26} {row['naive_bytes']:>12} {row['engine_bytes']:>12} {row['psnr_vs_naive_db']:>8}")
+    if targets:
+        print(f"\n{'target':>8} {'format':>6} {'passes':>6} {'quality':>7} {'bytes':>8} {'size':>10} {'met':>5} {'ms':>8}")
+        for row in targets:
+            print(f"{row['target']:>8} {row['format']:>6} {row['passes']:>6} {row['quality']:>7} {row['size']:>8} "
+                  f"{row['dimensions']:>10} {str(row['met']):>5} {row['ms']:>8}")
+    print(f"(median of {args.repeat} runs, {os.cpu_count()} CPUs)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
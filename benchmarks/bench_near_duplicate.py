@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+近似重复校验的区分度检查：同一张图的缩放 / 转码副本应当复用，同一模板只改了一个字符的单据必须拒绝
+
+- 单据：1240x1754（A4 150dpi）的发票版式，原图登记到 near_duplicate 的索引里；
+  副本为原图的重新编码（JPEG / WebP）和缩放（0.5-0.8 倍，Pillow 与 OpenCV 的几种缩放算法）；
+  改动为金额、发票号、日期、数量中的一个字符，再按副本的方式编码
+- 人像：corpus 的人像照片及其副本，确认抠图的蒙版复用不受影响
+
+每一项输出汉明距离、最大块差（block_diff）和索引的判断。改动过的单据被复用时退出码为 1，
+副本未被复用只会少省一次推理，单独计数。
+
+用法：python benchmarks/bench_near_duplicate.py [--block-diff 9] [--json]
+"""
+import io
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python-service')
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 每项为原图字段的一个字符改动
+CHANGES = {
+    'total 1,234.56 -> 7,234.58': {'total': '7,234.58'},
+    'total 1,234.56 -> 1,234.57': {'total': '1,234.57'},
+    'total 1,234.56 -> 1,234.58': {'total': '1,234.58'},
+    'total 1,234.56 -> 1,284.56': {'total': '1,284.56'},
+    'total 1,234.56 -> 1,234.66': {'total': '1,234.66'},
+    'number 00123 -> 00124': {'number': 'INV-2024-00124'},
+    'number 00123 -> 00128': {'number': 'INV-2024-00128'},
+    'date 03-15 -> 03-16': {'date': '2024-03-16'},
+    'qty 3 -> 8': {'qty': '8'},
+}
+
+
+def make_invoice(font_path: str = None, total: str = '1,234.56', number: str = 'INV-2024-00123',
+                 date: str = '2024-03-15', qty: str = '3') -> Image.Image:
+    from corpus import load_font
+
+    width, height = 1240, 1754
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    large, medium, small = (load_font(font_path, size) for size in (44, 26, 20))
+    draw.rectangle((60, 60, width - 60, 170), fill=(235, 240, 250))
+    draw.text((90, 85), 'ACME SUPPLY CO.', font=large, fill=(20, 40, 90))
+    draw.text((width - 420, 200), f'Invoice No: {number}', font=medium, fill='black')
+    draw.text((width - 420, 240), f'Date: {date}', font=medium, fill='black')
+    draw.text((90, 200), 'Bill to: Globex Corporation', font=medium, fill='black')
+    draw.text((90, 240), '742 Evergreen Terrace, Springfield', font=small, fill=(60, 60, 60))
+    y = 340
+    draw.line((80, y, width - 80, y), fill='black', width=2)
+    for x, title in ((90, 'Item'), (700, 'Qty'), (900, 'Amount')):
+        draw.text((x, y + 10), title, font=medium, fill='black')
+    y += 50
+    draw.line((80, y, width - 80, y), fill='black', width=1)
+    items = ('Widget A', 'Widget B', 'Gadget C', 'Sprocket D', 'Flange E', 'Bolt pack F', 'Service fee')
+    for i, item in enumerate(items):
+        row = y + 20 + i * 48
+        draw.text((90, row), item, font=small, fill='black')
+        draw.text((710, row), qty if i == 2 else str(i + 1), font=small, fill='black')
+        draw.text((900, row), f'{(i + 1) * 37.5:,.2f}', font=small, fill='black')
+    y += 20 + len(items) * 48 + 20
+    draw.line((80, y, width - 80, y), fill='black', width=2)
+    draw.text((600, y + 30), f'TOTAL AMOUNT DUE: {total}', font=medium, fill='black')
+    for k in range(12):
+        draw.text((90, 1100 + k * 36), 'Payment terms: net 30 days. Late payments incur 1.5% monthly interest.',
+                  font=small, fill=(80, 80, 80))
+    return image
+
+
+def encode(image: Image.Image, format: str, scale: float = 1.0, resample=Image.LANCZOS, **params) -> bytes:
+    if scale != 1.0:
+        size = (round(image.width * scale), round(image.height * scale))
+        if isinstance(resample, int) and resample >= 100:
+            import cv2
+            image = Image.fromarray(cv2.resize(np.asarray(image), size, interpolation=resample - 100))
+        else:
+            image = image.resize(size, resample)
+    output = io.BytesIO()
+    image.save(output, format, **params)
+    return output.getvalue()
+
+
+def copy_modes():
+    """副本的生成方式：名称 -> 编码函数；OpenCV 的插值常量加 100 以区别于 Pillow"""
+    import cv2
+
+    return {
+        'png': lambda im: encode(im, 'PNG'),
+        'jpeg-q75': lambda im: encode(im, 'JPEG', quality=75),
+        'webp-q80': lambda im: encode(im, 'WEBP', quality=80),
+        '0.8x-jpeg': lambda im: encode(im, 'JPEG', 0.8, quality=85),
+        '0.75x-cv-cubic-jpeg': lambda im: encode(im, 'JPEG', 0.75, 100 + cv2.INTER_CUBIC, quality=80),
+        '0.7x-cv-area-png': lambda im: encode(im, 'PNG', 0.7, 100 + cv2.INTER_AREA),
+        '0.6x-jpeg-q60': lambda im: encode(im, 'JPEG', 0.6, quality=60),
+        '0.5x-webp': lambda im: encode(im, 'WEBP', 0.5, quality=80),
+        '0.5x-png': lambda im: encode(im, 'PNG', 0.5),
+        '0.5x-bicubic-jpeg': lambda im: encode(im, 'JPEG', 0.5, Image.BICUBIC, quality=85),
+        '0.5x-bilinear-webp': lambda im: encode(im, 'WEBP', 0.5, Image.BILINEAR, quality=80),
+        '0.5x-cv-linear-png': lambda im: encode(im, 'PNG', 0.5, 100 + cv2.INTER_LINEAR),
+    }
+
+
+def fingerprint(data: bytes, verify_size: int):
+    from near_duplicate import Fingerprint
+
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return Fingerprint.of(image.convert('RGB'), verify_size=verify_size)
+
+
+def check(index, group: str, original, case: str, variant: str, data: bytes, expected: str, verify_size: int) -> dict:
+    from near_duplicate import block_difference, hamming
+
+    candidate = fingerprint(data, verify_size)
+    match = index.find(group, candidate)
+    return {
+        'case': case,
+        'variant': variant,
+        'expected': expected,
+        'outcome': 'reused' if match else 'rejected',
+        'distance': hamming(original.phash, candidate.phash),
+        'block_diff': round(block_difference(original.thumb, candidate.thumb), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="近似重复校验的区分度检查")
+    parser.add_argument('--block-diff', type=float, help="NEAR_DUP_BLOCK_DIFF（默认取 near_duplicate 的默认值）")
+    parser.add_argument('--font', help="单据用的字体（默认 Pillow 内置字体）")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    import corpus
+    from result_cache import get_cache
+    from near_duplicate import NearDuplicateIndex, VERIFY_SIZE, TEXT_VERIFY_SIZE, MAX_BLOCK_DIFF
+
+    index = NearDuplicateIndex(max_block_diff=args.block_diff if args.block_diff is not None else MAX_BLOCK_DIFF)
+    modes = copy_modes()
+    rows = []
+
+    invoice = make_invoice(args.font)
+    original = fingerprint(encode(invoice, 'PNG'), TEXT_VERIFY_SIZE)
+    get_cache().put('bench-near-duplicate-ocr', b'{}')
+    index.add('ocr:bench', original, 'bench-near-duplicate-ocr', 'invoice')
+    for variant, fn in modes.items():
+        rows.append(check(index, 'ocr:bench', original, 'invoice copy', variant, fn(invoice), 'reused',
+                          TEXT_VERIFY_SIZE))
+    for case, fields in CHANGES.items():
+        changed = make_invoice(args.font, **fields)
+        for variant, fn in modes.items():
+            rows.append(check(index, 'ocr:bench', original, case, variant, fn(changed), 'rejected', TEXT_VERIFY_SIZE))
+
+    for size in ((600, 800), (3000, 4000)):
+        portrait = Image.open(io.BytesIO(corpus.make_portrait_image(*size, 0))).convert('RGB')
+        original = fingerprint(encode(portrait, 'PNG'), VERIFY_SIZE)
+        key = f'bench-near-duplicate-matte-{size[0]}'
+        get_cache().put(key, b'matte')
+        index.add(f'matte:{size[0]}', original, key, 'portrait')
+        for variant, fn in modes.items():
+            rows.append(check(index, f'matte:{size[0]}', original, f'portrait {size[0]}x{size[1]} copy', variant,
+                              fn(portrait), 'reused', VERIFY_SIZE))
+
+    unsafe = [r for r in rows if r['expected'] == 'rejected' and r['outcome'] == 'reused']
+    missed = [r for r in rows if r['expected'] == 'reused' and r['outcome'] == 'rejected']
+    copies = [r['block_diff'] for r in rows if r['expected'] == 'reused']
+    changes = [r['block_diff'] for r in rows if r['expected'] == 'rejected']
+    summary = {'max_block_diff': index.max_block_diff, 'copies_max': max(copies), 'changes_min': min(changes),
+               'unsafe': len(unsafe), 'missed': len(missed)}
+
+    if args.json:
+        print(json.dumps({'summary': summary, 'results': rows}, indent=2))
+    else:
+        print(f"{'case':<32} {'variant':<20} {'dist':>4} {'block':>7} {'outcome':<9}")
+        for r in rows:
+            flag = '' if r['outcome'] == r['expected'] else '  <-- ' + ('UNSAFE' if r['expected'] == 'rejected' else 'missed')
+            print(f"{r['case']:<32} {r['variant']:<20} {r['distance']:>4} {r['block_diff']:>7} {r['outcome']:<9}{flag}")
+        print(f"cutoff {summary['max_block_diff']}: copies <= {summary['copies_max']}, "
+              f"one-character changes >= {summary['changes_min']}; {len(unsafe)} unsafe, {len(missed)} missed",
+              file=sys.stderr)
+    sys.exit(1 if unsafe else 0)
+
+
+if __name__ == '__main__':
+    main()
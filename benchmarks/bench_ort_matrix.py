@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime 会话参数矩阵：每种设置下 OCR / 抠图的吞吐量
+
+每种 (引擎, 线程数, 内存池, 图优化级别, 执行模式) 组合在独立子进程中运行，
+参数通过 python-service/inference_config.py 读取的环境变量传入。子进程加载模型并预热后，
+在每个并发度下用 --requests 次推理计算吞吐量（张/秒）和 p50 延迟。
+--optimized-cache 额外比较首次加载（优化并保存模型）与再次加载已优化模型的耗时。
+
+抠图需要 rembg 模型（首次运行会下载到 ~/.u2net）；加载失败的组合会在结果中标明错误。
+用法：python benchmarks/bench_ort_matrix.py [--engines ocr,rembg] [--threads 0,1,auto]
+      [--arena 0,1] [--graph basic,all] [--modes sequential,parallel] [--concurrency 1,4] [--requests 16]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import statistics
+import subprocess
+import tempfile
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python-service')
+
+
+def make_ocr_image():
+    """几行文字的白底图片，接近截图/文档类输入"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (800, 240), 'white')
+    draw = ImageDraw.Draw(image)
+    for row, text in enumerate(("PhotoBox benchmark 2024", "Invoice No. 12345 Total 678.90", "ONNX Runtime threads")):
+        draw.text((20, 30 + row * 70), text, fill='black')
+    return image
+
+
+def make_rembg_image():
+    """渐变背景上的椭圆主体"""
+    import numpy as np
+    from PIL import Image
+
+    height, width = 768, 1024
+    y, x = np.ogrid[:height, :width]
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[...] = np.linspace(90, 200, width, dtype=np.float32)[None, :, None].astype(np.uint8)
+    pixels[((x - width / 2) / 300) ** 2 + ((y - height / 2) / 300) ** 2 <= 1] = (200, 120, 80)
+    return Image.fromarray(pixels)
+
+
+def run_child(args):
+    """子进程：加载并预热引擎，在每个并发度下计时，输出一行 JSON"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    sys.path.insert(0, SERVICE_DIR)
+    start = time.perf_counter()
+    if args.engine == 'ocr':
+        from ocr_rapidocr import get_ocr
+        ocr = get_ocr()
+        image = make_ocr_image()
+        infer = lambda: ocr(image)  # noqa: E731
+    else:
+        from remove_background import get_engine
+        engine = get_engine()
+        engine.warm_up()
+        image = make_rembg_image()
+        infer = lambda: engine.mask(image)  # noqa: E731
+    load_ms = (time.perf_counter() - start) * 1000
+    infer()
+
+    def timed():
+        t = time.perf_counter()
+        infer()
+        return (time.perf_counter() - t) * 1000
+
+    results = []
+    for concurrency in (int(v) for v in args.concurrency.split(',')):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            t = time.perf_counter()
+            latencies = list(executor.map(lambda _: timed(), range(args.requests)))
+            elapsed = time.perf_counter() - t
+        results.append({
+            "concurrency": concurrency,
+            "throughput": round(args.requests / elapsed, 2),
+            "p50_ms": round(statistics.median(latencies), 1),
+        })
+    print(json.dumps({"load_ms": round(load_ms, 1), "runs": results}))
+
+
+def measure(engine: str, env_overrides: dict, args) -> dict:
+    env = dict(os.environ)
+    env.update(env_overrides)
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--engine', engine,
+               '--concurrency', args.concurrency, '--requests', str(args.requests)]
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        lines = completed.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else 'child failed'}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX Runtime 会话参数矩阵")
+    parser.add_argument('--engines', default='ocr,rembg')
+    parser.add_argument('--threads', default='0,1,auto', help="ORT_INTRA_OP_THREADS 取值，0 为 ONNX Runtime 默认")
+    parser.add_argument('--arena', default='0,1', help="ORT_CPU_MEM_ARENA 取值")
+    parser.add_argument('--graph', default='basic,all', help="ORT_GRAPH_OPTIMIZATION 取值")
+    parser.add_argument('--modes', default='sequential', help="ORT_EXECUTION_MODE 取值")
+    parser.add_argument('--concurrency', default='1,4', help="同时推理的调用方数量")
+    parser.add_argument('--requests', type=int, default=16, help="每个并发度下的推理次数")
+    parser.add_argument('--optimized-cache', action='store_true', help="比较首次加载与加载已保存优化模型的耗时")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--engine', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    split = lambda value: [v.strip() for v in value.split(',') if v.strip()]  # noqa: E731
+    results = []
+    for engine in split(args.engines):
+        for threads, arena, graph, mode in itertools.product(
+                split(args.threads), split(args.arena), split(args.graph), split(args.modes)):
+            setting = {"threads": threads, "arena": arena, "graph": graph, "mode": mode}
+            env = {
+                'ORT_INTRA_OP_THREADS': threads,
+                'ORT_CPU_MEM_ARENA': arena,
+                'ORT_GRAPH_OPTIMIZATION': graph,
+                'ORT_EXECUTION_MODE': mode,
+                # 引擎专属变量优先级更高，清空避免干扰矩阵
+                f'{engine.upper()}_ORT_INTRA_OP_THREADS': '',
+                f'{engine.upper()}_ORT_CPU_MEM_ARENA': '',
+                f'{engine.upper()}_ORT_GRAPH_OPTIMIZATION': '',
+                f'{engine.upper()}_ORT_EXECUTION_MODE': '',
+                'ORT_OPTIMIZED_MODEL_DIR': '',
+                f'{engine.upper()}_ORT_OPTIMIZED_MODEL_DIR': '',
+            }
+            results.append({"engine": engine, **setting, **measure(engine, env, args)})
+
+        if args.optimized_cache:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                env = {'ORT_OPTIMIZED_MODEL_DIR': cache_dir, f'{engine.upper()}_ORT_OPTIMIZED_MODEL_DIR': ''}
+                for label in ('optimize+save', 'load-optimized'):
+                    results.append({"engine": engine, "threads": "0", "arena": "-", "graph": "all",
+                                    "mode": label, **measure(engine, env, args)})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'engine':>6} {'threads':>7} {'arena':>5} {'graph':>8} {'mode':>14} {'load ms':>8}  throughput img/s (p50 ms) per concurrency")
+    for r in results:
+        if 'error' in r:
+            runs = f"error: {r['error']}"
+        else:
+            runs = '  '.join(f"c{run['concurrency']}: {run['throughput']} ({run['p50_ms']})" for run in r['runs'])
+        print(f"{r['engine']:>6} {r['threads']:>7} {r['arena']:>5} {r['graph']:>8} {r['mode']:>14} "
+              f"{r.get('load_ms', '-'):>8}  {runs}")
+    print(f"({args.requests} requests per concurrency level, one process per row, {os.cpu_count()} CPUs)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
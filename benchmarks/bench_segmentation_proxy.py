@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+抠图：原图直接分割 vs 代理图分割 + 蒙版放大 的延迟和峰值内存对比
+
+每个 (尺寸, 模式) 在独立子进程中运行，峰值 RSS 互不影响。子进程先加载模型并预热，
+再计时完整流程：解码 JPEG -> 分割 -> 合成纯色背景 -> 编码 PNG。
+模式：
+- full：REMBG_PROXY_SIZE=0，原图直接交给 rembg（旧流程）
+- proxy-N：最长边缩到 N 再分割，蒙版双线性放大
+- proxy-N-guided：同上，蒙版用导向滤波放大
+
+需要 rembg 模型（首次运行会下载到 ~/.u2net）。
+用法：python benchmarks/bench_segmentation_proxy.py [--sizes 4000x3000,8160x6120] [--proxy-sizes 1024,512] [--repeat 3]
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import statistics
+import subprocess
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python-service')
+
+
+def make_image(width: int, height: int) -> bytes:
+    """生成确定性的测试图片：渐变背景上的椭圆主体加噪声，编码为 JPEG"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(width * height)
+    y, x = np.ogrid[:height, :width]
+    inside = ((x - width / 2) / (width * 0.3)) ** 2 + ((y - height / 2) / (height * 0.4)) ** 2 <= 1
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[...] = (np.linspace(90, 200, width, dtype=np.float32)[None, :, None]).astype(np.uint8)
+    pixels[inside] = (200, 120, 80)
+    pixels += rng.integers(0, 16, size=(height, width, 1), dtype=np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+def peak_rss_mb() -> float:
+    """进程峰值 RSS。优先读 VmHWM：Linux 上 ru_maxrss 会带上 fork 时父进程的峰值"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss 在 Linux 上单位为 KB，macOS 上为字节
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+
+
+def run_child(args):
+    """子进程：预热后计时完整流程，输出一行 JSON"""
+    sys.path.insert(0, SERVICE_DIR)
+    import numpy as np
+    from PIL import Image
+    from remove_background import get_engine, segment, composite
+
+    engine = get_engine()
+    engine.warm_up((args.model,))
+    engine.mask(Image.new('RGB', (64, 64)), args.model)
+
+    # 测试图片由父进程生成后经 stdin 传入，生成过程不计入子进程的峰值内存
+    image_bytes = sys.stdin.buffer.read()
+    baseline_mb = peak_rss_mb()
+
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        rgb, alpha = segment(Image.open(io.BytesIO(image_bytes)), args.model, args.proxy_size, args.refine)
+        output = io.BytesIO()
+        Image.fromarray(composite(rgb, alpha, '#FFFFFF')).save(output, 'PNG', compress_level=1)
+        timings.append((time.perf_counter() - start) * 1000)
+        del rgb, alpha, output
+
+    print(json.dumps({
+        "median_ms": round(statistics.median(timings), 1),
+        "baseline_rss_mb": round(baseline_mb, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }))
+
+
+def measure(image_bytes: bytes, proxy_size: int, refine: str, args) -> dict:
+    command = [
+        sys.executable, os.path.abspath(__file__), '--child',
+        '--proxy-size', str(proxy_size), '--refine', refine,
+        '--model', args.model, '--repeat', str(args.repeat),
+    ]
+    completed = subprocess.run(command, input=image_bytes, capture_output=True)
+    stderr = completed.stderr.decode('utf-8', 'replace').strip()
+    if completed.returncode != 0:
+        raise RuntimeError(stderr.splitlines()[-1] if stderr else 'child failed')
+    return json.loads(completed.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="原图分割 vs 代理图分割的延迟和峰值内存对比")
+    parser.add_argument('--sizes', default='4000x3000,8160x6120')
+    parser.add_argument('--proxy-sizes', default='1024,512')
+    parser.add_argument('--model', default='u2net')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果")
+    # 以下参数仅供子进程使用
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--proxy-size', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--refine', default='none', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    modes = [('full', 0, 'none')]
+    for proxy_size in (int(v) for v in args.proxy_sizes.split(',') if v.strip()):
+        modes.append((f'proxy-{proxy_size}', proxy_size, 'none'))
+        modes.append((f'proxy-{proxy_size}-guided', proxy_size, 'guided'))
+
+    results = []
+    for size in args.sizes.split(','):
+        width, height = (int(v) for v in size.lower().split('x'))
+        image_bytes = make_image(width, height)
+        for name, proxy_size, refine in modes:
+            result = measure(image_bytes, proxy_size, refine, args)
+            results.append({"size": size, "mode": name, **result})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'size':>10} {'mode':>18} {'median ms':>10} {'peak RSS MB':>12} {'over baseline':>14}")
+    for r in results:
+        extra = round(r['peak_rss_mb'] - r['baseline_rss_mb'], 1)
+        print(f"{r['size']:>10} {r['mode']:>18} {r['median_ms']:>10} {r['peak_rss_mb']:>12} {extra:>14}")
+    print(f"(model {args.model}, median of {args.repeat} runs, one process per row)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+可复现的基准测试套件：固定语料、固定并发，输出 p50/p95/p99 延迟、吞吐量和峰值 RSS，
+结果保存为 JSON，可与之前保存的基线比较
+
+目标（--targets）：
+- ocr：进程内调用 ocr_rapidocr.process_image_with_rapidocr
+- segment：进程内调用 remove_background.process_image（换白底，输出 PNG）
+- http-ocr / http-segment：向 HTTP 服务 POST /ocr、/remove-background（原始字节请求体）
+
+语料由 benchmarks/corpus.py 按 seed 生成（文字图中英混排、人像剪影），结果里记录语料 digest。
+进程内目标每个 (尺寸, 并发) 在独立子进程中运行，峰值 RSS 互不影响；子进程先加载模型并预热，
+每个并发级别先不计时地跑一轮，再用 --requests 次调用计时。
+HTTP 目标默认在空闲端口上启动 uvicorn app:app（关闭结果缓存和请求日志，任务队列放在内存中），
+峰值 RSS 为服务进程及其推理工作进程的 VmHWM 之和，是截至该行的最高值；
+--url 指向已有服务时改为读取 /metrics 中的 process_resident_memory_bytes（当前值）。
+
+用法：
+  python benchmarks/bench_suite.py --output results.json
+  python benchmarks/bench_suite.py --targets ocr,http-ocr --concurrency 1,4 --output new.json --baseline results.json
+与基线比较时，同一 (目标, 尺寸, 并发) 的 p95 上升、吞吐量下降或峰值 RSS 上升超过 --tolerance 视为退化，退出码为 1。
+"""
+import os
+import sys
+import json
+import math
+import time
+import socket
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.join(BENCH_DIR, '..', 'python-service')
+sys.path.insert(0, BENCH_DIR)
+
+import corpus  # noqa: E402
+
+TARGETS = ('ocr', 'segment', 'http-ocr', 'http-segment')
+# 目标 -> (语料类型, HTTP 路径)
+TARGET_INFO = {
+    'ocr': ('text', None),
+    'segment': ('portrait', None),
+    'http-ocr': ('text', '/ocr'),
+    'http-segment': ('portrait', '/remove-background'),
+}
+MEDIA_TYPES = {'text': 'image/png', 'portrait': 'image/jpeg'}
+EXTENSIONS = {'text': 'png', 'portrait': 'jpg'}
+
+
+def peak_rss_mb() -> float:
+    """进程峰值 RSS。优先读 VmHWM：Linux 上 ru_maxrss 会带上 fork 时父进程的峰值"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss 在 Linux 上单位为 KB，macOS 上为字节
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+
+
+def process_tree_hwm_mb(pid: int) -> float:
+    """服务进程及其所有子进程（推理工作进程）的 VmHWM 之和，读不到时返回 0"""
+    total, pending = 0.0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                total += next((int(line.split()[1]) / 1024 for line in f if line.startswith('VmHWM:')), 0.0)
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return total
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """最近秩百分位数"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(latencies: list, elapsed: float, errors: int) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "mean_ms": round(sum(latencies) / len(latencies), 1) if latencies else 0.0,
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "errors": errors,
+    }
+
+
+def run_load(call, images: list, concurrency: int, requests: int) -> dict:
+    """先用 concurrency 个并发不计时地跑一轮，再计时 requests 次调用；call 返回 False 计为错误"""
+    def timed(index):
+        start = time.perf_counter()
+        ok = call(images[index % len(images)], index)
+        return (time.perf_counter() - start) * 1000, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(max(concurrency, len(images)))))
+        start = time.perf_counter()
+        results = list(executor.map(timed, range(requests)))
+        elapsed = time.perf_counter() - start
+    return summarize([ms for ms, _ in results], elapsed, sum(1 for _, ok in results if not ok))
+
+
+def run_child(args):
+    """子进程：加载模型并预热，按给定并发计时一个 (目标, 尺寸)，输出一行 JSON"""
+    import io
+
+    sys.path.insert(0, SERVICE_DIR)
+    images = []
+    for path in args.files.split(os.pathsep):
+        with open(path, 'rb') as f:
+            images.append(f.read())
+
+    if args.child == 'ocr':
+        from ocr_rapidocr import process_image_with_rapidocr, warm_up
+
+        warm_up()
+
+        def call(image_bytes, _):
+            return process_image_with_rapidocr(image_bytes).get('success', False)
+    else:
+        from remove_background import get_engine, process_image
+
+        get_engine().warm_up((args.model,) if args.model else None)
+
+        def call(image_bytes, _):
+            return process_image(io.BytesIO(image_bytes), io.BytesIO(), '#FFFFFF', args.model)
+
+    result = run_load(call, images, args.concurrency_level, args.requests)
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    print(json.dumps(result))
+
+
+def measure_in_process(target: str, paths: list, concurrency: int, args) -> dict:
+    command = [
+        sys.executable, os.path.abspath(__file__), '--child', target,
+        '--files', os.pathsep.join(paths), '--concurrency-level', str(concurrency),
+        '--requests', str(args.requests),
+    ]
+    if args.model:
+        command += ['--model', args.model]
+    completed = subprocess.run(command, capture_output=True)
+    stderr = completed.stderr.decode('utf-8', 'replace').strip()
+    if completed.returncode != 0:
+        raise RuntimeError(stderr.splitlines()[-1] if stderr else 'child failed')
+    return json.loads(completed.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(engines: list, timeout: float):
+    """在空闲端口上启动 uvicorn app:app，等到 /health 可用；返回 (进程, 地址)"""
+    port = free_port()
+    env = dict(os.environ, PRELOAD_MODELS=','.join(engines), METRICS_LOG='off',
+               JOB_DB_PATH=':memory:', RESULT_CACHE_MB='0')
+    env.pop('RESULT_CACHE_DIR', None)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with code {process.returncode}')
+        try:
+            with urllib.request.urlopen(url + '/health', timeout=2) as response:
+                if response.status == 200:
+                    return process, url
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'server not ready after {timeout:.0f}s')
+
+
+def server_rss_mb(url: str) -> float:
+    """外部服务：/metrics 中的 process_resident_memory_bytes（当前值，不是峰值）"""
+    try:
+        with urllib.request.urlopen(url + '/metrics', timeout=5) as response:
+            for line in response.read().decode('utf-8').splitlines():
+                if line.startswith('process_resident_memory_bytes'):
+                    return float(line.split()[-1]) / 1024 / 1024
+    except (urllib.error.URLError, OSError, ValueError):
+        pass
+    return 0.0
+
+
+def measure_http(url: str, path: str, media_type: str, images: list, concurrency: int, requests: int) -> dict:
+    def call(image_bytes, index):
+        # 末尾追加不同的字节，图片照常解码，但内容哈希不同，不会命中服务端结果缓存
+        body = image_bytes + f'bench-{time.time_ns()}-{index}'.encode('ascii')
+        request = urllib.request.Request(url + path, data=body, headers={'Content-Type': media_type})
+        try:
+            with urllib.request.urlopen(request, timeout=300) as response:
+                response.read()
+                return response.status == 200
+        except (urllib.error.URLError, OSError):
+            return False
+
+    return run_load(call, images, concurrency, requests)
+
+
+def git_commit() -> str:
+    try:
+        completed = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                                   timeout=10)
+        return completed.stdout.decode('ascii').strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    """按 (目标, 尺寸, 并发) 与基线逐行比较，返回退化项列表"""
+    previous = {(r['target'], r['size'], r['concurrency']): r for r in baseline.get('results', [])}
+    regressions = []
+    for r in results:
+        old = previous.get((r['target'], r['size'], r['concurrency']))
+        if old is None:
+            continue
+        checks = [
+            ('p95_ms', r['p95_ms'], old['p95_ms'], r['p95_ms'] > old['p95_ms'] * (1 + tolerance)),
+            ('throughput', r['throughput'], old['throughput'], r['throughput'] < old['throughput'] * (1 - tolerance)),
+            ('peak_rss_mb', r['peak_rss_mb'], old['peak_rss_mb'],
+             old['peak_rss_mb'] > 0 and r['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance)),
+        ]
+        for metric, new_value, old_value, regressed in checks:
+            if regressed:
+                regressions.append({"target": r['target'], "size": r['size'], "concurrency": r['concurrency'],
+                                    "metric": metric, "baseline": old_value, "current": new_value})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR / 抠图 / HTTP 服务的可复现基准测试")
+    parser.add_argument('--targets', default=','.join(TARGETS), help=f"逗号分隔，可选 {', '.join(TARGETS)}")
+    parser.add_argument('--text-sizes', default='640x480,1280x960,2480x3508', help="文字图尺寸（最后一个为 A4 300dpi）")
+    parser.add_argument('--portrait-sizes', default='600x800,1200x1600,3000x4000', help="人像图尺寸")
+    parser.add_argument('--images', type=int, default=4, help="每个尺寸的图片数，请求轮流使用")
+    parser.add_argument('--concurrency', default='1,2,4', help="并发级别")
+    parser.add_argument('--requests', type=int, default=16, help="每个 (目标, 尺寸, 并发) 计时的请求数")
+    parser.add_argument('--model', help="抠图模型（默认使用服务的 REMBG_MODEL）")
+    parser.add_argument('--font', help="CJK 字体文件路径（也可用 BENCH_FONT）")
+    parser.add_argument('--seed', type=int, default=0, help="语料随机种子")
+    parser.add_argument('--url', help="使用已运行的 HTTP 服务，不自动启动")
+    parser.add_argument('--server-timeout', type=float, default=180, help="等待自动启动的服务就绪的秒数")
+    parser.add_argument('--output', help="结果 JSON 文件")
+    parser.add_argument('--baseline', help="基线结果 JSON 文件")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="判定退化的相对变化（默认 0.15）")
+    # 以下参数仅供子进程使用
+    parser.add_argument('--child', choices=('ocr', 'segment'), help=argparse.SUPPRESS)
+    parser.add_argument('--files', help=argparse.SUPPRESS)
+    parser.add_argument('--concurrency-level', type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    targets = [t.strip() for t in args.targets.split(',') if t.strip()]
+    unknown = [t for t in targets if t not in TARGET_INFO]
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(unknown)}")
+    levels = [int(v) for v in args.concurrency.split(',') if v.strip()]
+    kinds = {TARGET_INFO[t][0] for t in targets}
+    text_sizes = corpus.parse_sizes(args.text_sizes) if 'text' in kinds else []
+    portrait_sizes = corpus.parse_sizes(args.portrait_sizes) if 'portrait' in kinds else []
+
+    print("Generating corpus...", file=sys.stderr)
+    data = corpus.build(text_sizes, portrait_sizes, args.images, args.font, args.seed)
+    if data['info']['font'] and not data['info']['cjk']:
+        print(f"No CJK font found, text images are Latin only ({data['info']['font']})", file=sys.stderr)
+
+    # 语料写到临时目录，子进程从文件读取，生成过程不计入子进程的峰值内存
+    workdir = tempfile.mkdtemp(prefix='bench-suite-')
+    paths = {}
+    for kind in ('text', 'portrait'):
+        for (width, height), items in data[kind].items():
+            for i, image_bytes in enumerate(items):
+                path = os.path.join(workdir, f'{kind}-{width}x{height}-{i}.{EXTENSIONS[kind]}')
+                with open(path, 'wb') as f:
+                    f.write(image_bytes)
+                paths.setdefault((kind, (width, height)), []).append(path)
+
+    http_targets = [t for t in targets if TARGET_INFO[t][1]]
+    server, url = None, args.url
+    results = []
+    try:
+        if http_targets and not url:
+            engines = sorted({'ocr' if t == 'http-ocr' else 'rembg' for t in http_targets})
+            print(f"Starting server (PRELOAD_MODELS={','.join(engines)})...", file=sys.stderr)
+            server, url = start_server(engines, args.server_timeout)
+
+        for target in targets:
+            kind, path = TARGET_INFO[target]
+            for size, items in data[kind].items():
+                for concurrency in levels:
+                    print(f"{target} {size[0]}x{size[1]} concurrency={concurrency}", file=sys.stderr)
+                    if path:
+                        row = measure_http(url, path, MEDIA_TYPES[kind], items, concurrency, args.requests)
+                        rss = process_tree_hwm_mb(server.pid) if server else server_rss_mb(url)
+                        row["peak_rss_mb"] = round(rss, 1)
+                    else:
+                        row = measure_in_process(target, paths[(kind, size)], concurrency, args)
+                    results.append({"target": target, "size": f"{size[0]}x{size[1]}", "concurrency": concurrency,
+                                    **row})
+    finally:
+        if server:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count(),
+            "corpus": data['info'],
+            "requests": args.requests,
+            "model": args.model,
+            "url": args.url,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"{'target':<13} {'size':>10} {'conc':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'img/s':>7} "
+          f"{'peak MB':>8} {'err':>4}")
+    for r in results:
+        print(f"{r['target']:<13} {r['size']:>10} {r['concurrency']:>4} {r['p50_ms']:>9} {r['p95_ms']:>9} "
+              f"{r['p99_ms']:>9} {r['throughput']:>7} {r['peak_rss_mb']:>8} {r['errors']:>4}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('corpus', {}).get('digest') != data['info']['digest']:
+            print("Warning: corpus digest differs from baseline (different seed, sizes or font)", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['target']} {r['size']} concurrency={r['concurrency']} {r['metric']}: "
+                  f"{r['baseline']} -> {r['current']}", file=sys.stderr)
+        print(f"{len(regressions)} regression(s) vs {args.baseline} (tolerance {args.tolerance:.0%})", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+临时文件 vs 内存管道的 I/O 开销对比
+
+只测量脚本中模型推理之外的部分（解码输入、编码输出、交给调用方），
+分别模拟：
+- tempfile：旧流程，输入写临时文件再用 PIL 打开，结果 PNG 写临时文件，
+  调用方读回后删除
+- memory：新流程，从 BytesIO 解码，结果编码到 BytesIO 直接返回
+
+用法：python benchmarks/bench_tempfile_io.py [--repeat 20] [--sizes 640x480,1920x1080,4000x3000]
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+from PIL import Image
+
+
+def make_image(width: int, height: int) -> bytes:
+    """生成确定性的测试图片（渐变 + 噪声），编码为 JPEG，接近手机照片"""
+    rng = np.random.default_rng(width * height)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    noise = rng.normal(0, 12, size=base.shape).astype(np.float32)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+def run_tempfile(image_bytes: bytes) -> bytes:
+    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_input:
+        temp_input.write(image_bytes)
+        input_path = temp_input.name
+    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_output:
+        output_path = temp_output.name
+    try:
+        image = Image.open(input_path).convert('RGBA')
+        image.convert('RGB').save(output_path, 'PNG')
+        # 调用方（Node）读回结果文件
+        with open(output_path, 'rb') as f:
+            return f.read()
+    finally:
+        os.unlink(input_path)
+        os.unlink(output_path)
+
+
+def run_memory(image_bytes: bytes) -> bytes:
+    image = Image.open(io.BytesIO(image_bytes)).convert('RGBA')
+    output = io.BytesIO()
+    image.convert('RGB').save(output, 'PNG')
+    return output.getvalue()
+
+
+def measure(fn, image_bytes: bytes, repeat: int) -> list:
+    fn(image_bytes)  # 预热
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(image_bytes)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="临时文件 vs 内存管道的 I/O 开销对比")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--sizes', default='640x480,1920x1080,4000x3000')
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes.split(','):
+        width, height = (int(v) for v in size.lower().split('x'))
+        image_bytes = make_image(width, height)
+        tempfile_ms = statistics.median(measure(run_tempfile, image_bytes, args.repeat))
+        memory_ms = statistics.median(measure(run_memory, image_bytes, args.repeat))
+        results.append({
+            "size": f"{width}x{height}",
+            "input_kb": round(len(image_bytes) / 1024, 1),
+            "tempfile_ms": round(tempfile_ms, 2),
+            "memory_ms": round(memory_ms, 2),
+            "saved_ms": round(tempfile_ms - memory_ms, 2),
+        })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'size':>10} {'input KB':>9} {'tempfile ms':>12} {'memory ms':>10} {'saved ms':>9}")
+    for r in results:
+        print(f"{r['size']:>10} {r['input_kb']:>9} {r['tempfile_ms']:>12} {r['memory_ms']:>10} {r['saved_ms']:>9}")
+    print(f"(median of {args.repeat} runs, temp dir: {tempfile.gettempdir()})", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+推理进程池（python-service/worker_pool.py）吞吐量随工作进程数的变化
+
+每个工作进程数下启动一个 WorkerPool（WORKER_CPU_SETS=auto 绑核，只预热 OCR），
+等全部进程预热完成后，用 2 x 进程数个调用方并发提交 --requests 次 OCR，
+统计吞吐量（张/秒）、p50/p95 延迟，以及相对单进程的加速比和线性扩展效率。
+最后一组额外打开 WORKER_MAX_REQUESTS，观察回收进程对吞吐量的影响。
+
+用法：python benchmarks/bench_worker_pool.py [--workers 1,2,4] [--requests 64] [--recycle-after 16] [--json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python-service')
+sys.path.insert(0, SERVICE_DIR)
+
+
+def make_ocr_image() -> bytes:
+    """几行文字的白底 PNG"""
+    import io
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (800, 240), 'white')
+    draw = ImageDraw.Draw(image)
+    for row, text in enumerate(("PhotoBox benchmark 2024", "Invoice No. 12345 Total 678.90", "worker pool scaling")):
+        draw.text((20, 30 + row * 70), text, fill='black')
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def measure(workers: int, requests: int, image: bytes, max_requests: int = 0) -> dict:
+    from concurrent.futures import ThreadPoolExecutor
+    from ocr_rapidocr import process_image_with_rapidocr
+    from worker_pool import WorkerPool
+
+    start = time.perf_counter()
+    pool = WorkerPool(workers, cpu_sets='auto', max_requests=max_requests, max_rss_mb=0).start(['ocr'])
+    pool.wait_ready()
+    startup_ms = (time.perf_counter() - start) * 1000
+
+    def timed(_):
+        t = time.perf_counter()
+        pool.call(process_image_with_rapidocr, image)
+        return (time.perf_counter() - t) * 1000
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers * 2) as executor:
+            list(executor.map(timed, range(workers)))  # 每个进程先跑一次
+            t = time.perf_counter()
+            latencies = sorted(executor.map(timed, range(requests)))
+            elapsed = time.perf_counter() - t
+        recycled = pool.stats()['recycled']
+    finally:
+        pool.shutdown()
+
+    return {
+        "workers": workers,
+        "max_requests": max_requests,
+        "startup_ms": round(startup_ms, 1),
+        "throughput": round(requests / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies), 1),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+        "recycled": recycled,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推理进程池吞吐量")
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    default_workers = sorted({1, max(1, cpus // 2), cpus})
+    parser.add_argument('--workers', default=','.join(map(str, default_workers)), help="要测试的工作进程数")
+    parser.add_argument('--requests', type=int, default=64, help="每组的 OCR 次数")
+    parser.add_argument('--recycle-after', type=int, default=16, help="最后一组的 WORKER_MAX_REQUESTS，0 为跳过")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    image = make_ocr_image()
+    counts = [int(v) for v in args.workers.split(',') if v.strip()]
+    results = [measure(n, args.requests, image) for n in counts]
+    if args.recycle_after:
+        results.append(measure(counts[-1], args.requests, image, args.recycle_after))
+
+    base = results[0]['throughput']
+    for r in results:
+        r['speedup'] = round(r['throughput'] / base, 2)
+        r['efficiency'] = round(r['speedup'] / r['workers'] * results[0]['workers'], 2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'workers':>7} {'recycle':>7} {'startup ms':>10} {'img/s':>7} {'p50 ms':>7} {'p95 ms':>7} "
+          f"{'speedup':>7} {'efficiency':>10} {'recycled':>8}")
+    for r in results:
+        print(f"{r['workers']:>7} {r['max_requests'] or '-':>7} {r['startup_ms']:>10} {r['throughput']:>7} "
+              f"{r['p50_ms']:>7} {r['p95_ms']:>7} {r['speedup']:>7} {r['efficiency']:>10} {r['recycled']:>8}")
+    print(f"({args.requests} OCR requests per row, {cpus} CPUs, WORKER_CPU_SETS=auto)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+确定性的合成测试语料（bench_suite.py 使用，也可单独导出查看）
+
+- text：白底多行文字，中文短语与英文单词、数字混排（发票、单据一类的版式），按分辨率缩放字号
+- portrait：渐变加噪声背景上的人像剪影（头发、脸、脖子、肩膀），用于分割
+
+同一个 seed、尺寸和字体生成的图片逐字节相同；digest 为整套语料的 sha256，用于确认两次结果用的是同一份语料。
+中文需要 CJK 字体：按 --font / BENCH_FONT、常见系统字体的顺序查找，找不到时退化为纯英文并在 info 中注明。
+
+用法：python benchmarks/corpus.py --out /tmp/corpus [--text-sizes 640x480,1280x960] [--portrait-sizes 600x800] [--images 4]
+"""
+import io
+import os
+import random
+import hashlib
+import argparse
+
+CJK_FONTS = (
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',
+    '/usr/share/fonts/wqy-microhei/wqy-microhei.ttc',
+    '/System/Library/Fonts/PingFang.ttc',
+    '/System/Library/Fonts/STHeiti Light.ttc',
+    'C:/Windows/Fonts/msyh.ttc',
+    'C:/Windows/Fonts/simhei.ttf',
+)
+LATIN_FONTS = ('DejaVuSans.ttf', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 'arial.ttf')
+
+CJK_PHRASES = ('发票号码', '开票日期', '购买方名称', '金额合计', '税率', '联系电话', '收货地址', '备注',
+               '增值税专用发票', '身份证号', '有效期至', '会员积分', '订单编号', '实付款', '你好世界')
+LATIN_WORDS = ('Invoice', 'Total', 'Amount', 'Date', 'PhotoBox', 'Order', 'No.', 'Tel', 'Address',
+               'Receipt', 'Hello', 'World', 'VAT', 'ID', 'Payment')
+
+
+def parse_sizes(value: str) -> list:
+    return [tuple(int(v) for v in item.lower().split('x')) for item in value.split(',') if item.strip()]
+
+
+def find_font(path: str = None):
+    """返回 (字体路径, 是否支持中文)；都找不到时返回 (None, False)，使用 Pillow 内置字体"""
+    from PIL import ImageFont
+
+    path = path or os.environ.get('BENCH_FONT')
+    candidates = ([(path, True)] if path else []) + [(p, True) for p in CJK_FONTS] + [(p, False) for p in LATIN_FONTS]
+    for candidate, cjk in candidates:
+        try:
+            ImageFont.truetype(candidate, 12)
+            return candidate, cjk
+        except OSError:
+            continue
+    return None, False
+
+
+def load_font(path: str, size: int):
+    from PIL import ImageFont
+
+    if path:
+        return ImageFont.truetype(path, size)
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1
+        return ImageFont.load_default()
+
+
+def text_line(rng: random.Random, cjk: bool) -> str:
+    tokens = []
+    for _ in range(rng.randint(2, 5)):
+        kind = rng.random()
+        if cjk and kind < 0.45:
+            tokens.append(rng.choice(CJK_PHRASES))
+        elif kind < 0.8:
+            tokens.append(rng.choice(LATIN_WORDS))
+        else:
+            tokens.append(f"{rng.randint(0, 99999):05d}" if rng.random() < 0.5 else f"{rng.uniform(1, 9999):.2f}")
+    return (' ' if not cjk else rng.choice((' ', '：', ' '))).join(tokens)
+
+
+def make_text_image(width: int, height: int, index: int, font_path: str = None, cjk: bool = False,
+                    seed: int = 0) -> bytes:
+    """白底多行文字，行高约为图片高度的 1/18，PNG"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(f'text-{seed}-{width}x{height}-{index}')
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    line_height = max(16, height // 18)
+    font = load_font(font_path, int(line_height * 0.6))
+    margin = width // 20
+    y = line_height
+    while y + line_height < height - line_height // 2:
+        shade = rng.randint(0, 60)
+        draw.text((margin + rng.randint(0, margin), y), text_line(rng, cjk), fill=(shade, shade, shade), font=font)
+        y += int(line_height * rng.uniform(1.2, 1.8))
+    output = io.BytesIO()
+    image.save(output, 'PNG')
+    return output.getvalue()
+
+
+def make_portrait_image(width: int, height: int, index: int, seed: int = 0) -> bytes:
+    """渐变背景上的半身人像剪影加噪声，JPEG（手机照片的常见格式）"""
+    import numpy as np
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = np.random.default_rng([seed, width, height, index])
+    top, bottom = rng.integers(120, 240, 3), rng.integers(40, 160, 3)
+    t = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    pixels = (top * (1 - t) + bottom * t).repeat(width, axis=1)
+    pixels += rng.normal(0, 6, (height, width, 1))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    draw = ImageDraw.Draw(image)
+    cx = width * rng.uniform(0.42, 0.58)
+    head_w, head_h = width * 0.2, height * 0.17
+    head_y = height * rng.uniform(0.22, 0.3)
+    skin = tuple(int(v) for v in rng.integers((170, 120, 90), (235, 190, 160)))
+    clothes = tuple(int(v) for v in rng.integers(20, 200, 3))
+    hair = tuple(int(v) for v in rng.integers(10, 70, 3))
+    # 肩膀和躯干
+    draw.ellipse((cx - width * 0.42, head_y + head_h * 1.05, cx + width * 0.42, height * 1.6), fill=clothes)
+    # 脖子、头发、脸
+    draw.rectangle((cx - head_w * 0.28, head_y + head_h * 0.6, cx + head_w * 0.28, head_y + head_h * 1.25), fill=skin)
+    draw.ellipse((cx - head_w * 0.62, head_y - head_h * 0.62, cx + head_w * 0.62, head_y + head_h * 0.45), fill=hair)
+    draw.ellipse((cx - head_w / 2, head_y - head_h / 2, cx + head_w / 2, head_y + head_h * 0.6), fill=skin)
+    image = image.filter(ImageFilter.GaussianBlur(radius=max(1, width // 600)))
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+def build(text_sizes, portrait_sizes, images: int = 4, font: str = None, seed: int = 0) -> dict:
+    """
+    生成整套语料：{'text': {(w, h): [bytes, ...]}, 'portrait': {...}, 'info': {...}}
+    info 含字体、是否有中文和 digest
+    """
+    font_path, cjk = find_font(font)
+    corpus = {
+        'text': {size: [make_text_image(*size, i, font_path, cjk, seed) for i in range(images)] for size in text_sizes},
+        'portrait': {size: [make_portrait_image(*size, i, seed) for i in range(images)] for size in portrait_sizes},
+    }
+    digest = hashlib.sha256()
+    for kind in ('text', 'portrait'):
+        for size, items in corpus[kind].items():
+            for data in items:
+                digest.update(f'{kind}{size}'.encode('ascii'))
+                digest.update(data)
+    corpus['info'] = {
+        'seed': seed,
+        'images_per_size': images,
+        'font': os.path.basename(font_path) if font_path else 'pillow-default',
+        'cjk': cjk,
+        'digest': digest.hexdigest(),
+    }
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成确定性的合成测试语料")
+    parser.add_argument('--out', required=True, help="输出目录")
+    parser.add_argument('--text-sizes', default='640x480,1280x960,2480x3508')
+    parser.add_argument('--portrait-sizes', default='600x800,1200x1600,3000x4000')
+    parser.add_argument('--images', type=int, default=4, help="每个尺寸的图片数")
+    parser.add_argument('--font', help="CJK 字体文件路径")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = build(parse_sizes(args.text_sizes), parse_sizes(args.portrait_sizes), args.images, args.font, args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    for kind, extension in (('text', 'png'), ('portrait', 'jpg')):
+        for (width, height), items in corpus[kind].items():
+            for i, data in enumerate(items):
+                with open(os.path.join(args.out, f'{kind}-{width}x{height}-{i}.{extension}'), 'wb') as f:
+                    f.write(data)
+    print(corpus['info'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+PhotoBox Python 服务 - FastAPI 应用
+
+推理在 inference_pool 的线程池中执行，事件循环只负责收发请求；
+线程池和排队名额都满时返回 503。
+"""
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse, PlainTextResponse
+from starlette.routing import Match
+
+import sys
+import json
+import time
+import asyncio
+import threading
+
+import service
+import metrics
+import startup
+import worker_pool
+import inference_config
+from inference_pool import get_pool, QueueFullError
+from result_cache import get_cache
+
+app = FastAPI(title="PhotoBox Python Service")
+
+
+class MetricsMiddleware:
+    """
+    按路由模板（例如 /jobs/{job_id}）记录请求耗时、状态码和各阶段耗时，每个请求输出一行 JSON 日志。
+    纯 ASGI 中间件：流式响应（/ocr/batch）计到最后一块发送完
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        with metrics.request(route_template(scope)) as outcome:
+            async def send_with_status(message):
+                if message["type"] == "http.response.start":
+                    outcome["status"] = message["status"]
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
+
+
+def route_template(scope) -> str:
+    """请求对应的路由模板；未匹配的路径统一记为 unmatched，避免标签数量无限增长"""
+    if scope.get("method") == "OPTIONS":
+        return "preflight"
+    for route in app.router.routes:
+        if route.matches(scope)[0] == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization"],
+    expose_headers=["X-Image-Id", "X-Original-Size", "X-Compressed-Size", "X-Image-Width", "X-Image-Height",
+                    "X-Quality", "X-Encode-Passes", "X-Target-Met", "X-Face-Detected", "X-Crop-Box"],
+)
+# 最后添加的中间件在最外层，CORS 预检和错误响应也会被计入
+app.add_middleware(MetricsMiddleware)
+
+
+@app.on_event("startup")
+async def preload_engines():
+    """
+    在主线程中导入 PRELOAD_MODELS 指定的引擎（见 startup.require），
+    模型加载和预热放到后台线程，服务启动后健康检查立即可用。
+    多进程模式下改为启动推理工作进程，由各进程自己加载模型
+    """
+    resume_jobs()
+    if worker_pool.enabled():
+        worker_pool.get_worker_pool()
+        return
+    engines = []
+    for engine in startup.preload_engines():
+        try:
+            startup.require(engine)
+            engines.append(engine)
+        except Exception as e:
+            print(f"Importing {engine} failed: {e}", file=sys.stderr)
+    if engines:
+        threading.Thread(target=startup.preload, args=(engines,), name="preload", daemon=True).start()
+
+
+def resume_jobs():
+    """打开任务队列，继续执行上次未完成的任务；先在主线程导入这些任务需要的引擎"""
+    from job_queue import get_job_queue
+
+    for kind in get_job_queue().pending_kinds():
+        startup.require(service.JOB_KINDS.get(kind, kind))
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    if worker_pool.enabled():
+        worker_pool.get_worker_pool().shutdown()
+
+
+@app.exception_handler(service.ServiceError)
+async def service_error_handler(request: Request, exc: service.ServiceError):
+    return JSONResponse({"success": False, "error": exc.message}, status_code=exc.status_code)
+
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse({"success": False, "error": str(exc)}, status_code=503, headers={"Retry-After": "1"})
+
+
+async def read_body(request: Request) -> bytes:
+    with metrics.stage("io"):
+        return await request.body()
+
+
+async def read_image_request(request: Request):
+    """读取图片请求：支持原始字节、multipart 表单和 Base64 JSON"""
+    body = await read_body(request)
+    return service.parse_image_request(request.headers.get("content-type"), body, request.query_params)
+
+
+@app.get("/")
+@app.get("/health")
+async def health():
+    return {
+        "status": "healthy",
+        "message": "PhotoBox API is running",
+        "inference": get_pool().stats(),
+        "workers": worker_pool.get_worker_pool().stats() if worker_pool.enabled() else None,
+        "cache": get_cache().stats(),
+        "jobs": job_stats(),
+        "onnxruntime": inference_config.describe(),
+    }
+
+
+def job_stats():
+    from job_queue import get_job_queue
+
+    return get_job_queue().stats()
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 文本格式的指标"""
+    return PlainTextResponse(service.metrics_text(include_jobs=True), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return get_cache().stats()
+
+
+@app.post("/ocr")
+async def ocr(request: Request):
+    image_bytes, params = await read_image_request(request)
+    startup.require("ocr")
+    return await get_pool().run(service.ocr, image_bytes, **service.ocr_params(params))
+
+
+@app.post("/ocr/batch")
+async def ocr_batch(request: Request):
+    """批量 OCR，以 NDJSON 流式返回，每识别完一张图片输出一行"""
+    body = await read_body(request)
+    images, _ = service.parse_batch_request(request.headers.get("content-type"), body, request.query_params)
+    pool = get_pool()
+    pool.check_capacity()
+    startup.require("ocr")
+
+    # 同步生成器由 Starlette 放到线程中迭代，等待推理结果时不会阻塞事件循环
+    lines = (json.dumps(line, ensure_ascii=False) + "\n" for line in service.ocr_batch(images, pool.submit))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+
+@app.post("/index")
+async def index_image(request: Request):
+    """把图片的 OCR 结果（行文本和框）加入关键词索引"""
+    body = await read_body(request)
+    params = service.index_request(request.headers.get("content-type"), body, request.query_params)
+    if params["image_bytes"] is not None:
+        startup.require("ocr")
+    return await get_pool().run(service.index_image, **params)
+
+
+@app.get("/index/search")
+async def search_index(q: str = "", limit: int = 20):
+    return service.search_index(q, limit)
+
+
+@app.get("/index/stats")
+async def index_stats():
+    from ocr_index import get_index
+
+    return get_index().stats()
+
+
+@app.delete("/index/{image_id}")
+async def remove_from_index(image_id: str):
+    return service.remove_from_index(image_id)
+
+
+@app.post("/remove-background")
+async def remove_background(request: Request):
+    image_bytes, params = await read_image_request(request)
+    output = service.output_params(params)
+    startup.require("rembg")
+    headers = {"X-Image-Id": service.image_id(image_bytes)}
+    if output:
+        # 换背景后直接编码为指定格式 / 字节预算，例如证件照 targetBytes=200KB&format=jpeg
+        result = await get_pool().run(service.remove_background_as, image_bytes, output, **service.background_params(params))
+        headers.update(service.compress_headers({"original": {"size": len(image_bytes)}, "outputs": [result]}))
+        return Response(content=result["data"], media_type=result["media_type"], headers=headers)
+    png = await get_pool().run(service.remove_background, image_bytes, **service.background_params(params))
+    return Response(content=png, media_type="image/png", headers=headers)
+
+
+@app.post("/id-photo")
+async def id_photo(request: Request):
+    """证件照：按人脸裁剪到 size（1inch / 2inch）、换背景，直接返回成片尺寸的图片"""
+    image_bytes, params = await read_image_request(request)
+    output = service.output_params(params)
+    startup.require("rembg")
+    result = await get_pool().run(service.id_photo, image_bytes, output=output, **service.id_photo_params(params))
+    return Response(content=result["data"], media_type=result["media_type"], headers=service.id_photo_headers(result))
+
+
+@app.post("/remove-background/variants")
+async def remove_background_variants(request: Request):
+    body = await read_body(request)
+    params = service.variants_request(request.headers.get("content-type"), body, request.query_params)
+    startup.require("rembg")
+    return await get_pool().run(service.background_variants, **params)
+
+
+async def compress_image(request: Request, resize: bool):
+    body = await read_body(request)
+    params = service.compress_request(request.headers.get("content-type"), body, request.query_params, resize)
+    result = await get_pool().run(service.compress, params["image_bytes"], params["outputs"])
+    if params["multiple"]:
+        return service.compress_json(result)
+    output = result["outputs"][0]
+    return Response(content=output["data"], media_type=output["media_type"], headers=service.compress_headers(result))
+
+
+@app.post("/compress")
+async def compress(request: Request):
+    """压缩，参数 quality（0.1-1.0）、format、maxWidth、maxHeight、effort；多个输出用 outputs"""
+    return await compress_image(request, resize=False)
+
+
+@app.post("/resize")
+async def resize(request: Request):
+    """缩放到 width / height，maintainAspectRatio 默认为 true；多个输出用 outputs"""
+    return await compress_image(request, resize=True)
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: Request):
+    """提交异步任务，立即返回任务 ID；相同图片和参数的任务直接返回已有任务"""
+    from job_queue import get_job_queue
+
+    body = await read_body(request)
+    params = service.job_request(request.headers.get("content-type"), body, request.query_params)
+    startup.require(service.JOB_KINDS[params["kind"]])
+    job = get_job_queue().enqueue(params["kind"], params["image_bytes"], params["params"], params["priority"])
+    return {"success": True, **job, "status_url": f"/jobs/{job['job_id']}"}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, wait: float = 0):
+    """任务状态；wait 大于 0 时最多等待这么多秒（上限 30）直到任务结束，减少轮询次数"""
+    deadline = time.monotonic() + max(0.0, min(wait, 30.0))
+    while True:
+        status = service.job_status(job_id)
+        if status["status"] in ("done", "failed") or time.monotonic() >= deadline:
+            return status
+        await asyncio.sleep(0.25)
+
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    content, media_type = service.job_result(job_id)
+    return Response(content=content, media_type=media_type)
@@ -0,0 +1,287 @@
+"""
+图片压缩 / 缩放引擎 - 一次解码，多种尺寸和格式并行编码
+
+- 解码见 image_io：JPEG 用 draft() 在 DCT 域直接按 1/2、1/4、1/8 缩小解码，只解码到最大输出尺寸所需的分辨率，
+  超出像素预算的图片缩小解码或直接拒绝
+- 缩放使用 LANCZOS + reducing_gap：先按整数倍快速缩小（Image.reduce），再做精确重采样
+- 同一尺寸只缩放一次，各输出在共享线程池中并行编码（Pillow 编码时释放 GIL）
+- effort 控制编码器的优化程度：fast / default / max
+  JPEG 对应 optimize（哈夫曼表优化）和 progressive，WebP 对应 method 0/4/6，PNG 对应 compress_level 1/6/9 + optimize
+- targetBytes 模式：在字节预算内找最高质量（quality 为上限），按文件大小对质量插值搜索；
+  最低质量仍超出时按“字节数约与像素数成正比”估算缩放比例，从同一份解码像素缩小后再搜索，返回编码次数
+"""
+import io
+import os
+import re
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import metrics
+from image_io import check_image, open_image, oriented_size, budget_size
+
+# 格式名 -> (Pillow 格式, 媒体类型)
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+    'png': ('PNG', 'image/png'),
+}
+EFFORT_LEVELS = ('fast', 'default', 'max')
+MAX_DIMENSION = 10000
+# reducing_gap 越大越接近完整 LANCZOS，越小越快；3.0 时与完整重采样几乎无差别
+REDUCING_GAP = float(os.environ.get('COMPRESS_REDUCING_GAP', '3.0'))
+# targetBytes 模式：质量搜索下限、结果落在预算的 (1 - TARGET_TOLERANCE) 以上即停止、最多缩放几轮、最小边长
+MIN_QUALITY = 10
+TARGET_TOLERANCE = 0.05
+MAX_SCALE_STEPS = 6
+MIN_SIDE = 16
+SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(b|kb|k|mb|m)?\s*$', re.IGNORECASE)
+
+
+def parse_bytes(value):
+    """字节预算：整数字节数，或带 KB / MB 单位（按 1024 换算），如 200KB"""
+    if value in (None, ''):
+        return None
+    match = SIZE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid targetBytes: {value}")
+    unit = (match.group(2) or 'b').lower()[0]
+    target = int(float(match.group(1)) * {'b': 1, 'k': 1024, 'm': 1024 * 1024}[unit])
+    if target < 512:
+        raise ValueError('targetBytes must be at least 512')
+    return target
+
+
+def parse_dimension(value, name: str):
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name}: {value}")
+    if not 0 < value <= MAX_DIMENSION:
+        raise ValueError(f"{name} must be a positive number between 1 and {MAX_DIMENSION}")
+    return value
+
+
+def parse_output(params: dict, resize: bool = False) -> dict:
+    """
+    校验一个输出配置，参数名与 Next.js 压缩路由一致：
+    quality（0.1-1.0）、format、maxWidth / maxHeight（只缩小）；
+    resize 模式为 width / height / maintainAspectRatio（可放大）；effort 为编码优化程度
+    """
+    fmt = (params.get('format') or 'jpeg').lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in FORMATS:
+        raise ValueError(f"Format must be one of: {', '.join(FORMATS)}")
+    target_bytes = parse_bytes(params.get('targetBytes'))
+    try:
+        # 指定字节预算时 quality 是搜索上限，默认尽量高
+        quality = float(params.get('quality') or (0.95 if target_bytes else 0.8))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid quality: {params.get('quality')}")
+    if not 0.1 <= quality <= 1.0:
+        raise ValueError('Quality must be a number between 0.1 and 1.0')
+    effort = (params.get('effort') or 'default').lower()
+    if effort not in EFFORT_LEVELS:
+        raise ValueError(f"Effort must be one of: {', '.join(EFFORT_LEVELS)}")
+
+    output = {'format': fmt, 'quality': round(quality * 100), 'effort': effort, 'target_bytes': target_bytes}
+    if resize:
+        output['width'] = parse_dimension(params.get('width'), 'width')
+        output['height'] = parse_dimension(params.get('height'), 'height')
+        if output['width'] is None and output['height'] is None:
+            raise ValueError('Provide width and/or height')
+        keep_aspect = params.get('maintainAspectRatio', True)
+        output['keep_aspect'] = str(keep_aspect).lower() not in ('false', '0', 'no')
+    else:
+        output['max_width'] = parse_dimension(params.get('maxWidth'), 'maxWidth')
+        output['max_height'] = parse_dimension(params.get('maxHeight'), 'maxHeight')
+    return output
+
+
+def target_size(size: tuple, output: dict) -> tuple:
+    """按输出配置计算目标尺寸；压缩模式只缩小，缩放模式按给定宽高（保持比例时放进该框内）"""
+    width, height = size
+    if 'max_width' in output:
+        scale = min(1.0, (output['max_width'] or width) / width, (output['max_height'] or height) / height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    target_w, target_h = output['width'], output['height']
+    if output['keep_aspect']:
+        scale = min(target_w / width if target_w else float('inf'), target_h / height if target_h else float('inf'),
+                    MAX_DIMENSION / width, MAX_DIMENSION / height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    return target_w or width, target_h or height
+
+
+def resize(image: Image.Image, size: tuple) -> Image.Image:
+    if image.size == size:
+        return image
+    with metrics.stage('resize'):
+        return image.resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+
+
+def encode(image: Image.Image, fmt: str, quality: int, effort: str = 'default') -> bytes:
+    """编码到内存缓冲区，返回字节"""
+    output = io.BytesIO()
+    if fmt == 'jpeg':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # JPEG 不支持透明，铺白底
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(output, 'JPEG', quality=quality, optimize=effort != 'fast', progressive=effort == 'max')
+    elif fmt == 'webp':
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+        image.save(output, 'WEBP', quality=quality, method={'fast': 0, 'default': 4, 'max': 6}[effort])
+    else:
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            image = image.convert('RGB')
+        image.save(output, 'PNG', compress_level={'fast': 1, 'default': 6, 'max': 9}[effort],
+                   optimize=effort == 'max')
+    return output.getvalue()
+
+
+def encode_to_target(image: Image.Image, fmt: str, target_bytes: int, max_quality: int = 95,
+                     effort: str = 'default') -> dict:
+    """
+    在 target_bytes 以内找最高质量的编码，所有尝试都从同一份像素（image）出发、编码到内存。
+    返回 {data, quality, width, height, passes, target_met}；缩到最小边长仍超出预算时返回最小的一次结果
+    """
+    passes = 0
+
+    def attempt(img, quality):
+        nonlocal passes
+        passes += 1
+        return encode(img, fmt, quality, effort)
+
+    def done(data, img, quality, met=True):
+        return {'data': data, 'quality': quality, 'width': img.width, 'height': img.height,
+                'passes': passes, 'target_met': met}
+
+    current = image
+    smallest = None
+    for _ in range(MAX_SCALE_STEPS):
+        if fmt == 'png':
+            # 无损格式没有质量可调，只能缩小
+            data = attempt(current, max_quality)
+            if len(data) <= target_bytes:
+                return done(data, current, max_quality)
+            low, low_quality = data, max_quality
+        else:
+            # 原尺寸先试上限质量（多数情况一次即可）；缩小后先试最低质量，确认缩放足够再搜索
+            low_quality = min(MIN_QUALITY, max_quality)
+            if current is image:
+                high = attempt(current, max_quality)
+                if len(high) <= target_bytes:
+                    return done(high, current, max_quality)
+                low = attempt(current, low_quality)
+            else:
+                low = attempt(current, low_quality)
+                if len(low) <= target_bytes:
+                    high = attempt(current, max_quality)
+                    if len(high) <= target_bytes:
+                        return done(high, current, max_quality)
+            if len(low) <= target_bytes:
+                # 区间 [lo, hi)：lo 满足预算、hi 超出；按 log(大小) 对质量线性插值取下一次尝试点，
+                # 插值点贴边时退回二分，避免凸曲线上一侧收敛过慢
+                lo, lo_size, best = low_quality, len(low), low
+                hi, hi_size = max_quality, len(high)
+                while hi - lo > 1 and lo_size < target_bytes * (1 - TARGET_TOLERANCE):
+                    ratio = (math.log(target_bytes) - math.log(lo_size)) / (math.log(hi_size) - math.log(lo_size))
+                    guess = lo + round((hi - lo) * ratio)
+                    if not lo + (hi - lo) // 4 <= guess <= hi - (hi - lo) // 4:
+                        guess = (lo + hi) // 2
+                    guess = min(max(guess, lo + 1), hi - 1)
+                    data = attempt(current, guess)
+                    if len(data) <= target_bytes:
+                        lo, lo_size, best = guess, len(data), data
+                    else:
+                        hi, hi_size = guess, len(data)
+                return done(best, current, lo)
+
+        if smallest is None or len(low) < len(smallest[0]):
+            smallest = (low, current, low_quality)
+        # 字节数大致与像素数成正比，按面积比例估算新尺寸并留 10% 余量
+        scale = math.sqrt(target_bytes / len(low)) * 0.9
+        if min(current.size) <= MIN_SIDE:
+            break
+        scale = max(scale, MIN_SIDE / min(current.size))
+        current = resize(image, (max(1, round(current.width * scale)), max(1, round(current.height * scale))))
+    data, img, quality = smallest
+    return done(data, img, quality, met=False)
+
+
+@metrics.timed('encode')
+def encode_output(image: Image.Image, output: dict) -> dict:
+    """按输出配置编码已缩放到目标尺寸的图像"""
+    if output.get('target_bytes'):
+        encoded = encode_to_target(image, output['format'], output['target_bytes'], output['quality'], output['effort'])
+    else:
+        data = encode(image, output['format'], output['quality'], output['effort'])
+        encoded = {'data': data, 'quality': output['quality'], 'width': image.width, 'height': image.height,
+                   'passes': 1}
+    return {
+        'format': output['format'],
+        'media_type': FORMATS[output['format']][1],
+        'effort': output['effort'],
+        'size': len(encoded['data']),
+        **({'target_bytes': output['target_bytes']} if output.get('target_bytes') else {}),
+        **encoded,
+    }
+
+
+def render(image: Image.Image, output: dict) -> dict:
+    """缩放并编码一张已解码的图像（例如换背景后的合成结果）"""
+    return encode_output(resize(image, target_size(image.size, output)), output)
+
+
+def process(image_bytes: bytes, outputs: list) -> dict:
+    """
+    按多个输出配置（parse_output 的结果）处理同一张图片：只解码一次，每种尺寸只缩放一次，并行编码
+    返回 {original: {width, height, size, format}, outputs: [encode_output 的结果, ...]}
+    """
+    header = check_image(image_bytes)
+    source_format = header.format
+    original = oriented_size(header)
+    # 超出像素预算的 JPEG 缩小解码，输出尺寸按解码后的尺寸计算
+    size = budget_size(header)
+    targets = [target_size(size, output) for output in outputs]
+    largest = max(targets, key=lambda s: s[0] * s[1])
+    # 有输出需要放大时不能缩小解码
+    draft_size = largest if largest[0] <= size[0] and largest[1] <= size[1] else None
+    with metrics.stage('decode'):
+        image = open_image(header, draft_size)
+
+    executor = get_executor()
+    sizes = list(dict.fromkeys(targets))
+    resized = dict(zip(sizes, executor.map(metrics.bind(lambda s: resize(image, s)), sizes)))
+    results = list(executor.map(metrics.bind(lambda item: encode_output(resized[item[1]], item[0])),
+                                zip(outputs, targets)))
+    return {
+        'original': {'width': original[0], 'height': original[1], 'size': len(image_bytes), 'format': source_format},
+        'outputs': results,
+    }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """缩放和编码共用的线程池，大小为 COMPRESS_THREADS（默认 CPU 核数）"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = int(os.environ.get('COMPRESS_THREADS', os.cpu_count() or 1))
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='compress')
+    return _executor
@@ -0,0 +1,130 @@
+"""
+证件照 - 先检测人脸，按标准证件照比例裁出头肩区域，只分割这一块，直接输出成片尺寸
+
+- 人脸检测用 OpenCV 自带的 Haar 级联（CPU，几毫秒），在缩小到 ID_PHOTO_DETECT_SIZE 以内的灰度图上进行；
+  有多张候选时取邻近检测数最多（最可信）的一张，检测不到时退化为原图中靠上居中的最大同比例区域
+- 裁剪框由人脸框推算：人脸框高度占成片高度的 ID_PHOTO_FACE_RATIO，人脸水平居中、位于成片上部，
+  上方留出头顶空白，下方带上肩膀；裁剪框超出原图的部分在合成时用背景填充
+- 裁剪区域在原图上直接缩放到成片尺寸再分割、合成，U²-Net 前后处理和合成的像素数与原图尺寸无关，
+  也不需要客户端再缩放一次
+"""
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+import metrics
+
+# 300 dpi 下的标准尺寸：一寸 25x35mm，二寸 35x49mm
+PRESETS = {'1inch': (295, 413), '2inch': (413, 579)}
+PRESET_ALIASES = {'1': '1inch', '2': '2inch', '1寸': '1inch', '2寸': '2inch', 'one-inch': '1inch', 'two-inch': '2inch'}
+DEFAULT_PRESET = os.environ.get('ID_PHOTO_PRESET', '1inch')
+# 人脸框（眉毛到下巴）高度占成片高度的比例，越大人像越大
+FACE_RATIO = float(os.environ.get('ID_PHOTO_FACE_RATIO', '0.42'))
+# 人脸框中心在成片高度上的位置（从上往下）
+FACE_CENTER_Y = 0.5
+# 人脸检测用的灰度图最长边
+DETECT_SIZE = int(os.environ.get('ID_PHOTO_DETECT_SIZE', '480'))
+
+
+def resolve_preset(preset: str = None) -> str:
+    """规范化尺寸名，不支持时抛出 ValueError"""
+    name = str(preset or DEFAULT_PRESET).strip().lower()
+    name = PRESET_ALIASES.get(name, name)
+    if name not in PRESETS:
+        raise ValueError(f"Unsupported size: {preset}. Choose one of: {', '.join(PRESETS)}")
+    return name
+
+
+_cascade = None
+_cascade_lock = threading.Lock()
+
+
+def get_cascade():
+    """返回进程级单例人脸检测器"""
+    global _cascade
+    if _cascade is None:
+        with _cascade_lock:
+            if _cascade is None:
+                import cv2
+                _cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades,
+                                                              'haarcascade_frontalface_default.xml'))
+    return _cascade
+
+
+@metrics.timed('detect')
+def detect_face(image: Image.Image):
+    """在缩小的灰度图上检测人脸，返回原图坐标下最可信的人脸框 (x, y, w, h)，没有时返回 None"""
+    import cv2
+
+    width, height = image.size
+    scale = min(1.0, DETECT_SIZE / max(width, height))
+    small = image
+    if scale < 1.0:
+        small = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR,
+                             reducing_gap=2.0)
+    gray = cv2.equalizeHist(np.asarray(small.convert('L')))
+    # 证件照的人脸不会太小，跳过小尺度的搜索
+    min_side = max(24, min(gray.shape) // 8)
+    cascade = get_cascade()
+    # 级联分类器不保证线程安全，串行执行
+    with _cascade_lock:
+        faces, neighbors = cascade.detectMultiScale2(gray, scaleFactor=1.15, minNeighbors=5,
+                                                     minSize=(min_side, min_side))
+    if len(faces) == 0:
+        return None
+    x, y, w, h = faces[int(np.argmax(neighbors))]
+    return tuple(round(float(v) / scale) for v in (x, y, w, h))
+
+
+def crop_box(size: tuple, face, target: tuple) -> tuple:
+    """按人脸框和成片比例计算裁剪框 (left, top, right, bottom)，可能超出原图"""
+    width, height = size
+    aspect = target[0] / target[1]
+    if face:
+        x, y, w, h = face
+        crop_h = h / FACE_RATIO
+        crop_w = crop_h * aspect
+        left = x + w / 2 - crop_w / 2
+        top = y + h / 2 - crop_h * FACE_CENTER_Y
+    else:
+        crop_w = min(width, height * aspect)
+        crop_h = crop_w / aspect
+        left = (width - crop_w) / 2
+        top = (height - crop_h) * 0.2
+    return round(left), round(top), round(left + crop_w), round(top + crop_h)
+
+
+def extract_roi(image: Image.Image, box: tuple, target: tuple):
+    """
+    把裁剪框内、原图范围内的部分缩放到成片坐标系。
+    返回 (缩放后的区域图像, 区域在成片中的 (left, top))；裁剪框与原图不相交时返回 (None, None)
+    """
+    left, top, right, bottom = box
+    clip = (max(0, left), max(0, top), min(image.width, right), min(image.height, bottom))
+    if clip[0] >= clip[2] or clip[1] >= clip[3]:
+        return None, None
+    scale_x, scale_y = target[0] / (right - left), target[1] / (bottom - top)
+    dest_left, dest_top = round((clip[0] - left) * scale_x), round((clip[1] - top) * scale_y)
+    dest_right = min(target[0], round((clip[2] - left) * scale_x))
+    dest_bottom = min(target[1], round((clip[3] - top) * scale_y))
+    size = (max(1, dest_right - dest_left), max(1, dest_bottom - dest_top))
+    with metrics.stage('resize'):
+        # 只读取裁剪框内的像素，不生成整幅中间图
+        region = image.resize(size, Image.LANCZOS, box=clip, reducing_gap=3.0)
+    if region.mode != 'RGB':
+        region = region.convert('RGB')
+    return region, (dest_left, dest_top)
+
+
+def place(region_rgb: np.ndarray, region_alpha: np.ndarray, offset: tuple, target: tuple) -> tuple:
+    """把区域像素和蒙版放进成片大小的画布，画布其余部分 alpha 为 0（合成时显示背景）"""
+    width, height = target
+    rgb = np.zeros((height, width, 3), dtype=np.uint8)
+    alpha = np.zeros((height, width), dtype=np.uint8)
+    left, top = offset
+    rows, cols = slice(top, top + region_rgb.shape[0]), slice(left, left + region_rgb.shape[1])
+    rgb[rows, cols] = region_rgb
+    alpha[rows, cols] = region_alpha
+    return rgb, alpha
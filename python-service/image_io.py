@@ -0,0 +1,111 @@
+"""
+图片解码 - 所有入口（抠图、证件照、OCR、压缩）共用，单次解码的内存有上限
+
+- 像素预算 MAX_IMAGE_PIXELS：先只读文件头取尺寸，超出预算的 JPEG 用 draft() 在 DCT 域按 1/2、1/4、1/8
+  缩小解码到预算以内；其他格式（PNG 解压炸弹等）无法缩小解码，直接拒绝，不分配像素内存
+- 调用方知道需要的尺寸时（target），JPEG 只解码到不小于该尺寸的最小缩放级别
+- 按 EXIF 方向原地摆正（没有方向标记时不复制整幅图像）
+- 只在模式不被调用方接受时才转换（例如分割只要 RGB，OCR 接受 RGB 和 L），不做多余的 RGBA 转换
+单次解码的像素内存约为 MAX_IMAGE_PIXELS x 通道数字节，可据此估算每个工作进程的峰值内存
+"""
+import io
+import os
+import sys
+
+from PIL import Image, ImageOps
+
+# 单张图片解码后的最大像素数（默认 4000 万，约 120MB RGB）
+MAX_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', str(40_000_000)))
+# EXIF 方向为这些值时图片需要旋转 90°，宽高互换
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+# JPEG draft() 支持的缩小倍数
+DRAFT_SCALES = (1, 2, 4, 8)
+
+
+class ImageTooLarge(ValueError):
+    """图片超出像素预算且无法缩小解码"""
+
+
+def orientation(image: Image.Image) -> int:
+    return image.getexif().get(0x0112, 1)
+
+
+def oriented_size(image: Image.Image) -> tuple:
+    """按 EXIF 方向校正后的尺寸（只读文件头，不解码像素）"""
+    if orientation(image) in TRANSPOSED_ORIENTATIONS:
+        return image.height, image.width
+    return image.size
+
+
+def budget_size(image: Image.Image, max_pixels: int = None) -> tuple:
+    """open_image 解码后的尺寸（摆正后的方向）：超出预算的 JPEG 为缩小解码后的尺寸，其余为原尺寸"""
+    width, height = oriented_size(image)
+    if image.format != 'JPEG':
+        return width, height
+    scale = draft_scale(image.size, None, max_pixels) or 1
+    return -(-width // scale), -(-height // scale)
+
+
+def open_header(source) -> Image.Image:
+    """只读文件头；source 为字节、文件路径或文件对象。Pillow 自身的解压炸弹检查也转换为 ImageTooLarge"""
+    try:
+        return Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+
+
+def draft_scale(size: tuple, target: tuple = None, max_pixels: int = None) -> int:
+    """
+    JPEG 的缩小倍数：在预算以内的最小倍数，与不小于 target 的最大倍数中取较大者；
+    缩小 8 倍仍超出预算时返回 0
+    """
+    width, height = size
+    max_pixels = max_pixels or MAX_PIXELS
+    budget = next((s for s in DRAFT_SCALES if -(-width // s) * -(-height // s) <= max_pixels), 0)
+    if not budget:
+        return 0
+    scale = budget
+    if target:
+        target_w, target_h = target
+        scale = max(scale, max((s for s in DRAFT_SCALES if width // s >= target_w and height // s >= target_h),
+                               default=1))
+    return scale
+
+
+def check_image(source, max_pixels: int = None) -> Image.Image:
+    """
+    只读文件头校验图片：无法识别时抛出 OSError 等 Pillow 异常，超出预算且不能缩小解码时抛出 ImageTooLarge。
+    返回未解码的图像
+    """
+    image = source if isinstance(source, Image.Image) else open_header(source)
+    width, height = image.size
+    limit = max_pixels or MAX_PIXELS
+    if width * height > limit and not (image.format == 'JPEG' and draft_scale(image.size, None, limit)):
+        raise ImageTooLarge(f"Image too large: {width}x{height} exceeds the {limit} pixel limit")
+    return image
+
+
+def open_image(source, target: tuple = None, modes: tuple = None, max_pixels: int = None) -> Image.Image:
+    """
+    在像素预算内解码并按 EXIF 方向摆正，返回已加载的图像。
+    source：字节、文件路径、文件对象或尚未加载的 PIL 图像；
+    target：需要的最小尺寸（摆正后的方向），JPEG 只解码到够用的分辨率；
+    modes：可接受的模式，其他模式转换为 modes[0]；为 None 时保持原模式
+    """
+    image = check_image(source, max_pixels)
+    if image.format == 'JPEG' and image.mode in ('RGB', 'L', 'CMYK'):
+        if target and orientation(image) in TRANSPOSED_ORIENTATIONS:
+            target = (target[1], target[0])
+        scale = draft_scale(image.size, target, max_pixels)
+        if scale > 1:
+            size = image.size
+            # draft() 选不小于请求尺寸的最大缩小倍数，按向下取整的尺寸请求才会正好落在 scale
+            image.draft(image.mode, (size[0] // scale, size[1] // scale))
+            if size[0] * size[1] > (max_pixels or MAX_PIXELS):
+                print(f"Image over pixel budget, decoding JPEG at 1/{scale}: {size} -> {image.size}", file=sys.stderr)
+    image.load()
+    if orientation(image) != 1:
+        ImageOps.exif_transpose(image, in_place=True)
+    if modes and image.mode not in modes:
+        image = image.convert(modes[0])
+    return image
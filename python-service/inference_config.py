@@ -0,0 +1,247 @@
+"""
+ONNX Runtime 会话参数 - OCR（RapidOCR）和抠图（rembg）共用的一套配置
+
+每项参数按以下顺序取值：引擎专属环境变量（OCR_ORT_* / REMBG_ORT_*）> 通用环境变量（ORT_*）> 引擎默认值。
+默认值与各引擎原来的行为一致（RapidOCR 关闭 CPU 内存池，rembg 使用 ONNX Runtime 默认值）。
+
+- ORT_INTRA_OP_THREADS: 单个算子内部的并行线程数；0 为 ONNX Runtime 默认（全部物理核），
+  auto 为 CPU 核数 / INFERENCE_CONCURRENCY，多个推理并发时避免每个会话都占满所有核
+- ORT_INTER_OP_THREADS: 算子之间的并行线程数，只在 parallel 执行模式下有意义（0 为默认）
+- ORT_GRAPH_OPTIMIZATION: 图优化级别 disable / basic / extended / all（默认 all）
+- ORT_CPU_MEM_ARENA: 是否启用 CPU 内存池，1 / 0（OCR 默认 0，抠图默认 1）
+- ORT_EXECUTION_MODE: sequential / parallel（默认 sequential）
+- ORT_OPTIMIZED_MODEL_DIR: 设置后把图优化后的模型保存到该目录，之后的进程直接加载优化后的模型
+
+INT8 量化模型由 quantize_models.py 生成，放在 QUANTIZED_MODEL_DIR（默认 ~/.photobox/quantized），
+文件名为 <模型名>.int8.onnx：抠图为 rembg 模型名（u2net.int8.onnx），OCR 为原模型文件名（ch_PP-OCRv4_det_infer.int8.onnx）
+"""
+import os
+import sys
+import hashlib
+import threading
+
+GRAPH_OPTIMIZATION_LEVELS = ('disable', 'basic', 'extended', 'all')
+EXECUTION_MODES = ('sequential', 'parallel')
+PRECISIONS = ('fp32', 'int8')
+# OCR 只量化检测和识别模型；方向分类模型很小，保持 fp32
+OCR_QUANTIZED_SECTIONS = ('Det', 'Rec')
+ENGINE_DEFAULTS = {
+    'ocr': {'CPU_MEM_ARENA': '0'},
+    'rembg': {'CPU_MEM_ARENA': '1'},
+}
+
+
+def cpu_count() -> int:
+    """当前进程可用的 CPU 核数（容器中会受 CPU 亲和性限制）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def concurrent_runs(engine: str) -> int:
+    """
+    同一个会话上最多同时推理的个数：并发数 x 单次推理的算子线程数不超过可用核数。
+    默认（算子线程数 0，占满所有核）为 1，即推理串行；ORT_INTRA_OP_THREADS=auto 时为 INFERENCE_CONCURRENCY
+    """
+    threads = load_config(engine)['intra_op_threads'] or cpu_count()
+    return max(1, cpu_count() // threads)
+
+
+def setting(engine: str, name: str, default: str = '') -> str:
+    for key in (f'{engine.upper()}_ORT_{name}', f'ORT_{name}'):
+        value = os.environ.get(key)
+        if value is not None and value.strip() != '':
+            return value.strip().lower()
+    return ENGINE_DEFAULTS.get(engine, {}).get(name, default)
+
+
+def parse_threads(value: str, name: str) -> int:
+    if value == 'auto':
+        concurrency = int(os.environ.get('INFERENCE_CONCURRENCY', cpu_count()))
+        return max(1, cpu_count() // max(1, concurrency))
+    try:
+        threads = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer or 'auto', got {value!r}")
+    if threads < 0:
+        raise ValueError(f"{name} must not be negative")
+    return threads
+
+
+def load_config(engine: str) -> dict:
+    """读取某个引擎的会话参数，非法取值抛出 ValueError"""
+    config = {
+        'intra_op_threads': parse_threads(setting(engine, 'INTRA_OP_THREADS', '0'), 'ORT_INTRA_OP_THREADS'),
+        'inter_op_threads': parse_threads(setting(engine, 'INTER_OP_THREADS', '0'), 'ORT_INTER_OP_THREADS'),
+        'graph_optimization': setting(engine, 'GRAPH_OPTIMIZATION', 'all'),
+        'cpu_mem_arena': setting(engine, 'CPU_MEM_ARENA', '1') in ('1', 'true', 'yes', 'on'),
+        'execution_mode': setting(engine, 'EXECUTION_MODE', 'sequential'),
+        'optimized_model_dir': os.environ.get(f'{engine.upper()}_ORT_OPTIMIZED_MODEL_DIR')
+        or os.environ.get('ORT_OPTIMIZED_MODEL_DIR') or None,
+    }
+    if config['graph_optimization'] not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"ORT_GRAPH_OPTIMIZATION must be one of: {', '.join(GRAPH_OPTIMIZATION_LEVELS)}")
+    if config['execution_mode'] not in EXECUTION_MODES:
+        raise ValueError(f"ORT_EXECUTION_MODE must be one of: {', '.join(EXECUTION_MODES)}")
+    return config
+
+
+def session_options(config: dict):
+    import onnxruntime as ort
+
+    levels = {
+        'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    options = ort.SessionOptions()
+    options.log_severity_level = 3
+    options.graph_optimization_level = levels[config['graph_optimization']]
+    options.enable_cpu_mem_arena = config['cpu_mem_arena']
+    options.execution_mode = (ort.ExecutionMode.ORT_PARALLEL if config['execution_mode'] == 'parallel'
+                              else ort.ExecutionMode.ORT_SEQUENTIAL)
+    if config['intra_op_threads']:
+        options.intra_op_num_threads = config['intra_op_threads']
+    if config['inter_op_threads']:
+        options.inter_op_num_threads = config['inter_op_threads']
+    return options
+
+
+def optimized_model_path(model_path: str, config: dict) -> str:
+    """优化后模型的缓存路径：源模型、优化级别或 ONNX Runtime 版本变化时自动换新文件"""
+    import onnxruntime as ort
+
+    stat = os.stat(model_path)
+    source = f"{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}:{ort.__version__}"
+    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(config['optimized_model_dir'], f"{stem}.{config['graph_optimization']}.{digest}.onnx")
+
+
+def create_session(model_path: str, engine: str, config: dict = None):
+    """按配置创建 InferenceSession；启用了 ORT_OPTIMIZED_MODEL_DIR 时优先加载已保存的优化模型"""
+    import onnxruntime as ort
+
+    config = config or load_config(engine)
+    options = session_options(config)
+    providers = ['CPUExecutionProvider']
+
+    if config['optimized_model_dir'] and config['graph_optimization'] != 'disable':
+        cached_path = optimized_model_path(model_path, config)
+        if os.path.exists(cached_path):
+            # 已经优化过，跳过加载时的图优化
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            return ort.InferenceSession(cached_path, sess_options=options, providers=providers)
+        os.makedirs(config['optimized_model_dir'], exist_ok=True)
+        temp_path = f"{cached_path}.{os.getpid()}.tmp"
+        options.optimized_model_filepath = temp_path
+        session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+        try:
+            os.replace(temp_path, cached_path)
+            print(f"Saved optimized model: {cached_path}", file=sys.stderr)
+        except OSError as e:
+            print(f"Could not save optimized model {cached_path}: {e}", file=sys.stderr)
+        return session
+
+    return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+
+
+def quantized_model_dir() -> str:
+    return os.environ.get('QUANTIZED_MODEL_DIR') or os.path.join(os.path.expanduser('~'), '.photobox', 'quantized')
+
+
+def quantized_model_path(name: str) -> str:
+    return os.path.join(quantized_model_dir(), f'{name}.int8.onnx')
+
+
+def split_precision(model_name: str) -> tuple:
+    """'u2net-int8' -> ('u2net', 'int8')，不带后缀为 fp32"""
+    base, _, suffix = model_name.rpartition('-')
+    if base and suffix in PRECISIONS:
+        return base, suffix
+    return model_name, 'fp32'
+
+
+def require_quantized(path: str):
+    if not os.path.exists(path):
+        raise ValueError(f"INT8 model not prepared: {path} (run python quantize_models.py)")
+
+
+def rembg_session(model_name: str):
+    """
+    创建 rembg 会话。rembg.new_session 不接受会话参数，
+    这里按它的方式找到会话类和模型文件，再用 create_session 创建底层 InferenceSession。
+    model_name 带 -int8 后缀时加载 quantize_models.py 生成的量化模型，前后处理与原模型相同
+    """
+    from rembg.sessions import sessions_class
+    from rembg.sessions.u2net import U2netSession
+
+    base_name, precision = split_precision(model_name)
+    session_class = next((sc for sc in sessions_class if sc.name() == base_name), U2netSession)
+    if precision == 'int8':
+        model_path = quantized_model_path(base_name)
+        require_quantized(model_path)
+    else:
+        model_path = str(session_class.download_models())
+    session = session_class.__new__(session_class)
+    session.model_name = base_name
+    session.providers = ['CPUExecutionProvider']
+    session.inner_session = create_session(model_path, 'rembg')
+    return session
+
+
+def rapidocr_model_paths(precision: str = 'fp32') -> dict:
+    """RapidOCR 各会话（Det / Cls / Rec）的模型文件；int8 时检测和识别换成量化模型"""
+    from rapidocr_onnxruntime.main import root_dir
+    from rapidocr_onnxruntime.utils import read_yaml, concat_model_path
+
+    model_config = concat_model_path(read_yaml(str(root_dir / 'config.yaml')))
+    paths = {section: model_config[section]['model_path'] for section in ('Det', 'Cls', 'Rec')}
+    if precision == 'int8':
+        for section in OCR_QUANTIZED_SECTIONS:
+            paths[section] = quantized_model_path(os.path.splitext(os.path.basename(paths[section]))[0])
+            require_quantized(paths[section])
+    return paths
+
+
+_rapidocr_lock = threading.Lock()
+
+
+def create_rapidocr(precision: str = 'fp32'):
+    """
+    按配置创建 RapidOCR，检测、方向分类、识别三个模型各只加载一次。
+    RapidOCR 只支持通过参数设置线程数，内存池、执行模式等只能换掉它内部的 InferenceSession：
+    构造期间把 rapidocr_onnxruntime.utils.InferenceSession 换成按 create_session 创建会话的函数，
+    int8 时直接加载量化模型（quantize_models.py 把识别模型的字符表复制到了量化模型的元数据中）
+    """
+    import rapidocr_onnxruntime.utils as rapidocr_utils
+    from rapidocr_onnxruntime import RapidOCR
+
+    config = load_config('ocr')
+    sources, paths = rapidocr_model_paths('fp32'), rapidocr_model_paths(precision)
+    targets = {str(sources[section]): str(paths[section]) for section in sources}
+
+    def inference_session(model_path, sess_options=None, providers=None):
+        return create_session(targets.get(str(model_path), str(model_path)), 'ocr', config)
+
+    # 替换的是模块属性，多个线程同时创建时串行执行
+    with _rapidocr_lock:
+        original = rapidocr_utils.InferenceSession
+        rapidocr_utils.InferenceSession = inference_session
+        try:
+            return RapidOCR()
+        finally:
+            rapidocr_utils.InferenceSession = original
+
+
+def describe() -> dict:
+    """各引擎生效的会话参数，用于健康检查"""
+    described = {}
+    for engine in ENGINE_DEFAULTS:
+        try:
+            described[engine] = load_config(engine)
+        except ValueError as e:
+            described[engine] = {'error': str(e)}
+    return described
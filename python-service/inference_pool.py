@@ -0,0 +1,83 @@
+"""
+推理线程池 - 限制 CPU 密集型推理的并发数
+
+最多同时运行 max_workers 个推理任务，另有 max_queue 个排队名额；
+超出后直接拒绝（QueueFullError），由 HTTP 层返回 503，避免请求无限堆积。
+"""
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import metrics
+
+
+class QueueFullError(Exception):
+    """推理队列已满"""
+
+
+class InferencePool:
+    def __init__(self, max_workers: int = None, max_queue: int = None):
+        # 多进程模式下线程只等待工作进程返回，线程数不少于工作进程数才能让每个进程都有活干
+        default_workers = max(os.cpu_count() or 1, int(os.environ.get('INFERENCE_WORKERS', '0')))
+        self.max_workers = max_workers or int(os.environ.get('INFERENCE_CONCURRENCY', default_workers))
+        self.max_queue = max_queue if max_queue is not None else int(os.environ.get('INFERENCE_QUEUE_SIZE', '16'))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='inference')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """正在运行和排队中的任务数"""
+        return self._pending
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+        }
+
+    def check_capacity(self):
+        """队列已满时抛出 QueueFullError，用于在开始流式响应前提前拒绝"""
+        if self._pending >= self.max_workers + self.max_queue:
+            raise QueueFullError("Inference queue is full, please retry later")
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                raise QueueFullError("Inference queue is full, please retry later")
+            self._pending += 1
+        try:
+            # 在提交方的上下文中执行，阶段耗时归到发起请求的路由
+            future = self._executor.submit(metrics.bind(fn), *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """在事件循环中等待推理结果，不阻塞循环本身"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> InferencePool:
+    """返回进程级单例线程池"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = InferencePool()
+    return _pool
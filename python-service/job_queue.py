@@ -0,0 +1,238 @@
+"""
+异步任务队列 - 提交后立即返回任务 ID，客户端轮询状态和结果，慢任务不再占住 HTTP 连接
+
+- 任务持久化在 SQLite（JOB_DB_PATH），服务重启后未完成的任务继续执行
+- 优先级：priority 越大越先执行，同优先级先进先出
+- 去重：按 (任务类型, 参数, 图片内容) 的哈希去重，排队中、执行中或结果未过期的相同任务直接返回已有任务
+- 重试：推理异常（非 4xx 业务错误）按 JOB_RETRY_DELAY * 2^(n-1) 秒退避重试，最多 JOB_MAX_ATTEMPTS 次
+- 结果保留 JOB_RESULT_TTL 秒，过期后连同任务记录一起删除
+- 执行复用推理线程池（inference_pool），与同步请求共享并发上限
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+from inference_pool import QueueFullError
+from result_cache import make_key
+
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+class JobQueue:
+    def __init__(self, path: str, runner, submit, concurrency: int = None):
+        """
+        runner(kind, image_bytes, params) 执行任务并返回 (结果字节, 媒体类型)，
+        submit(fn, *args) 返回 Future（通常是推理线程池）
+        """
+        self.path = path
+        self.runner = runner
+        self.submit = submit
+        self.concurrency = concurrency or int(os.environ.get('JOB_CONCURRENCY', '2'))
+        self.max_jobs = int(os.environ.get('JOB_QUEUE_MAX', '1000'))
+        self.max_attempts = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+        self.retry_delay = float(os.environ.get('JOB_RETRY_DELAY', '2'))
+        self.result_ttl = float(os.environ.get('JOB_RESULT_TTL', '3600'))
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._in_flight = 0
+        self._closed = False
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, kind TEXT NOT NULL, dedup_key TEXT NOT NULL, priority INTEGER NOT NULL, '
+            'status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, params TEXT NOT NULL, input BLOB, '
+            'result BLOB, media_type TEXT, error TEXT, created_at REAL NOT NULL, available_at REAL NOT NULL, '
+            'started_at REAL, finished_at REAL, expires_at REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs (dedup_key)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority DESC, created_at)')
+        # 上次退出时还在执行的任务重新排队（已计入一次尝试）
+        recovered = self._db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+        self._db.commit()
+        if recovered:
+            print(f"Requeued {recovered} interrupted jobs", file=sys.stderr)
+        self._thread = threading.Thread(target=self._dispatch, name='job-dispatcher', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, kind: str, image_bytes: bytes, params: dict = None, priority: int = 0) -> dict:
+        """提交任务，返回 {job_id, status, deduplicated}；队列已满时抛出 QueueFullError"""
+        params = params or {}
+        dedup_key = make_key(f'job:{kind}', image_bytes, params)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, priority FROM jobs WHERE dedup_key = ? AND status != 'failed' "
+                "AND (expires_at IS NULL OR expires_at > ?) ORDER BY created_at DESC LIMIT 1",
+                (dedup_key, now),
+            ).fetchone()
+            if row is not None:
+                job_id, status, current_priority = row
+                if status == 'queued' and priority > current_priority:
+                    self._db.execute('UPDATE jobs SET priority = ? WHERE id = ?', (priority, job_id))
+                    self._db.commit()
+                return {'job_id': job_id, 'status': status, 'deduplicated': True}
+
+            pending = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            if pending >= self.max_jobs:
+                raise QueueFullError("Job queue is full, please retry later")
+            job_id = uuid.uuid4().hex
+            self._db.execute(
+                'INSERT INTO jobs (id, kind, dedup_key, priority, status, params, input, created_at, available_at) '
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, dedup_key, priority, json.dumps(params), image_bytes, now, now),
+            )
+            self._db.commit()
+        self._wake.set()
+        return {'job_id': job_id, 'status': 'queued', 'deduplicated': False}
+
+    def get(self, job_id: str):
+        """任务状态（不含结果内容），不存在或已过期时返回 None"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT id, kind, priority, status, attempts, media_type, error, created_at, started_at, '
+                'finished_at, expires_at FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None or (row[10] is not None and row[10] <= time.time()):
+            return None
+        keys = ('job_id', 'kind', 'priority', 'status', 'attempts', 'media_type', 'error',
+                'created_at', 'started_at', 'finished_at', 'expires_at')
+        return dict(zip(keys, row))
+
+    def result(self, job_id: str):
+        """已完成任务的 (结果字节, 媒体类型)，未完成或不存在时返回 None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result, media_type FROM jobs WHERE id = ? AND status = 'done' AND expires_at > ?",
+                (job_id, time.time()),
+            ).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def pending_kinds(self) -> set:
+        """排队中的任务类型（启动时用于提前导入对应引擎）"""
+        with self._lock:
+            return {kind for (kind,) in self._db.execute("SELECT DISTINCT kind FROM jobs WHERE status = 'queued'")}
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return {
+            **{status: counts.get(status, 0) for status in STATUSES},
+            "in_flight": self._in_flight,
+            "concurrency": self.concurrency,
+            "max_jobs": self.max_jobs,
+        }
+
+    def _claim(self):
+        """取出优先级最高的一个可执行任务并标记为执行中"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, kind, params, input FROM jobs WHERE status = 'queued' AND available_at <= ? "
+                'ORDER BY priority DESC, created_at LIMIT 1', (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?",
+                (now, row[0]),
+            )
+            self._db.commit()
+        return row[0], row[1], json.loads(row[2]), bytes(row[3])
+
+    def _release(self, job_id: str):
+        """推理池已满，任务放回队列，不计入尝试次数"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1 WHERE id = ?", (job_id,))
+            self._db.commit()
+
+    def _finish(self, job_id: str, future):
+        from service import ServiceError
+
+        now = time.time()
+        try:
+            result, media_type = future.result()
+            update = ("UPDATE jobs SET status = 'done', result = ?, media_type = ?, error = NULL, input = NULL, "
+                      'finished_at = ?, expires_at = ? WHERE id = ?',
+                      (result, media_type, now, now + self.result_ttl, job_id))
+        except Exception as e:
+            message = e.message if isinstance(e, ServiceError) else str(e) or type(e).__name__
+            with self._lock:
+                attempts = self._db.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+            permanent = isinstance(e, ServiceError) and e.status_code < 500
+            if permanent or attempts >= self.max_attempts:
+                update = ("UPDATE jobs SET status = 'failed', error = ?, input = NULL, finished_at = ?, "
+                          'expires_at = ? WHERE id = ?', (message, now, now + self.result_ttl, job_id))
+            else:
+                delay = self.retry_delay * 2 ** (attempts - 1)
+                print(f"Job {job_id} failed (attempt {attempts}), retrying in {delay:.0f}s: {message}", file=sys.stderr)
+                update = ("UPDATE jobs SET status = 'queued', error = ?, available_at = ? WHERE id = ?",
+                          (message, now + delay, job_id))
+        with self._lock:
+            self._db.execute(*update)
+            self._db.commit()
+            self._in_flight -= 1
+        self._wake.set()
+
+    def _purge(self):
+        with self._lock:
+            removed = self._db.execute('DELETE FROM jobs WHERE expires_at <= ?', (time.time(),)).rowcount
+            self._db.commit()
+        return removed
+
+    def _dispatch(self):
+        """后台线程：有空闲名额时按优先级取任务交给推理线程池；空闲时清理过期任务"""
+        last_purge = 0
+        while not self._closed:
+            self._wake.clear()
+            if time.monotonic() - last_purge > 60:
+                self._purge()
+                last_purge = time.monotonic()
+            if self._in_flight >= self.concurrency:
+                self._wake.wait(1.0)
+                continue
+            job = self._claim()
+            if job is None:
+                self._wake.wait(1.0)
+                continue
+            job_id, kind, params, image_bytes = job
+            with self._lock:
+                self._in_flight += 1
+            try:
+                future = self.submit(self.runner, kind, image_bytes, params)
+            except QueueFullError:
+                with self._lock:
+                    self._in_flight -= 1
+                self._release(job_id)
+                self._wake.wait(0.5)
+                continue
+            future.add_done_callback(lambda f, job_id=job_id: self._finish(job_id, f))
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """返回进程级单例任务队列，JOB_DB_PATH 为 SQLite 文件路径（设为 :memory: 则不持久化）"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                from service import run_job
+                from inference_pool import get_pool
+
+                _queue = JobQueue(os.environ.get('JOB_DB_PATH', 'jobs.db'), run_job, get_pool().submit)
+    return _queue
@@ -1,10 +1,51 @@
-# 腾讯云云函数入口文件 - 简化测试版本
+# 腾讯云云函数入口文件 - 适配 service.py 中的核心逻辑
+# 直接运行 python main.py 时启动 FastAPI 服务（app.py）
+import os
 import json
+import base64
+from urllib.parse import unquote
+
+import service
+import metrics
+import startup
+import worker_pool
+from inference_pool import get_pool, QueueFullError
+
+def initializer(context):
+    """
+    云函数初始化入口（函数配置中的"初始化入口"设为 main.initializer）
+    在实例初始化阶段导入引擎并加载、预热模型，首个请求不再承担这部分耗时；
+    多进程模式（INFERENCE_WORKERS > 0）下改为启动推理工作进程
+    """
+    if worker_pool.enabled():
+        worker_pool.get_worker_pool()
+    else:
+        startup.preload()
+
+# 指标的路由标签，按路径后缀匹配（与 dispatch 的路由一致）
+ROUTES = ('/ocr/batch', '/ocr', '/index/search', '/index', '/remove-background/variants', '/remove-background',
+          '/id-photo', '/compress', '/resize', '/metrics')
+
+def route_name(method, path):
+    if method == 'OPTIONS':
+        return 'preflight'
+    if path in ('/', '/health'):
+        return path
+    if method == 'DELETE' and '/index/' in path:
+        return '/index/{image_id}'
+    return next((route for route in ROUTES if path.endswith(route)), 'unmatched')
 
 def handler(event, context):
     """
     腾讯云云函数入口 - 支持HTTP触发器
+    每个请求记录耗时和各阶段耗时（见 metrics），并输出一行 JSON 日志
     """
+    with metrics.request(route_name(event.get('httpMethod', 'POST'), event.get('path', '/'))) as outcome:
+        response = dispatch(event)
+        outcome['status'] = response.get('statusCode', 200)
+        return response
+
+def dispatch(event):
     try:
         # 处理OPTIONS预检请求（CORS）
         if event.get('httpMethod') == 'OPTIONS':
@@ -19,13 +60,8 @@ def handler(event, context):
                 'body': ''
             }
         
-        # 解析事件数据
-        body = {}
-        if 'body' in event and event['body']:
-            if isinstance(event['body'], str):
-                body = json.loads(event['body'])
-            else:
-                body = event['body']
+        # 解析事件数据（请求体保持为原始字节，由 service 按 Content-Type 解析）
+        request = read_event(event)
         
         # 获取请求方法和路径
         method = event.get('httpMethod', 'POST')
@@ -49,9 +85,31 @@ def handler(event, context):
         
         # 根据路径路由到不同的处理函数
         if path == '/ocr' or path.endswith('/ocr'):
-            return handle_ocr(body)
+            return handle_ocr(request)
+        elif path.endswith('/ocr/batch'):
+            return handle_ocr_batch(request)
+        elif path.endswith('/index/search'):
+            return handle_search_index(request)
+        elif method == 'DELETE' and '/index/' in path:
+            return handle_remove_from_index(unquote(path.rsplit('/index/', 1)[1]))
+        elif path.endswith('/index'):
+            return handle_index_image(request)
+        elif path.endswith('/remove-background/variants'):
+            return handle_remove_background_variants(request)
         elif path == '/remove-background' or path.endswith('/remove-background'):
-            return handle_remove_background(body)
+            return handle_remove_background(request)
+        elif path.endswith('/id-photo'):
+            return handle_id_photo(request)
+        elif path.endswith('/compress'):
+            return handle_compress(request, resize=False)
+        elif path.endswith('/resize'):
+            return handle_compress(request, resize=True)
+        elif path.endswith('/metrics'):
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'text/plain; version=0.0.4'},
+                'body': service.metrics_text()
+            }
         else:
             return {
                 'statusCode': 404,
@@ -74,82 +132,188 @@ def handler(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
-def handle_ocr(body):
-    """处理 OCR 请求 - 简化版本"""
+def read_event(event):
+    """从 API 网关事件中取出 (Content-Type, 请求体字节, 查询参数)"""
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    content_type = headers.get('content-type', 'application/json')
+    query = event.get('queryString') or event.get('queryStringParameters') or {}
+
+    body = event.get('body') or b''
+    if isinstance(body, dict):
+        body = json.dumps(body).encode('utf-8')
+        content_type = 'application/json'
+    elif event.get('isBase64Encoded'):
+        # 二进制请求体由 API 网关以 Base64 传入
+        body = base64.b64decode(body)
+    elif isinstance(body, str):
+        body = body.encode('utf-8')
+    return content_type, body, query
+
+def json_response(status_code, payload):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(payload)
+    }
+
+def run_inference(fn, *args, **kwargs):
+    """与 HTTP 服务共用同一个有界推理线程池"""
     try:
-        # 获取图片数据
-        image_data = body.get('image')
-        if not image_data:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': False, 'error': 'No image data provided'})
-            }
-        
-        # 简化处理：返回模拟结果
+        return get_pool().submit(fn, *args, **kwargs).result()
+    except QueueFullError as e:
+        raise service.ServiceError(503, str(e))
+
+def handle_ocr(request):
+    """处理 OCR 请求"""
+    try:
+        image_bytes, params = service.parse_image_request(*request)
+        return json_response(200, run_inference(service.ocr, image_bytes, **service.ocr_params(params)))
+    except service.ServiceError as e:
+        return json_response(e.status_code, {'success': False, 'error': e.message})
+    except Exception as e:
+        return json_response(500, {'success': False, 'error': str(e)})
+
+def handle_ocr_batch(request):
+    """批量 OCR；云函数不支持流式响应，整批完成后一次返回 NDJSON"""
+    try:
+        images, _ = service.parse_batch_request(*request)
+        lines = service.ocr_batch(images, get_pool().submit)
         return {
             'statusCode': 200,
             'headers': {
-                'Content-Type': 'application/json',
+                'Content-Type': 'application/x-ndjson',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
-                'success': True,
-                'text': 'OCR功能测试成功 - 这是模拟的识别结果',
-                'confidence': 0.95
-            })
+            'body': ''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines)
         }
-        
+    except service.ServiceError as e:
+        return json_response(e.status_code, {'success': False, 'error': e.message})
+    except Exception as e:
+        return json_response(500, {'success': False, 'error': str(e)})
+
+def handle_index_image(request):
+    """把图片的 OCR 结果加入关键词索引"""
+    try:
+        params = service.index_request(*request)
+        return json_response(200, run_inference(service.index_image, **params))
+    except service.ServiceError as e:
+        return json_response(e.status_code, {'success': False, 'error': e.message})
+    except Exception as e:
+        return json_response(500, {'success': False, 'error': str(e)})
+
+def handle_search_index(request):
+    """关键词搜索，参数 q、limit 放在查询字符串"""
+    try:
+        query = request[2]
+        return json_response(200, service.search_index(query.get('q'), query.get('limit', 20)))
+    except service.ServiceError as e:
+        return json_response(e.status_code, {'success': False, 'error': e.message})
+    except Exception as e:
+        return json_response(500, {'success': False, 'error': str(e)})
+
+def handle_remove_from_index(key):
+    try:
+        return json_response(200, service.remove_from_index(key))
+    except service.ServiceError as e:
+        return json_response(e.status_code, {'success': False, 'error': e.message})
     except Exception as e:
+        return json_response(500, {'success': False, 'error': str(e)})
+
+def handle_remove_background(request):
+    """处理背景移除请求，返回 PNG（API 网关按 isBase64Encoded 解码为二进制）"""
+    try:
+        image_bytes, params = service.parse_image_request(*request)
+        output = service.output_params(params)
+        startup.require('rembg')
+        headers = {
+            'Content-Type': 'image/png',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'X-Image-Id',
+            'X-Image-Id': service.image_id(image_bytes)
+        }
+        if output:
+            # 换背景后直接编码为指定格式 / 字节预算
+            result = run_inference(service.remove_background_as, image_bytes, output, **service.background_params(params))
+            extra = service.compress_headers({'original': {'size': len(image_bytes)}, 'outputs': [result]})
+            headers.update(extra)
+            headers['Content-Type'] = result['media_type']
+            headers['Access-Control-Expose-Headers'] = ', '.join(['X-Image-Id', *extra])
+            data = result['data']
+        else:
+            data = run_inference(service.remove_background, image_bytes, **service.background_params(params))
         return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'success': False, 'error': str(e)})
+            'statusCode': 200,
+            'isBase64Encoded': True,
+            'headers': headers,
+            'body': base64.b64encode(data).decode('ascii')
         }
+    except service.ServiceError as e:
+        return json_response(e.status_code, {'success': False, 'error': e.message})
+    except Exception as e:
+        return json_response(500, {'success': False, 'error': str(e)})
 
-def handle_remove_background(body):
-    """处理背景移除请求 - 简化版本"""
+def handle_remove_background_variants(request):
+    """同一张图片一次分割，返回多种背景色的结果"""
     try:
-        # 获取图片数据和背景色
-        image_data = body.get('image')
-        background_color = body.get('backgroundColor', '#FFFFFF')
-        
-        if not image_data:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': False, 'error': 'No image data provided'})
-            }
-        
-        # 简化处理：返回模拟结果
+        params = service.variants_request(*request)
+        startup.require('rembg')
+        return json_response(200, run_inference(service.background_variants, **params))
+    except service.ServiceError as e:
+        return json_response(e.status_code, {'success': False, 'error': e.message})
+    except Exception as e:
+        return json_response(500, {'success': False, 'error': str(e)})
+
+def handle_id_photo(request):
+    """证件照：按人脸裁剪、换背景，返回成片尺寸的图片"""
+    try:
+        image_bytes, params = service.parse_image_request(*request)
+        output = service.output_params(params)
+        startup.require('rembg')
+        result = run_inference(service.id_photo, image_bytes, output=output, **service.id_photo_params(params))
+        headers = service.id_photo_headers(result)
         return {
             'statusCode': 200,
+            'isBase64Encoded': True,
             'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
+                'Content-Type': result['media_type'],
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': ', '.join(headers),
+                **headers
             },
-            'body': json.dumps({
-                'success': True,
-                'message': '背景移除功能测试成功',
-                'backgroundColor': background_color
-            })
+            'body': base64.b64encode(result['data']).decode('ascii')
         }
-            
+    except service.ServiceError as e:
+        return json_response(e.status_code, {'success': False, 'error': e.message})
     except Exception as e:
+        return json_response(500, {'success': False, 'error': str(e)})
+
+def handle_compress(request, resize):
+    """压缩 / 缩放；单个输出直接返回图片，多个输出返回 JSON"""
+    try:
+        params = service.compress_request(*request, resize=resize)
+        result = run_inference(service.compress, params['image_bytes'], params['outputs'])
+        if params['multiple']:
+            return json_response(200, service.compress_json(result))
+        output = result['outputs'][0]
         return {
-            'statusCode': 500,
+            'statusCode': 200,
+            'isBase64Encoded': True,
             'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
+                'Content-Type': output['media_type'],
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': ', '.join(service.compress_headers(result)),
+                **service.compress_headers(result)
             },
-            'body': json.dumps({'success': False, 'error': str(e)})
-        }
\ No newline at end of file
+            'body': base64.b64encode(output['data']).decode('ascii')
+        }
+    except service.ServiceError as e:
+        return json_response(e.status_code, {'success': False, 'error': e.message})
+    except Exception as e:
+        return json_response(500, {'success': False, 'error': str(e)})
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('app:app', host='0.0.0.0', port=int(os.environ.get('PORT', '8000')))
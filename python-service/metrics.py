@@ -0,0 +1,256 @@
+"""
+运行指标 - 分阶段计时、每个请求一行 JSON 日志，以及 Prometheus 文本格式的 /metrics
+
+- 阶段：io（读请求体、磁盘缓存）、decode、hash（近似重复指纹）、detect（人脸检测）、model_load、inference、
+  resize、composite、encode
+- 当前路由和本次请求的阶段耗时放在 contextvars 里：推理线程池提交任务时复制上下文，
+  推理工作进程把子进程里的阶段耗时随结果传回（collect / merge），阶段都能归到发起它的路由上
+- 请求结束时输出一行 JSON 到 stderr（METRICS_LOG=off 关闭），包含状态码、总耗时和各阶段耗时；
+  并行执行的阶段（例如多个输出同时编码）按各线程耗时累加
+- 不依赖 prometheus_client，直方图和计数器在进程内累计，/metrics 时渲染
+"""
+import os
+import sys
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+# 秒；覆盖从几毫秒的解码到几十秒的冷启动推理
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LOG_FORMAT = os.environ.get('METRICS_LOG', 'json').lower()
+# 不输出请求日志的路由（健康检查、抓取指标）
+QUIET_ROUTES = {'/', '/health', '/metrics'}
+
+# 不属于任何请求的工作（预热、任务调度线程、工作进程启动）记在这个路由下
+_route = contextvars.ContextVar('metrics_route', default='background')
+_trace = contextvars.ContextVar('metrics_trace', default=None)
+_lock = threading.Lock()
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self._values = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with _lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{format_labels(self.labels, labels)} {format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels=(), buckets=BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help_text, tuple(labels), tuple(buckets)
+        self._series = {}  # labels -> [每个桶的计数（不累计）..., 总和, 次数]
+
+    def observe(self, labels: tuple, value: float):
+        with _lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with _lock:
+            snapshot = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, labels)} {series[-2]!r}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, labels)} {series[-1]}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('photobox_request_duration_seconds', 'Request latency by route', ('route',))
+REQUESTS = Counter('photobox_requests_total', 'Requests by route and status code', ('route', 'status'))
+STAGE_SECONDS = Histogram('photobox_stage_duration_seconds', 'Pipeline stage latency by route', ('route', 'stage'))
+MODEL_LOADS = Counter('photobox_model_loads_total', 'Model sessions loaded (including in worker processes)',
+                      ('engine', 'model'))
+OCR_PATHS = Counter('photobox_ocr_path_total',
+                    'OCR passes by path (blank, no_text, upright, flipped, per_box, skipped)', ('path',))
+OCR_EXIF_ROTATED = Counter('photobox_ocr_exif_rotated_total', 'OCR inputs rotated according to EXIF orientation')
+NEAR_DUPLICATES = Counter('photobox_near_duplicate_total',
+                          'Near-duplicate lookups after an exact cache miss by kind and outcome (reused, rejected, miss)',
+                          ('kind', 'outcome'))
+REGISTRY = (REQUEST_SECONDS, REQUESTS, STAGE_SECONDS, MODEL_LOADS, OCR_PATHS, OCR_EXIF_ROTATED, NEAR_DUPLICATES)
+COUNTERS = {metric.name: metric for metric in REGISTRY if isinstance(metric, Counter)}
+
+
+def new_trace() -> dict:
+    return {'stages': {}, 'model_loads': [], 'counts': []}
+
+
+def record(stage_name: str, seconds: float):
+    """记录一个阶段的耗时：计入当前路由的直方图，并累加到当前请求的阶段耗时"""
+    STAGE_SECONDS.observe((_route.get(), stage_name), seconds)
+    trace = _trace.get()
+    if trace is not None:
+        with _lock:
+            trace['stages'][stage_name] = trace['stages'].get(stage_name, 0.0) + seconds
+
+
+@contextmanager
+def stage(stage_name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage_name, time.perf_counter() - start)
+
+
+def timed(stage_name: str):
+    """把整个函数计为一个阶段的装饰器"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def model_loaded(engine: str, model: str, seconds: float):
+    """加载了一个模型会话"""
+    MODEL_LOADS.inc((engine, model))
+    record('model_load', seconds)
+    trace = _trace.get()
+    if trace is not None:
+        trace['model_loads'].append([engine, model, round(seconds * 1000, 1)])
+
+
+def count(counter: Counter, labels: tuple = (), amount: float = 1):
+    """计数；在推理工作进程中计的数随阶段耗时一起传回主进程（merge）"""
+    counter.inc(labels, amount)
+    trace = _trace.get()
+    if trace is not None:
+        with _lock:
+            trace['counts'].append([counter.name, list(labels), amount])
+
+
+@contextmanager
+def collect():
+    """在当前上下文中单独收集阶段耗时（推理工作进程执行任务时使用），交给主进程的 merge 计入"""
+    trace = new_trace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+def merge(trace: dict):
+    """把工作进程传回的阶段耗时和模型加载计入当前路由和请求"""
+    if not trace:
+        return
+    for stage_name, seconds in trace['stages'].items():
+        if stage_name != 'model_load':
+            record(stage_name, seconds)
+    for engine, model, ms in trace['model_loads']:
+        model_loaded(engine, model, ms / 1000)
+    for name, labels, amount in trace['counts']:
+        count(COUNTERS[name], tuple(labels), amount)
+
+
+def bind(fn):
+    """让提交到其他线程池的函数在当前上下文（路由、请求阶段）中执行"""
+    context = contextvars.copy_context()
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        # 同一个 Context 不能在多个线程中同时进入，每次调用用一份副本
+        return context.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+def log(entry: dict):
+    if LOG_FORMAT == 'json':
+        print(json.dumps(entry, ensure_ascii=False), file=sys.stderr, flush=True)
+
+
+@contextmanager
+def request(route: str, event: str = 'request'):
+    """
+    包住一次请求（或一个异步任务）：设置路由标签，结束时记录总耗时、状态码并输出 JSON 日志。
+    产生的 dict 中可写入 status（响应状态码）；抛出异常时取 ServiceError 的状态码，否则为 500
+    """
+    trace = new_trace()
+    route_token, trace_token = _route.set(route), _trace.set(trace)
+    outcome = {'status': 200}
+    start = time.perf_counter()
+    try:
+        yield outcome
+    except BaseException as e:
+        outcome['status'] = getattr(e, 'status_code', 500)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _trace.reset(trace_token)
+        _route.reset(route_token)
+        REQUEST_SECONDS.observe((route,), elapsed)
+        REQUESTS.inc((route, str(outcome['status'])))
+        if route not in QUIET_ROUTES:
+            entry = {
+                'ts': round(time.time(), 3),
+                'event': event,
+                'route': route,
+                'status': outcome['status'],
+                'duration_ms': round(elapsed * 1000, 1),
+                'stages': {name: round(seconds * 1000, 1) for name, seconds in trace['stages'].items()},
+            }
+            if trace['model_loads']:
+                entry['model_loads'] = trace['model_loads']
+            log(entry)
+
+
+def snapshot(name: str, help_text: str, samples, labels=(), kind: str = 'gauge') -> list:
+    """
+    渲染调用方在抓取时读到的值（队列深度、内存、缓存命中数等）；
+    samples 为 [(标签值元组, 数值), ...]，无标签时可直接传数值。累计值用 kind='counter'
+    """
+    if not isinstance(samples, list):
+        samples = [((), samples)]
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    for values, value in samples:
+        lines.append(f'{name}{format_labels(labels, values)} {format_value(value)}')
+    return lines
+
+
+def render(extra=()) -> str:
+    """Prometheus 文本格式；extra 为调用方采集的即时值（snapshot 的结果）"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for block in extra:
+        lines.extend(block)
+    return '\n'.join(lines) + '\n'
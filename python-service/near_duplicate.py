@@ -0,0 +1,297 @@
+"""
+近似重复图片索引 - 同一张照片被缩放、转成 WebP 或重新保存后字节不同，内容哈希缓存命中不了，
+用感知哈希找到之前处理过的原图，复用它的 OCR 结果或抠图蒙版（按尺寸缩放），不再重新推理
+
+- 指纹：64 位 pHash（32x32 灰度图 DCT 的低频 8x8 与中位数比较）和 64 位 dHash（9x8 灰度图相邻像素比较），
+  另存一张灰度校验图（放在结果缓存里，随缓存淘汰）：抠图最长边 VERIFY_SIZE，OCR 最长边 TEXT_VERIFY_SIZE
+- 查找：pHash 建 BK 树，按汉明距离找 NEAR_DUP_DISTANCE 以内的候选，dHash 也必须在阈值内、宽高比一致，
+  且两张图的尺寸相差不超过 2 倍（更小的图已分辨不出单个字符，无法校验）
+- 校验：较大的校验图按几种常见的缩放算法分别缩到较小的尺寸，与较小的一张逐 6 像素块比较平均灰度差，
+  任一种算法下最大块差不超过 NEAR_DUP_BLOCK_DIFF 才算通过。感知哈希对整体结构敏感、对局部细节不敏感，
+  同一模板的两张单据哈希完全相同，只有改了字的那一块差异明显；按上传方可能用的缩放算法对齐，
+  重采样造成的边缘差异才不会盖过改动一个字符的差异（benchmarks/bench_near_duplicate.py）
+- OCR 默认不复用（NEAR_DUP_OCR=off）：误判时返回的是另一张单据的文字和数字，只在确认可以接受时打开
+- 索引只在主进程内存中，按插入顺序最多保留 NEAR_DUP_MAX_ENTRIES 条；原结果已被缓存淘汰时候选作废
+"""
+import io
+import os
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+import metrics
+
+OFF_VALUES = ('0', 'off', 'false', 'no')
+ENABLED = os.environ.get('NEAR_DUP', 'on').strip().lower() not in OFF_VALUES
+# OCR 结果的复用需要单独打开
+OCR_ENABLED = os.environ.get('NEAR_DUP_OCR', 'off').strip().lower() not in OFF_VALUES
+# pHash / dHash 的最大汉明距离（64 位中）
+MAX_DISTANCE = int(os.environ.get('NEAR_DUP_DISTANCE', '6'))
+# 校验时允许的最大分块平均灰度差（0-255）。缩放 / 转码后的同一张图在 7 以内，
+# 同一模板的单据改了一个数字时改动处的块在 13 以上（缩小一半后）到 100 左右（原尺寸）
+MAX_BLOCK_DIFF = float(os.environ.get('NEAR_DUP_BLOCK_DIFF', '9'))
+MAX_ENTRIES = int(os.environ.get('NEAR_DUP_MAX_ENTRIES', '10000'))
+# 校验图的最长边：抠图只需确认是同一张照片；OCR 需要在原分辨率附近逐字比较
+VERIFY_SIZE = 768
+TEXT_VERIFY_SIZE = 2048
+# 比较的分块边长，约为缩小一半后一个字符的宽度
+VERIFY_BLOCK = 6
+# 两张图的尺寸之比不低于该值才校验：缩小到一半以下时数字的笔画差异已不比重采样误差大
+MIN_SCALE = 0.5
+# 宽高比（取对数）最多相差多少仍视为同一张图
+MAX_ASPECT_DELTA = 0.02
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def bits(values: np.ndarray) -> int:
+    return int(''.join('1' if v else '0' for v in values.ravel()), 2)
+
+
+class Fingerprint:
+    """一张图片的感知哈希、尺寸和校验缩略图"""
+
+    def __init__(self, phash: int, dhash: int, size: tuple, thumb: np.ndarray):
+        self.phash, self.dhash, self.size, self.thumb = phash, dhash, tuple(size), thumb
+
+    @classmethod
+    def of(cls, image: Image.Image, size: tuple = None, verify_size: int = VERIFY_SIZE):
+        """
+        由已解码的图像计算指纹；size 为结果坐标所在的尺寸（默认为图像尺寸），verify_size 为校验图的最长边。
+        先缩小再转灰度，不在原图分辨率上做任何转换
+        """
+        import cv2
+
+        width, height = image.size
+        scale = min(1.0, verify_size / max(width, height))
+        small = image
+        if scale < 1.0:
+            small = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR,
+                                 reducing_gap=2.0)
+        thumb = np.asarray(small.convert('L') if small.mode != 'L' else small)
+        square = cv2.resize(thumb, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+        low = cv2.dct(square)[:8, :8]
+        phash = bits(low > np.median(low.ravel()[1:]))
+        row = cv2.resize(thumb, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+        dhash = bits(row[:, 1:] > row[:, :-1])
+        return cls(phash, dhash, size or (width, height), thumb)
+
+    def thumb_bytes(self) -> bytes:
+        output = io.BytesIO()
+        Image.fromarray(self.thumb).save(output, 'PNG', compress_level=1)
+        return output.getvalue()
+
+
+def resamplers():
+    """校验时尝试的缩放算法：OpenCV 和 Pillow 的常用算法，覆盖压缩页面、浏览器和图片工具的缩放结果"""
+    import cv2
+
+    def cv_resize(interpolation):
+        return lambda pixels, size: cv2.resize(pixels, size, interpolation=interpolation)
+
+    def pil_resize(resample):
+        return lambda pixels, size: np.asarray(Image.fromarray(pixels).resize(size, resample))
+
+    return (cv_resize(cv2.INTER_AREA), pil_resize(Image.BILINEAR), pil_resize(Image.BICUBIC),
+            pil_resize(Image.LANCZOS), pil_resize(Image.BOX), cv_resize(cv2.INTER_LINEAR), cv_resize(cv2.INTER_CUBIC))
+
+
+def block_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    两张灰度校验图在较小尺寸上、轻微模糊去掉压缩噪声后，分块平均差的最大值。
+    较大的一张依次用各种缩放算法缩小，取最小的结果（上传方用的算法下差异最小）
+    """
+    import cv2
+
+    if a.size > b.size:
+        a, b = b, a
+    small = cv2.GaussianBlur(a, (3, 3), 0)
+    rows, cols = max(1, math.ceil(a.shape[0] / VERIFY_BLOCK)), max(1, math.ceil(a.shape[1] / VERIFY_BLOCK))
+    best = None
+    for resize in (resamplers() if a.shape != b.shape else (None,)):
+        large = cv2.GaussianBlur(resize(b, (a.shape[1], a.shape[0])) if resize else b, (3, 3), 0)
+        diff = cv2.absdiff(small, large).astype(np.float32)
+        score = float(cv2.resize(diff, (cols, rows), interpolation=cv2.INTER_AREA).max())
+        best = score if best is None else min(best, score)
+    return best
+
+
+def comparable(a: tuple, b: tuple) -> bool:
+    """两张图的尺寸相差不超过 1 / MIN_SCALE 倍"""
+    return min(a[0], b[0]) >= max(a[0], b[0]) * MIN_SCALE
+
+
+class Entry:
+    def __init__(self, group: str, fingerprint: Fingerprint, result_key: str, thumb_key: str, image_id: str):
+        self.group, self.result_key, self.thumb_key, self.image_id = group, result_key, thumb_key, image_id
+        self.phash, self.dhash, self.size = fingerprint.phash, fingerprint.dhash, fingerprint.size
+        self.removed = False
+
+
+class Match:
+    """校验通过的近似重复：原结果（缓存中的字节）、原图尺寸和 ID、哈希距离和最大块差"""
+
+    def __init__(self, entry: Entry, data: bytes, distance: int, block_diff: float):
+        self.data, self.size, self.image_id = data, entry.size, entry.image_id
+        self.distance, self.block_diff = distance, block_diff
+
+    def info(self) -> dict:
+        return {'image_id': self.image_id, 'distance': self.distance, 'block_diff': round(self.block_diff, 2)}
+
+
+class BKTree:
+    """按汉明距离组织的 BK 树；节点为 [pHash, 条目列表, {距离: 子节点}]，相同 pHash 的条目放在同一节点"""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, entry: Entry):
+        if self.root is None:
+            self.root = [entry.phash, [entry], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(entry.phash, node[0])
+            if distance == 0:
+                node[1].append(entry)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [entry.phash, [entry], {}]
+                return
+            node = child
+
+    def search(self, phash: int, radius: int) -> list:
+        """返回 [(距离, 条目), ...]；只进入距离在 [d - radius, d + radius] 内的子树（三角不等式）"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(phash, node[0])
+            if distance <= radius:
+                found.extend((distance, entry) for entry in node[1] if not entry.removed)
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+class NearDuplicateIndex:
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_distance: int = MAX_DISTANCE,
+                 max_block_diff: float = MAX_BLOCK_DIFF):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.max_block_diff = max_block_diff
+        self._tree = BKTree()
+        self._entries = OrderedDict()  # 结果缓存键 -> 条目，按插入顺序淘汰
+        self._removed = 0
+        self._lock = threading.Lock()
+
+    def add(self, group: str, fingerprint: Fingerprint, result_key: str, image_id: str = None):
+        """登记一个写入结果缓存的结果；group 为 '操作:参数'，只在同组内查找"""
+        from result_cache import get_cache, make_key
+
+        thumb_key = make_key('near-duplicate-thumb', result_key.encode('ascii'))
+        get_cache().put(thumb_key, fingerprint.thumb_bytes())
+        entry = Entry(group, fingerprint, result_key, thumb_key, image_id)
+        with self._lock:
+            old = self._entries.pop(result_key, None)
+            if old is not None:
+                self._remove(old)
+            self._entries[result_key] = entry
+            self._tree.add(entry)
+            while len(self._entries) > self.max_entries:
+                self._remove(self._entries.popitem(last=False)[1])
+            # BK 树不支持删除，作废的条目超过一半时重建
+            if self._removed > len(self._entries):
+                self._rebuild()
+
+    def find(self, group: str, fingerprint: Fingerprint):
+        """找到同组内校验通过、距离最近的近似重复，返回 Match；没有时返回 None"""
+        from result_cache import get_cache
+
+        kind = group.split(':', 1)[0]
+        aspect = math.log(fingerprint.size[0] / fingerprint.size[1])
+        with self._lock:
+            candidates = [(distance, entry) for distance, entry in self._tree.search(fingerprint.phash,
+                                                                                     self.max_distance)
+                          if entry.group == group and hamming(entry.dhash, fingerprint.dhash) <= self.max_distance
+                          and abs(math.log(entry.size[0] / entry.size[1]) - aspect) <= MAX_ASPECT_DELTA
+                          and comparable(entry.size, fingerprint.size)]
+        if not candidates:
+            metrics.count(metrics.NEAR_DUPLICATES, (kind, 'miss'))
+            return None
+        cache = get_cache()
+        for distance, entry in sorted(candidates, key=lambda item: item[0]):
+            thumb = cache.get(entry.thumb_key)
+            data = cache.get(entry.result_key) if thumb is not None else None
+            if data is None:
+                # 原结果或缩略图已被缓存淘汰
+                with self._lock:
+                    self._forget(entry)
+                continue
+            block_diff = block_difference(fingerprint.thumb, np.asarray(Image.open(io.BytesIO(thumb))))
+            if block_diff <= self.max_block_diff:
+                metrics.count(metrics.NEAR_DUPLICATES, (kind, 'reused'))
+                return Match(entry, data, distance, block_diff)
+        metrics.count(metrics.NEAR_DUPLICATES, (kind, 'rejected'))
+        return None
+
+    def _forget(self, entry: Entry):
+        if self._entries.get(entry.result_key) is entry:
+            del self._entries[entry.result_key]
+            self._remove(entry)
+
+    def _remove(self, entry: Entry):
+        entry.removed = True
+        self._removed += 1
+
+    def _rebuild(self):
+        self._tree = BKTree()
+        for entry in self._entries.values():
+            self._tree.add(entry)
+        self._removed = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'max_distance': self.max_distance, 'max_block_diff': self.max_block_diff}
+
+
+def rescale_lines(result: dict, source: tuple, size: tuple) -> dict:
+    """OCR 结果的行框从原图尺寸 source 换算到 size"""
+    scale_x, scale_y = size[0] / source[0], size[1] / source[1]
+    for line in result.get('lines') or []:
+        line['box'] = [[round(x * scale_x, 1), round(y * scale_y, 1)] for x, y in line['box']]
+    return result
+
+
+def rescale_matte(png: bytes, size: tuple) -> bytes:
+    """alpha 蒙版（PNG）双线性缩放到 size"""
+    matte = Image.open(io.BytesIO(png))
+    if matte.size == size:
+        return png
+    output = io.BytesIO()
+    matte.resize(size, Image.BILINEAR).save(output, 'PNG', compress_level=1)
+    return output.getvalue()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_near_duplicates(kind: str):
+    """返回进程级单例索引；NEAR_DUP=off，或 kind 为 ocr 且 NEAR_DUP_OCR=off 时返回 None"""
+    global _index
+    if not ENABLED or (kind == 'ocr' and not OCR_ENABLED):
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = NearDuplicateIndex()
+    return _index
@@ -0,0 +1,189 @@
+"""
+OCR 关键词索引 - 在服务端对 OCR 结果建立倒排索引
+
+- 分词：中日韩字符切成单字 + 相邻二字组（bigram），拉丁字母和数字按单词切分；
+  统一做 NFKC 归一化并转小写，全角/半角、大小写不影响匹配
+- 倒排表常驻内存：词 -> {图片 ID: 命中的行号}，查询只做字典查找和集合求交
+- 每张图片的行文本、四点框和置信度持久化在 SQLite（OCR_INDEX_PATH），启动时重建倒排表
+- 支持增量添加/删除，同一图片 ID 重复添加时覆盖旧内容
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import heapq
+import threading
+import unicodedata
+
+# 中日韩统一表意文字、扩展 A、兼容表意文字、日文假名、韩文音节
+CJK_RANGES = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+TOKEN_PATTERN = re.compile(f'[{CJK_RANGES}]+|[0-9a-z]+')
+CJK_PATTERN = re.compile(f'[{CJK_RANGES}]')
+# OCR 经常在中文字符之间插入空格，分词前去掉，保证二字组跨空格也能匹配
+CJK_SPACE_PATTERN = re.compile(f'(?<=[{CJK_RANGES}])\\s+(?=[{CJK_RANGES}])')
+
+
+def normalize(text: str) -> str:
+    return CJK_SPACE_PATTERN.sub('', unicodedata.normalize('NFKC', text or '').lower())
+
+
+def tokenize(text: str) -> set:
+    """建索引用的分词：中日韩字符同时产出单字和二字组，这样一个字和多个字的查询都能命中"""
+    tokens = set()
+    for run in TOKEN_PATTERN.findall(normalize(text)):
+        if CJK_PATTERN.match(run):
+            tokens.update(run)
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.add(run)
+    return tokens
+
+
+def query_tokens(query: str) -> list:
+    """查询用的分词：多字中文只用二字组（比单字选择性高得多），单字才查单字"""
+    tokens = []
+    for run in TOKEN_PATTERN.findall(normalize(query)):
+        if CJK_PATTERN.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return list(dict.fromkeys(tokens))
+
+
+def compact(text: str) -> str:
+    """去掉空白，用于短语校验（OCR 常在中文字符间插入或丢失空格）"""
+    return re.sub(r'\s+', '', normalize(text))
+
+
+class OCRIndex:
+    def __init__(self, path: str = ':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        # 词 -> {图片 ID: frozenset(行号)}
+        self._postings = {}
+        # 图片 ID -> (行列表, 每行去空白后的文本)
+        self._documents = {}
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS documents ('
+            'image_id TEXT PRIMARY KEY, lines TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self._db.commit()
+        self._load()
+
+    def _load(self):
+        for key, lines in self._db.execute('SELECT image_id, lines FROM documents'):
+            self._insert(key, json.loads(lines))
+
+    def _insert(self, key: str, lines: list):
+        """更新内存中的文档和倒排表（调用方持有锁或处于初始化阶段）"""
+        line_tokens = {}
+        for number, line in enumerate(lines):
+            for token in tokenize(line['text']):
+                line_tokens.setdefault(token, []).append(number)
+        for token, numbers in line_tokens.items():
+            self._postings.setdefault(token, {})[key] = frozenset(numbers)
+        self._documents[key] = (lines, [compact(line['text']) for line in lines])
+
+    def _delete(self, key: str) -> bool:
+        document = self._documents.pop(key, None)
+        if document is None:
+            return False
+        for token in set().union(*(tokenize(line['text']) for line in document[0])):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[token]
+        return True
+
+    def add(self, key: str, lines: list):
+        """添加或覆盖一张图片；lines 为 OCR 结果中的 [{text, box, score}, ...]"""
+        lines = [
+            {'text': line['text'], 'box': line.get('box'), 'score': line.get('score')}
+            for line in lines if isinstance(line.get('text'), str) and line['text'].strip()
+        ]
+        with self._lock:
+            self._delete(key)
+            self._insert(key, lines)
+            self._db.execute(
+                'INSERT OR REPLACE INTO documents (image_id, lines, updated_at) VALUES (?, ?, ?)',
+                (key, json.dumps(lines, ensure_ascii=False), time.time()),
+            )
+            self._db.commit()
+        return len(lines)
+
+    def remove(self, key: str) -> bool:
+        with self._lock:
+            removed = self._delete(key)
+            self._db.execute('DELETE FROM documents WHERE image_id = ?', (key,))
+            self._db.commit()
+        return removed
+
+    def search(self, query: str, limit: int = 20) -> dict:
+        """
+        返回包含全部查询词的图片及其命中行（用于高亮的框）
+        排序：整句出现在同一行的图片优先，其次是同一行包含全部查询词的，再按命中行数
+        """
+        start = time.perf_counter()
+        tokens = query_tokens(query)
+        phrase = compact(query)
+        # 单个查询词时命中即整句匹配，不必再逐行校验
+        phrase = None if tokens == [phrase] else phrase
+        results = []
+        with self._lock:
+            postings = [self._postings.get(token) for token in tokens]
+            if tokens and all(postings):
+                # 从最短的倒排表开始求交，候选集合只会越来越小
+                postings.sort(key=len)
+                for key, numbers in postings[0].items():
+                    line_sets = [numbers]
+                    for other in postings[1:]:
+                        other_numbers = other.get(key)
+                        if other_numbers is None:
+                            break
+                        line_sets.append(other_numbers)
+                    else:
+                        results.append(self._match(key, line_sets, phrase))
+            # 只为排在前 limit 的图片组装带框的结果
+            top = heapq.nlargest(limit, results, key=lambda item: item[0])
+            top = [self._result(key, numbers) for _, key, numbers in top]
+        return {
+            'query': query,
+            'total': len(results),
+            'results': top,
+            'took_ms': round((time.perf_counter() - start) * 1000, 3),
+        }
+
+    def _match(self, key: str, line_sets: list, phrase: str) -> tuple:
+        """返回 (排序键, 图片 ID, 命中行号)；命中行优先取整句匹配的行，其次是包含全部查询词的行"""
+        compacted = self._documents[key][1]
+        full = frozenset.intersection(*line_sets) if len(line_sets) > 1 else line_sets[0]
+        exact = full if phrase is None else [n for n in full if phrase in compacted[n]]
+        numbers = exact or full or frozenset.union(*line_sets)
+        return (len(exact), len(full), len(numbers)), key, numbers
+
+    def _result(self, key: str, numbers) -> dict:
+        lines = self._documents[key][0]
+        return {'image_id': key, 'matches': [{'line': n, **lines[n]} for n in sorted(numbers)]}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'documents': len(self._documents), 'tokens': len(self._postings), 'path': self.path}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> OCRIndex:
+    """返回进程级单例索引，OCR_INDEX_PATH 为 SQLite 文件路径（设为 :memory: 则不持久化）"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = OCRIndex(os.environ.get('OCR_INDEX_PATH', 'ocr_index.db'))
+    return _index
@@ -1,73 +1,390 @@
 #!/usr/bin/env python3
 """
 RapidOCR 脚本 - 适配 FastAPI 服务调用
+
+推理并发：同一个 RapidOCR 实例上同时推理的个数为 核数 / 算子线程数（inference_config.concurrent_runs，
+ORT_INTRA_OP_THREADS 默认 0 占满所有核，即推理串行）。分块识别的线程数 OCR_TILE_WORKERS 默认取同一个值，
+分块数 x 算子线程数不超过核数；显式调大时多出的分块只并行裁剪和合并，推理仍按实例的推理名额排队
 """
 import sys
 import os
 import json
 import base64
-import tempfile
+import time
+import math
+import threading
 from PIL import Image
-import io
+
+import metrics
+
+# 文字方向：auto（默认）先用几行文字判断整页方向，整页一致时不再逐行分类；always 逐行分类（RapidOCR 默认）；off 不分类
+ORIENTATION_MODES = ('auto', 'always', 'off')
+ORIENTATION = os.environ.get('OCR_ORIENTATION', 'auto').strip().lower()
+# auto 模式下参与整页方向判断的文字行数（取最宽的几行，文字最多、分类最可靠）
+ORIENTATION_PROBE = int(os.environ.get('OCR_ORIENTATION_PROBE', '6'))
+# 缩小后的灰度图最亮与最暗相差不到该值时视为空白，不做检测
+BLANK_RANGE = 16
+
+# 分块识别：超大扫描件、长截图切成相互重叠的分块分别识别（OCR_TILE_SIZE=0 关闭）
+TILING_MODES = ('auto', 'on', 'off')
+TILING = os.environ.get('OCR_TILING', 'auto').strip().lower()
+TILE_SIZE = int(os.environ.get('OCR_TILE_SIZE', '1600'))
+# 重叠应大于最高的一行文字，保证每一行至少在一个分块中完整出现
+TILE_OVERLAP = int(os.environ.get('OCR_TILE_OVERLAP', '200'))
+TILE_MAX_SIDE = int(os.environ.get('OCR_TILE_MAX_SIDE', '4000'))
+TILE_MAX_ASPECT = float(os.environ.get('OCR_TILE_MAX_ASPECT', '3'))
+# 框离分块内侧边缘不超过 max(4 像素, 行高 * 该比例) 时视为被切断（切在字中间时框会停在半个字之前）
+TILE_EDGE_MARGIN = 0.5
+# 两个分块的框相交面积占较小框的比例达到该值时视为同一行
+DUPLICATE_OVERLAP = 0.6
+
+# 默认模型精度：fp32，或 int8（quantize_models.py 生成的量化检测、识别模型），单个请求可用 precision 参数覆盖
+PRECISION = os.environ.get('OCR_PRECISION', 'fp32').strip().lower()
+
+_ocr = {}
+_ocr_lock = threading.Lock()
+_tile_executor = None
+_tile_executor_lock = threading.Lock()
+
+def get_ocr(precision: str = None):
+    """返回进程内共享的 RapidOCR 实例（每种精度一个），首次调用时加载模型"""
+    precision = precision or PRECISION
+    ocr = _ocr.get(precision)
+    if ocr is None:
+        with _ocr_lock:
+            ocr = _ocr.get(precision)
+            if ocr is None:
+                from inference_config import create_rapidocr, concurrent_runs
+                print(f"Loading RapidOCR models ({precision})...", file=sys.stderr)
+                start = time.perf_counter()
+                # 按 ORT_* / OCR_ORT_* 配置创建 ONNX Runtime 会话
+                ocr = create_rapidocr(precision)
+                # 每个会话的算子线程已用满分到的核，同一实例上同时推理的个数受限（见 run_ocr）
+                ocr.inference_slots = threading.BoundedSemaphore(concurrent_runs('ocr'))
+                _ocr[precision] = ocr
+                metrics.model_loaded('ocr', 'rapidocr' if precision == 'fp32' else f'rapidocr-{precision}',
+                                     time.perf_counter() - start)
+    return ocr
+
+def warm_up():
+    """加载模型并用一张带文字的小图推理一次；空白图检测不到文字，识别和方向分类模型不会被预热"""
+    from PIL import ImageDraw
+
+    image = Image.new('RGB', (240, 60), 'white')
+    ImageDraw.Draw(image).text((10, 20), "PhotoBox 2024", fill='black')
+    get_ocr()(image)
 
 def check_dependencies():
-    """检查必要的依赖是否已安装"""
-    missing_deps = []
-    
-    try:
-        from rapidocr_onnxruntime import RapidOCR
-        print("✅ RapidOCR available", file=sys.stderr)
-    except ImportError:
-        missing_deps.append("rapidocr-onnxruntime")
-    
-    try:
-        from PIL import Image
-        print("✅ PIL (Pillow) available", file=sys.stderr)
-    except ImportError:
-        missing_deps.append("Pillow")
-    
-    return missing_deps
+    """检查必要的依赖是否已安装：只查找模块不导入，通过后由 startup 写入标记文件"""
+    from startup import check_dependencies as check_cached, ENGINES
+
+    return list(check_cached('ocr', ENGINES['ocr']['requires']))
+
+def load_image(image) -> Image.Image:
+    """在像素预算内解码（见 image_io，不经过临时文件），按 EXIF 方向摆正，并转换为 RapidOCR 支持的模式"""
+    from image_io import open_header, orientation, open_image
+
+    if not isinstance(image, Image.Image):
+        image = open_header(image)
+    if orientation(image) != 1:
+        # 手机照片常以横向存储、靠 EXIF 标记方向，摆正后文字行才是水平的
+        metrics.count(metrics.OCR_EXIF_ROTATED)
+    return open_image(image, modes=('RGB', 'L'))
+
+def is_blank(image: Image.Image) -> bool:
+    """缩小到 256 像素以内后几乎没有明暗变化（纯色背景、空白页），不可能有文字"""
+    small = image.convert('L') if image.mode != 'L' else image
+    scale = max(1, max(small.size) // 256)
+    if scale > 1:
+        small = small.reduce(scale)
+    low, high = small.getextrema()
+    return high - low < BLANK_RANGE
+
+def orient_crops(ocr, crops: list, mode: str) -> tuple:
+    """
+    文字行方向分类。auto：先对最宽的 OCR_ORIENTATION_PROBE 行分类，全部为正向（或全部倒置）时
+    其余行按同一方向处理、不再分类；结果不一致时才逐行分类。返回 (摆正后的文字行, 路径)
+    """
+    import cv2
+
+    if mode == 'off':
+        return crops, 'skipped'
+    if mode == 'always':
+        crops, _, _ = ocr.text_cls(crops)
+        return crops, 'per_box'
+
+    crops = list(crops)
+    probe = sorted(range(len(crops)), key=lambda i: crops[i].shape[1] / max(crops[i].shape[0], 1),
+                   reverse=True)[:max(1, ORIENTATION_PROBE)]
+    _, results, _ = ocr.text_cls([crops[i] for i in probe])
+    flipped = [('180' in label and score > ocr.text_cls.cls_thresh) for label, score in results]
+    for i, flip in zip(probe, flipped):
+        if flip:
+            crops[i] = cv2.rotate(crops[i], cv2.ROTATE_180)
+    probed = set(probe)
+    rest = [i for i in range(len(crops)) if i not in probed]
+    if not any(flipped):
+        return crops, 'upright'
+    if all(flipped):
+        for i in rest:
+            crops[i] = cv2.rotate(crops[i], cv2.ROTATE_180)
+        return crops, 'flipped'
+    if rest:
+        rotated, _, _ = ocr.text_cls([crops[i] for i in rest])
+        for i, crop in zip(rest, rotated):
+            crops[i] = crop
+    return crops, 'per_box'
+
+def run_ocr(ocr, image: Image.Image, orientation: str = None) -> list:
+    """
+    检测 -> 按需方向分类 -> 识别，结果格式与 RapidOCR 相同（[[box, text, score], ...]）。
+    空白图不做检测，检测不到文字时不做分类和识别；走过的路径计入 photobox_ocr_path_total。
+    检测、分类和识别占用实例的推理名额（默认同一时间只有一个），前处理和裁剪文字行可以与其他请求并行
+    """
+    if is_blank(image):
+        metrics.count(metrics.OCR_PATHS, ('blank',))
+        return []
+    img, padding_h = ocr.maybe_add_letterbox(ocr.load_img(image))
+    with ocr.inference_slots:
+        dt_boxes, _ = ocr.auto_text_det(img)
+    if dt_boxes is None:
+        metrics.count(metrics.OCR_PATHS, ('no_text',))
+        return []
+    crops = ocr.get_crop_img_list(img, dt_boxes)
+    with ocr.inference_slots:
+        crops, path = orient_crops(ocr, crops, orientation or ORIENTATION)
+        rec_res, _ = ocr.text_rec(crops)
+    metrics.count(metrics.OCR_PATHS, (path,))
+    if padding_h > 0:
+        for box in dt_boxes:
+            box[:, 1] -= padding_h
+    result, _ = ocr.get_final_res(dt_boxes, None, rec_res, 0.0, 0.0, 0.0)
+    return result or []
+
+def collect_lines(result) -> list:
+    """保留每一行的文本、四点框和置信度，供关键词索引高亮使用"""
+    lines = []
+    for item in result or ():
+        if len(item) >= 3 and isinstance(item[1], str) and item[1].strip():
+            lines.append({
+                "text": item[1].strip(),
+                "box": [[round(float(x), 1), round(float(y), 1)] for x, y in item[0]],
+                "score": round(float(item[2]), 4),
+            })
+    return lines
+
+def tiling_config() -> dict:
+    """分块参数（计入 OCR 结果缓存键）"""
+    return {'size': TILE_SIZE, 'overlap': TILE_OVERLAP, 'max_side': TILE_MAX_SIDE, 'max_aspect': TILE_MAX_ASPECT}
+
+def should_tile(width: int, height: int, mode: str = 'auto') -> bool:
+    """auto：最长边超过 OCR_TILE_MAX_SIDE，或长宽比超过 OCR_TILE_MAX_ASPECT 且长边放不进两块时分块"""
+    if mode == 'off' or TILE_SIZE <= 0:
+        return False
+    long_side, short_side = max(width, height), max(1, min(width, height))
+    if mode == 'on':
+        return long_side > TILE_SIZE
+    return long_side > TILE_MAX_SIDE or (long_side / short_side > TILE_MAX_ASPECT and long_side > 2 * TILE_SIZE)
+
+def tile_spans(length: int, tile: int, overlap: int) -> list:
+    """把 [0, length) 分成长度为 tile、相邻重叠至少 overlap 的区间，首尾对齐边界"""
+    if length <= tile:
+        return [(0, length)]
+    count = math.ceil((length - overlap) / (tile - overlap))
+    step = (length - tile) / (count - 1)
+    return [(round(i * step), round(i * step) + tile) for i in range(count)]
+
+def tile_grid(width: int, height: int) -> list:
+    """
+    分块矩形 (left, top, right, bottom)，按行优先。分块高 OCR_TILE_SIZE；
+    页面宽度不超过 OCR_TILE_MAX_SIDE 时每块取整个宽度，横排文字的行不会被切断，更宽的页面才按列切开
+    """
+    overlap = min(TILE_OVERLAP, TILE_SIZE // 2)
+    tile_width = width if width <= max(TILE_MAX_SIDE, TILE_SIZE) else max(TILE_MAX_SIDE, TILE_SIZE)
+    return [(left, top, right, bottom)
+            for top, bottom in tile_spans(height, TILE_SIZE, overlap)
+            for left, right in tile_spans(width, tile_width, overlap)]
+
+def get_tile_executor():
+    """
+    进程内所有请求共用的分块识别线程池，同时识别的分块数（也就是分块占用的内存）不超过 OCR_TILE_WORKERS，
+    默认为实例的推理名额数（核数 / 算子线程数），分块线程不会超额占用 CPU
+    """
+    global _tile_executor
+    if _tile_executor is None:
+        with _tile_executor_lock:
+            if _tile_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                from inference_config import concurrent_runs
+
+                workers = int(os.environ.get('OCR_TILE_WORKERS', '0')) or concurrent_runs('ocr')
+                _tile_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocr-tile')
+    return _tile_executor
 
-def process_image_with_rapidocr(image_bytes):
-    """使用 RapidOCR 处理图片"""
+def recognize_tile(ocr, image: Image.Image, rect: tuple, width: int, height: int) -> list:
+    """识别一个分块，框平移回整页坐标，并标出被分块内侧边缘切断的方向"""
+    left, top, right, bottom = rect
+    with metrics.stage('inference'):
+        lines = collect_lines(run_ocr(ocr, image.crop(rect)))
+    for line in lines:
+        line["box"] = [[round(x + left, 1), round(y + top, 1)] for x, y in line["box"]]
+        xs, ys = [x for x, _ in line["box"]], [y for _, y in line["box"]]
+        line["rect"] = (min(xs), min(ys), max(xs), max(ys))
+        line["tiles"] = {rect}
+        x0, y0, x1, y1 = line["rect"]
+        margin = max(4.0, TILE_EDGE_MARGIN * min(x1 - x0, y1 - y0))
+        line["clipped"] = {side for side, cut in (
+            ('left', left > 0 and x0 <= left + margin),
+            ('top', top > 0 and y0 <= top + margin),
+            ('right', right < width and x1 >= right - margin),
+            ('bottom', bottom < height and y1 >= bottom - margin),
+        ) if cut}
+    return lines
+
+def rect_area(rect) -> float:
+    return max(0.0, rect[2] - rect[0]) * max(0.0, rect[3] - rect[1])
+
+def rect_intersection(a, b) -> float:
+    return rect_area((max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])))
+
+def stitch_text(left: dict, right: dict) -> str:
+    """
+    拼接同一行被竖向切开的两段文字：在两段重叠区的中线处接缝，按字符宽度均匀估计中线在两段文字中的位置，
+    再在附近找左段接缝前的几个字符，修正估计的误差
+    """
+    seam = (max(left["rect"][0], right["rect"][0]) + min(left["rect"][2], right["rect"][2])) / 2
+
+    def position(line):
+        x0, x1 = line["rect"][0], line["rect"][2]
+        return round(len(line["text"]) * min(1.0, max(0.0, (seam - x0) / max(x1 - x0, 1.0))))
+
+    i, j = position(left), position(right)
+    anchor = left["text"][max(0, i - 3):i]
+    if anchor:
+        found = right["text"].find(anchor, max(0, j - 6), j + 6 + len(anchor))
+        if found >= 0:
+            j = found + len(anchor)
+    return left["text"][:i] + right["text"][j:]
+
+def join_fragments(a: dict, b: dict) -> dict:
+    """把左右两个分块里各自被切断的同一行合成一行"""
+    left, right = (a, b) if a["rect"][0] <= b["rect"][0] else (b, a)
+    text = stitch_text(left, right)
+    weight = len(left["text"]) + len(right["text"])
+    rect = (min(left["rect"][0], right["rect"][0]), min(left["rect"][1], right["rect"][1]),
+            max(left["rect"][2], right["rect"][2]), max(left["rect"][3], right["rect"][3]))
+    return {
+        "text": text,
+        "box": [left["box"][0], right["box"][1], right["box"][2], left["box"][3]],
+        "score": round((left["score"] * len(left["text"]) + right["score"] * len(right["text"])) / weight, 4),
+        "rect": rect,
+        "tiles": left["tiles"] | right["tiles"],
+        "clipped": (left["clipped"] - {'right'}) | (right["clipped"] - {'left'}),
+    }
+
+def are_fragments(a: dict, b: dict) -> bool:
+    """同一行文字被分块的竖向边界切开：纵向基本重合，一段在右侧被切断、另一段在左侧被切断"""
+    left, right = (a, b) if a["rect"][0] <= b["rect"][0] else (b, a)
+    if 'right' not in left["clipped"] or 'left' not in right["clipped"]:
+        return False
+    overlap = min(left["rect"][3], right["rect"][3]) - max(left["rect"][1], right["rect"][1])
+    return overlap >= 0.6 * min(left["rect"][3] - left["rect"][1], right["rect"][3] - right["rect"][1])
+
+def merge_tile_lines(lines: list, tiles: list) -> list:
+    """
+    合并各分块的识别结果：一行被竖向边界切成两段、两边都不完整时拼成一行；
+    其他情况下重叠区里同一行在两个分块各出现一次时，保留没有被切断、面积更大的那个。完全不在重叠区的行不需要比较
+    """
+    def in_overlap(line):
+        return any(rect_intersection(line["rect"], tile) > 0 for tile in tiles if tile not in line["tiles"])
+
+    merged, candidates = [], []
+    for line in lines:
+        (candidates if in_overlap(line) else merged).append(line)
+
+    # 完整的行优先，其次面积大的
+    candidates.sort(key=lambda line: (bool(line["clipped"]), -rect_area(line["rect"])))
+    kept = []
+    for line in candidates:
+        for i, other in enumerate(kept):
+            if other["tiles"] & line["tiles"]:
+                continue
+            intersection = rect_intersection(line["rect"], other["rect"])
+            if intersection <= 0:
+                continue
+            if are_fragments(line, other):
+                kept[i] = join_fragments(other, line)
+                break
+            if intersection >= DUPLICATE_OVERLAP * min(rect_area(line["rect"]), rect_area(other["rect"])):
+                break  # 重复，已保留的更完整
+        else:
+            kept.append(line)
+    return merged + kept
+
+def sort_lines(lines: list) -> list:
+    """与 RapidOCR 相同的阅读顺序：从上到下，同一行（纵坐标相差小于 10）从左到右"""
+    lines = sorted(lines, key=lambda line: (line["box"][0][1], line["box"][0][0]))
+    for i in range(len(lines) - 1):
+        for j in range(i, -1, -1):
+            if abs(lines[j + 1]["box"][0][1] - lines[j]["box"][0][1]) < 10 and \
+                    lines[j + 1]["box"][0][0] < lines[j]["box"][0][0]:
+                lines[j], lines[j + 1] = lines[j + 1], lines[j]
+            else:
+                break
+    return lines
+
+def recognize_tiled(ocr, image: Image.Image) -> tuple:
+    """
+    分块识别：按 OCR_TILE_SIZE 切成相互重叠的分块，在共用线程池中并行识别，再合并回整页坐标。
+    分块在工作线程里才裁剪，同一时间最多 OCR_TILE_WORKERS 个分块在内存中，推理内存与原图尺寸无关
+    """
+    width, height = image.size
+    tiles = tile_grid(width, height)
+    task = metrics.bind(recognize_tile)
+    lines = []
+    for tile_lines in get_tile_executor().map(lambda rect: task(ocr, image, rect, width, height), tiles):
+        lines.extend(tile_lines)
+    lines = sort_lines(merge_tile_lines(lines, tiles))
+    for line in lines:
+        del line["rect"], line["tiles"], line["clipped"]
+    return lines, len(tiles)
+
+def process_image_with_rapidocr(image_bytes, tiling: str = None, precision: str = None):
+    """
+    使用 RapidOCR 处理图片，image_bytes 可以是原始图片字节或已解码的 PIL 图像
+    tiling：auto（默认，取 OCR_TILING）按尺寸自动决定是否分块，on 超过一个分块就分块，off 整图识别
+    precision：fp32 / int8，默认取 OCR_PRECISION
+    """
     try:
-        from rapidocr_onnxruntime import RapidOCR
-        
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-            temp_file.write(image_bytes)
-            temp_path = temp_file.name
-        
-        try:
-            # 初始化 RapidOCR
-            ocr = RapidOCR()
-            
+        with metrics.stage('decode'):
+            image = load_image(image_bytes)
+            image.load()
+
+        # 复用已加载的 RapidOCR，直接传入解码后的图像
+        ocr = get_ocr(precision)
+
+        tiles = 0
+        if should_tile(*image.size, tiling or TILING):
+            lines, tiles = recognize_tiled(ocr, image)
+        else:
             # 执行 OCR
-            result, _ = ocr(temp_path)
-            
-            # 提取文本
-            text_parts = []
-            if result:
-                for item in result:
-                    if len(item) >= 2 and isinstance(item[1], str):
-                        text_parts.append(item[1].strip())
-            
-            # 合并所有文本
-            extracted_text = ' '.join(text_parts)
-            
-            return {
-                "success": True,
-                "text": extracted_text,
-                "confidence": 0.8  # RapidOCR 不直接提供置信度，使用默认值
-            }
-            
-        finally:
-            # 清理临时文件
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
-                
+            with metrics.stage('inference'):
+                lines = collect_lines(run_ocr(ocr, image))
+
+        # 合并所有文本
+        extracted_text = ' '.join(line["text"] for line in lines)
+        confidence = sum(line["score"] for line in lines) / len(lines) if lines else 0.0
+
+        result = {
+            "success": True,
+            "text": extracted_text,
+            "confidence": round(confidence, 4),
+            "lines": lines,
+        }
+        if tiles:
+            result["tiles"] = tiles
+        return result
+
     except Exception as e:
         print(f"RapidOCR processing error: {str(e)}", file=sys.stderr)
         return {
@@ -76,6 +393,18 @@ def process_image_with_rapidocr(image_bytes):
             "error": str(e)
         }
 
+def decode_stdin_image(data: bytes) -> bytes:
+    """stdin 内容是合法的 base64（可带 data URL 前缀）时解码，否则视为原始图片字节"""
+    text = data.strip()
+    if text.startswith(b'data:'):
+        text = text.split(b',', 1)[1]
+    try:
+        return base64.b64decode(text, validate=True)
+    except Exception:
+        if data.startswith(b'data:'):
+            raise
+        return data
+
 def main():
     # Check dependencies
     missing_deps = check_dependencies()
@@ -89,10 +418,10 @@ def main():
         sys.exit(1)
     
     try:
-        # 从 stdin 读取 base64 图片数据
-        input_data = sys.stdin.read().strip()
+        # 从 stdin 读取图片：原始图片字节，或（兼容旧调用方式）base64 文本
+        input_data = sys.stdin.buffer.read()
         
-        if not input_data:
+        if not input_data.strip():
             result = {
                 "success": False,
                 "text": "",
@@ -101,14 +430,8 @@ def main():
             print(json.dumps(result))
             sys.exit(1)
         
-        # 解码 base64
         try:
-            if ',' in input_data:
-                image_data = input_data.split(',')[1]
-            else:
-                image_data = input_data
-            
-            image_bytes = base64.b64decode(image_data)
+            image_bytes = decode_stdin_image(input_data)
         except Exception as e:
             result = {
                 "success": False,
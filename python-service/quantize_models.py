@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+INT8 量化模型准备工具 - 为 U²-Net（u2net / u2netp / silueta）和 RapidOCR 检测、识别模型生成量化版本
+
+- static（默认）：用本地样本图片校准激活值范围，QDQ 格式、权重按通道量化，卷积网络在 CPU 上收益最大
+- dynamic：只量化权重，激活值在运行时量化，不需要校准
+- 样本按文件名排序后交替分成校准集和评估集，评估时与 fp32 对比：单次推理加速比、模型大小、
+  分割蒙版 IoU（U²-Net 320x320 输出二值化后）、OCR 字符一致率（1 - 编辑距离 / fp32 文本长度）
+- 达到 --min-iou / --min-agreement 的模型才写入 QUANTIZED_MODEL_DIR（--force 跳过检查），
+  服务随后即可选用：抠图 model=u2net-int8，OCR precision=int8 或 OCR_PRECISION=int8
+
+需要 onnx（onnxruntime.quantization 依赖它）：pip install onnx
+用法：python quantize_models.py --seg-samples ./portraits --ocr-samples ./documents [--models u2net,ocr]
+      [--mode static|dynamic] [--max-samples 64] [--report quantize_report.json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+from PIL import Image
+
+from inference_config import create_session, quantized_model_dir, quantized_model_path, rapidocr_model_paths
+
+SEGMENTATION_MODELS = ('u2net', 'u2netp', 'silueta')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+# rembg 的 U²-Net 系列会话使用的输入尺寸和归一化参数
+U2NET_SIZE = (320, 320)
+U2NET_MEAN = (0.485, 0.456, 0.406)
+U2NET_STD = (0.229, 0.224, 0.225)
+# 每张图最多取这么多个文字行参与识别模型的校准
+REC_CROPS_PER_IMAGE = 32
+
+
+def load_samples(directory: str, limit: int) -> tuple:
+    """读取目录中的图片，按文件名排序后交替分为 (校准集, 评估集)；只有一张时两者相同"""
+    if not directory or not os.path.isdir(directory):
+        raise SystemExit(f"Sample directory not found: {directory}")
+    names = sorted(n for n in os.listdir(directory) if n.lower().endswith(IMAGE_EXTENSIONS))[:limit]
+    images = []
+    for name in names:
+        with Image.open(os.path.join(directory, name)) as image:
+            images.append(image.convert('RGB'))
+    if not images:
+        raise SystemExit(f"No images in {directory}")
+    if len(images) == 1:
+        return images, images
+    return images[0::2], images[1::2]
+
+
+def edit_distance(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def character_agreement(reference: str, candidate: str) -> float:
+    if not reference:
+        return 1.0 if not candidate else 0.0
+    return max(0.0, 1 - edit_distance(reference, candidate) / len(reference))
+
+
+def copy_metadata(source: str, target: str):
+    """量化后保留原模型的元数据（RapidOCR 识别模型的字符表存在元数据里）"""
+    import onnx
+
+    source_model = onnx.load(source, load_external_data=False)
+    if not source_model.metadata_props:
+        return
+    target_model = onnx.load(target)
+    existing = {prop.key for prop in target_model.metadata_props}
+    for prop in source_model.metadata_props:
+        if prop.key not in existing:
+            target_model.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(target_model, target)
+
+
+def quantize(source: str, target: str, mode: str, feeds: list, reduce_range: bool = False):
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic,
+                                          quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    # 先做形状推断和图优化，量化器才能处理全部节点；个别模型推断失败时直接量化原模型
+    prepared = target + '.pre.onnx'
+    try:
+        quant_pre_process(source, prepared)
+    except Exception as e:
+        print(f"Pre-processing skipped for {os.path.basename(source)}: {e}", file=sys.stderr)
+        prepared = source
+
+    class FeedReader(CalibrationDataReader):
+        """把预先算好的输入逐个交给校准器"""
+
+        def __init__(self):
+            self._feeds = iter(feeds)
+
+        def get_next(self):
+            return next(self._feeds, None)
+
+    if mode == 'dynamic':
+        quantize_dynamic(prepared, target, weight_type=QuantType.QUInt8, reduce_range=reduce_range)
+    else:
+        quantize_static(prepared, target, FeedReader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, reduce_range=reduce_range)
+    if prepared != source:
+        os.remove(prepared)
+    copy_metadata(source, target)
+
+
+def median_run_ms(session, feeds: list) -> float:
+    session.run(None, feeds[0])  # 预热
+    timings = []
+    for feed in feeds:
+        start = time.perf_counter()
+        session.run(None, feed)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def model_report(name: str, source: str, target: str, fp32_session, int8_session, feeds: list) -> dict:
+    fp32_ms, int8_ms = median_run_ms(fp32_session, feeds), median_run_ms(int8_session, feeds)
+    return {
+        "model": name,
+        "fp32_mb": round(os.path.getsize(source) / 1024 / 1024, 2),
+        "int8_mb": round(os.path.getsize(target) / 1024 / 1024, 2),
+        "fp32_ms": round(fp32_ms, 1),
+        "int8_ms": round(int8_ms, 1),
+        "speedup": round(fp32_ms / int8_ms, 2) if int8_ms else None,
+    }
+
+
+def u2net_mask(session, feed: dict) -> np.ndarray:
+    """与 rembg 相同的后处理：取第一个输出，按最小最大值归一化到 0..1"""
+    pred = session.run(None, feed)[0][0, 0]
+    low, high = pred.min(), pred.max()
+    return (pred - low) / max(high - low, 1e-6)
+
+
+def prepare_segmentation(model_name: str, samples: tuple, workdir: str, args) -> dict:
+    from inference_config import rembg_session
+
+    calibration, evaluation = samples
+    session = rembg_session(model_name)
+    source = str(type(session).download_models())
+    feeds = [session.normalize(image, U2NET_MEAN, U2NET_STD, U2NET_SIZE) for image in calibration]
+    eval_feeds = [session.normalize(image, U2NET_MEAN, U2NET_STD, U2NET_SIZE) for image in evaluation]
+
+    target = os.path.join(workdir, f'{model_name}.int8.onnx')
+    print(f"Quantizing {model_name} ({args.mode}, {len(feeds)} calibration images)...", file=sys.stderr)
+    quantize(source, target, args.mode, feeds, args.reduce_range)
+
+    fp32_session, int8_session = session.inner_session, create_session(target, 'rembg')
+    ious, diffs = [], []
+    for feed in eval_feeds:
+        reference, candidate = u2net_mask(fp32_session, feed), u2net_mask(int8_session, feed)
+        a, b = reference > 0.5, candidate > 0.5
+        union = np.logical_or(a, b).sum()
+        ious.append(float(np.logical_and(a, b).sum() / union) if union else 1.0)
+        diffs.append(float(np.abs(reference - candidate).mean() * 255))
+
+    report = model_report(model_name, source, target, fp32_session, int8_session, eval_feeds)
+    report.update({
+        "mask_iou_mean": round(statistics.mean(ious), 4),
+        "mask_iou_min": round(min(ious), 4),
+        "mask_mean_abs_diff": round(statistics.mean(diffs), 2),
+    })
+    report["accepted"] = report["mask_iou_mean"] >= args.min_iou
+    return {"report": [report], "files": [(target, quantized_model_path(model_name))], "accepted": report["accepted"]}
+
+
+def det_feed(ocr, image: Image.Image):
+    """与 RapidOCR 检测前处理相同的输入，以及送入检测的 BGR 图"""
+    from rapidocr_onnxruntime.ch_ppocr_v3_det.utils import transform
+
+    img, _ = ocr.maybe_add_letterbox(ocr.load_img(image))
+    data = transform({'image': img}, ocr.text_det.preprocess_op)
+    name = ocr.text_det.infer.session.get_inputs()[0].name
+    return {name: np.expand_dims(data[0], axis=0).astype(np.float32)}, img
+
+
+def rec_feeds(ocr, img: np.ndarray) -> list:
+    """用 fp32 检测结果裁出文字行，按 RapidOCR 识别的前处理生成输入（每行单独一批）"""
+    dt_boxes, _ = ocr.auto_text_det(img)
+    if dt_boxes is None:
+        return []
+    name = ocr.text_rec.session.session.get_inputs()[0].name
+    feeds = []
+    for crop in ocr.get_crop_img_list(img, dt_boxes)[:REC_CROPS_PER_IMAGE]:
+        height, width = crop.shape[:2]
+        norm = ocr.text_rec.resize_norm_img(crop, width / max(height, 1))
+        feeds.append({name: norm[np.newaxis].astype(np.float32)})
+    return feeds
+
+
+def ocr_text(ocr, image: Image.Image) -> str:
+    result, _ = ocr(image)
+    return ' '.join(item[1] for item in result or ())
+
+
+def prepare_ocr(samples: tuple, workdir: str, args) -> dict:
+    from inference_config import create_rapidocr
+
+    calibration, evaluation = samples
+    fp32 = create_rapidocr('fp32')
+    sources = rapidocr_model_paths('fp32')
+
+    det_calibration, rec_calibration = [], []
+    for image in calibration:
+        feed, img = det_feed(fp32, image)
+        det_calibration.append(feed)
+        rec_calibration.extend(rec_feeds(fp32, img))
+    det_eval, rec_eval = [], []
+    for image in evaluation:
+        feed, img = det_feed(fp32, image)
+        det_eval.append(feed)
+        rec_eval.extend(rec_feeds(fp32, img))
+    if not rec_calibration or not rec_eval:
+        raise SystemExit("No text detected in the OCR samples; use images that contain text")
+
+    reports, files = [], []
+    int8 = create_rapidocr('fp32')
+    for section, calibration_feeds, eval_feeds, holder, fp32_holder in (
+            ('Det', det_calibration, det_eval, int8.text_det.infer, fp32.text_det.infer),
+            ('Rec', rec_calibration, rec_eval, int8.text_rec.session, fp32.text_rec.session)):
+        source = sources[section]
+        stem = os.path.splitext(os.path.basename(source))[0]
+        target = os.path.join(workdir, f'{stem}.int8.onnx')
+        print(f"Quantizing {stem} ({args.mode}, {len(calibration_feeds)} calibration inputs)...", file=sys.stderr)
+        quantize(source, target, args.mode, calibration_feeds, args.reduce_range)
+        holder.session = create_session(target, 'ocr')
+        reports.append(model_report(stem, source, target, fp32_holder.session, holder.session, eval_feeds))
+        files.append((target, quantized_model_path(stem)))
+
+    # 端到端对比：检测和识别都换成量化模型
+    agreements, fp32_ms, int8_ms = [], [], []
+    for image in evaluation:
+        start = time.perf_counter()
+        reference = ocr_text(fp32, image)
+        fp32_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        candidate = ocr_text(int8, image)
+        int8_ms.append((time.perf_counter() - start) * 1000)
+        agreements.append(character_agreement(reference, candidate))
+    pipeline = {
+        "model": "rapidocr (det + rec)",
+        "fp32_ms": round(statistics.median(fp32_ms), 1),
+        "int8_ms": round(statistics.median(int8_ms), 1),
+        "speedup": round(statistics.median(fp32_ms) / statistics.median(int8_ms), 2),
+        "char_agreement_mean": round(statistics.mean(agreements), 4),
+        "char_agreement_min": round(min(agreements), 4),
+    }
+    pipeline["accepted"] = pipeline["char_agreement_mean"] >= args.min_agreement
+    for report in reports:
+        report["accepted"] = pipeline["accepted"]
+    return {"report": reports + [pipeline], "files": files, "accepted": pipeline["accepted"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成 INT8 量化模型并与 fp32 对比速度、大小和精度")
+    parser.add_argument('--models', default='u2net,ocr', help=f"逗号分隔，可选 {', '.join(SEGMENTATION_MODELS)}, ocr")
+    parser.add_argument('--seg-samples', help="分割校准 / 评估用的人像图片目录")
+    parser.add_argument('--ocr-samples', help="OCR 校准 / 评估用的文字图片目录")
+    parser.add_argument('--mode', choices=('static', 'dynamic'), default='static')
+    parser.add_argument('--max-samples', type=int, default=64, help="每个目录最多使用的图片数")
+    parser.add_argument('--reduce-range', action='store_true',
+                        help="权重用 7 位量化，避免没有 VNNI 的 x86 CPU 上 U8S8 乘加饱和")
+    parser.add_argument('--min-iou', type=float, default=0.97, help="分割模型的平均蒙版 IoU 下限")
+    parser.add_argument('--min-agreement', type=float, default=0.98, help="OCR 的平均字符一致率下限")
+    parser.add_argument('--force', action='store_true', help="未达到精度下限也写入")
+    parser.add_argument('--report', help="结果 JSON 文件")
+    args = parser.parse_args()
+
+    try:
+        import onnx  # noqa: F401
+    except ImportError:
+        raise SystemExit("onnx is required for quantization: pip install onnx")
+
+    models = [m.strip() for m in args.models.split(',') if m.strip()]
+    unknown = [m for m in models if m not in SEGMENTATION_MODELS + ('ocr',)]
+    if unknown:
+        parser.error(f"unknown models: {', '.join(unknown)}")
+
+    output_dir = quantized_model_dir()
+    os.makedirs(output_dir, exist_ok=True)
+    # 临时目录和输出目录在同一文件系统上，写入时直接 rename
+    workdir = tempfile.mkdtemp(prefix='.quantize-', dir=output_dir)
+    results = []
+    try:
+        seg_samples = load_samples(args.seg_samples, args.max_samples) if set(models) & set(SEGMENTATION_MODELS) else None
+        ocr_samples = load_samples(args.ocr_samples, args.max_samples) if 'ocr' in models else None
+        for model in models:
+            result = prepare_ocr(ocr_samples, workdir, args) if model == 'ocr' else \
+                prepare_segmentation(model, seg_samples, workdir, args)
+            installed = result["accepted"] or args.force
+            for temp_path, final_path in result["files"]:
+                if installed:
+                    os.replace(temp_path, final_path)
+                    print(f"Saved {final_path}", file=sys.stderr)
+            for report in result["report"]:
+                report["installed"] = installed
+            results.extend(result["report"])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({"mode": args.mode, "reduce_range": args.reduce_range, "output_dir": output_dir,
+                       "results": results}, f, indent=2, ensure_ascii=False)
+
+    print(f"{'model':<28} {'fp32 MB':>8} {'int8 MB':>8} {'fp32 ms':>8} {'int8 ms':>8} {'speedup':>7} "
+          f"{'accuracy':>9} {'installed':>9}")
+    for r in results:
+        accuracy = r.get('mask_iou_mean', r.get('char_agreement_mean', '-'))
+        print(f"{r['model']:<28} {r.get('fp32_mb', '-'):>8} {r.get('int8_mb', '-'):>8} {r['fp32_ms']:>8} "
+              f"{r['int8_ms']:>8} {r['speedup']:>7} {accuracy:>9} {str(r['installed']):>9}")
+    print("(accuracy: mean mask IoU for segmentation, mean character agreement for the OCR pipeline)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
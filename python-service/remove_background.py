@@ -1,36 +1,46 @@
 #!/usr/bin/env python3
 """
 背景移除脚本 - 适配 FastAPI 服务调用
+
+rembg 会话按模型在进程内创建一次并放入会话池复用，
+避免每张图片都重新加载 U²-Net 模型。
 """
 import sys
 import os
+import time
+import queue
+import threading
 import tempfile
 import base64
+from contextlib import contextmanager
+from functools import lru_cache
 from PIL import Image
 import numpy as np
 
+import metrics
+from compositor import COMPOSITE_ROWS, resize_rows
+
+# 允许按请求选择的模型；u2netp / silueta 体积更小，适合对延迟敏感的请求。
+# 加 -int8 后缀（例如 u2net-int8）使用 quantize_models.py 生成的 INT8 量化模型
+SUPPORTED_MODELS = ('u2net', 'u2netp', 'silueta')
+DEFAULT_MODEL = os.environ.get('REMBG_MODEL', 'u2net')
+# 每个模型最多创建的会话数，即同一模型可并发推理的调用方数量
+DEFAULT_POOL_SIZE = int(os.environ.get('REMBG_POOL_SIZE', '1'))
+# 分割用代理图的最长边（像素）。U²-Net 只在 320x320 上推理，原图再大也只是增加
+# rembg 前后处理的时间和内存；蒙版在代理图上生成后再放大回原尺寸。0 表示直接分割原图
+DEFAULT_PROXY_SIZE = int(os.environ.get('REMBG_PROXY_SIZE', '1024'))
+# 蒙版放大方式：none 为双线性插值；guided 以原图为引导做快速导向滤波，边缘贴合发丝等细节
+REFINE_MODES = ('none', 'guided')
+DEFAULT_REFINE = os.environ.get('REMBG_REFINE', 'none')
+
+
+@lru_cache(maxsize=None)
 def check_dependencies():
-    """检查必要的依赖是否已安装"""
-    missing_deps = []
-    
-    try:
-        import rembg
-        print("✅ rembg available", file=sys.stderr)
-    except ImportError:
-        missing_deps.append("rembg")
-    
-    try:
-        from PIL import Image
-        print("✅ PIL (Pillow) available", file=sys.stderr)
-    except ImportError:
-        missing_deps.append("Pillow")
-    
-    try:
-        import numpy
-        print("✅ numpy available", file=sys.stderr)
-    except ImportError:
-        missing_deps.append("numpy")
-    
+    """检查必要的依赖是否已安装：只查找模块不导入，通过后由 startup 写入标记文件，之后的进程直接跳过"""
+    from startup import check_dependencies as check_cached, ENGINES
+
+    missing_deps = check_cached('rembg', ENGINES['rembg']['requires'])
+
     # 检查模型文件 (Model file check - now only a warning, not blocking)
     model_path = os.path.join(os.path.expanduser("~"), ".u2net", "u2net.onnx")
     if os.path.exists(model_path):
@@ -45,37 +55,232 @@ def check_dependencies():
 
     return missing_deps
 
-def hex_to_rgb(hex_color: str) -> tuple:
-    """将十六进制颜色转换为RGB元组，支持#RGB和#RRGGBB"""
-    hex_color = hex_color.lstrip('#')
-    if len(hex_color) == 3:
-        hex_color = ''.join([c*2 for c in hex_color])
-    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+class SessionPool:
+    """单个模型的 rembg 会话池，最多创建 size 个会话，用完归还"""
 
-def process_image(input_path: str, output_path: str, bg_color: str):
-    """处理图片：移除背景并添加新背景色"""
-    try:
+    def __init__(self, model_name: str, size: int):
+        self.model_name = model_name
+        self.size = max(1, size)
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_session(self):
+        from inference_config import rembg_session
+        print(f"Loading rembg session: {self.model_name}", file=sys.stderr)
+        start = time.perf_counter()
+        # 会话参数来自 ORT_* / REMBG_ORT_* 环境变量
+        session = rembg_session(self.model_name)
+        metrics.model_loaded('rembg', self.model_name, time.perf_counter() - start)
+        return session
+
+    def warm_up(self):
+        """预先创建一个会话，使首个请求不承担模型加载时间"""
+        with self.acquire():
+            pass
+
+    @contextmanager
+    def acquire(self):
+        try:
+            session = self._idle.get_nowait()
+        except queue.Empty:
+            session = None
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    session = self._new_session()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                # 会话都在使用中，等待其他调用方归还
+                session = self._idle.get()
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+
+class BackgroundRemovalEngine:
+    """进程内共享的背景移除引擎，按模型懒加载会话池"""
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, default_model: str = DEFAULT_MODEL):
+        self.pool_size = pool_size
+        self.default_model = default_model
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def resolve_model(self, model_name: str = None) -> str:
+        from inference_config import split_precision, quantized_model_path, require_quantized
+
+        model_name = model_name or self.default_model
+        base_name, precision = split_precision(model_name)
+        if base_name not in SUPPORTED_MODELS:
+            raise ValueError(f"Unsupported model: {model_name}. Choose one of: {', '.join(SUPPORTED_MODELS)} "
+                             f"(add -int8 for the quantized variant)")
+        if precision == 'int8':
+            require_quantized(quantized_model_path(base_name))
+            return model_name
+        return base_name
+
+    def get_pool(self, model_name: str = None) -> SessionPool:
+        model_name = self.resolve_model(model_name)
+        with self._lock:
+            pool = self._pools.get(model_name)
+            if pool is None:
+                pool = SessionPool(model_name, self.pool_size)
+                self._pools[model_name] = pool
+        return pool
+
+    def warm_up(self, models=None):
+        for model_name in models or (self.default_model,):
+            self.get_pool(model_name).warm_up()
+
+    def remove(self, image: Image.Image, model_name: str = None) -> Image.Image:
+        """移除背景，返回 RGBA 图像"""
+        from rembg import remove
+
+        with self.get_pool(model_name).acquire() as session, metrics.stage('inference'):
+            fg_image = remove(image, session=session)
+        if not isinstance(fg_image, Image.Image):
+            fg_image = Image.fromarray(fg_image)
+        if fg_image.mode != 'RGBA':
+            fg_image = fg_image.convert('RGBA')
+        return fg_image
+
+    def mask(self, image: Image.Image, model_name: str = None) -> np.ndarray:
+        """只做分割，返回与输入同尺寸的 alpha 蒙版（uint8，HxW）"""
         from rembg import remove
-        
-        # Read input image
-        input_image = Image.open(input_path).convert("RGBA")
-        print(f"Input image size: {input_image.size}", file=sys.stderr)
 
-        # Remove background with rembg
-        print("Removing background with rembg...", file=sys.stderr)
-        transparent_image = remove(input_image)
-        print(f"Transparent image size: {transparent_image.size}", file=sys.stderr)
+        with self.get_pool(model_name).acquire() as session, metrics.stage('inference'):
+            mask = remove(image, session=session, only_mask=True)
+        if isinstance(mask, Image.Image):
+            mask = np.asarray(mask.convert('L'))
+        return mask
+
+
+_engine = None
+_engine_lock = threading.Lock()
 
-        # Create new background image
-        bg_rgb = hex_to_rgb(bg_color)
-        background = Image.new('RGBA', transparent_image.size, bg_rgb + (255,))
 
-        # Composite images
-        print("Compositing image with new background...", file=sys.stderr)
-        if transparent_image.mode != 'RGBA':
-            transparent_image = transparent_image.convert('RGBA')
+def get_engine() -> BackgroundRemovalEngine:
+    """返回进程级单例引擎"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = BackgroundRemovalEngine()
+    return _engine
 
-        result = Image.alpha_composite(background, transparent_image)
+
+def make_proxy(image: Image.Image, proxy_size: int) -> Image.Image:
+    """按最长边缩小到 proxy_size 以内；不需要缩小时返回原图"""
+    width, height = image.size
+    if proxy_size <= 0 or max(width, height) <= proxy_size:
+        return image
+    scale = proxy_size / max(width, height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return image.resize(size, Image.BILINEAR, reducing_gap=3.0)
+
+
+def guided_upsample(mask: np.ndarray, proxy_rgb: np.ndarray, full_rgb: np.ndarray,
+                    radius: int = 8, eps: float = 1e-3) -> np.ndarray:
+    """
+    快速导向滤波：在代理图分辨率上求局部线性系数 (a, b)，放大后作用于原图灰度，
+    得到与原图边缘对齐的全分辨率蒙版。全分辨率部分按 COMPOSITE_ROWS 行分块计算，
+    浮点中间数组不会达到原图大小
+    """
+    import cv2
+
+    def box(x):
+        return cv2.boxFilter(x, -1, (2 * radius + 1, 2 * radius + 1))
+
+    guide = cv2.cvtColor(proxy_rgb, cv2.COLOR_RGB2GRAY).astype(np.float32) / 255
+    src = mask.astype(np.float32) / 255
+    mean_i, mean_p = box(guide), box(src)
+    a = (box(guide * src) - mean_i * mean_p) / (box(guide * guide) - mean_i * mean_i + eps)
+    b = mean_p - a * mean_i
+    # 输出 = 255 * (a * 灰度 / 255 + b) = a * 灰度 + 255 * b
+    mean_a, mean_b = box(a), box(b) * 255
+
+    height, width = full_rgb.shape[:2]
+    output = np.empty((height, width), dtype=np.uint8)
+    for top in range(0, height, COMPOSITE_ROWS):
+        rows = slice(top, min(top + COMPOSITE_ROWS, height))
+        strip_a = resize_rows(mean_a, height, width, rows)
+        strip_b = resize_rows(mean_b, height, width, rows)
+        strip_a *= cv2.cvtColor(full_rgb[rows], cv2.COLOR_RGB2GRAY)
+        strip_a += strip_b
+        np.clip(strip_a, 0, 255, out=strip_a)
+        output[rows] = strip_a
+    return output
+
+
+def upsample_mask(mask: np.ndarray, proxy_rgb: np.ndarray, full_rgb: np.ndarray, refine: str = 'none') -> np.ndarray:
+    """把代理图上的蒙版放大回原图尺寸"""
+    if refine == 'guided':
+        return guided_upsample(mask, proxy_rgb, full_rgb)
+    height, width = full_rgb.shape[:2]
+    return np.asarray(Image.fromarray(mask).resize((width, height), Image.BILINEAR))
+
+
+def segment(input_image: Image.Image, model_name: str = None, proxy_size: int = None, refine: str = None):
+    """
+    分割阶段：返回 (RGB 像素数组, alpha 蒙版)，蒙版可缓存后用于任意背景色
+    大图先缩小到 proxy_size 再分割，蒙版放大回原尺寸，合成仍在原分辨率上进行
+    """
+    proxy_size = DEFAULT_PROXY_SIZE if proxy_size is None else proxy_size
+    refine = refine or DEFAULT_REFINE
+    if refine not in REFINE_MODES:
+        raise ValueError(f"Unsupported refine mode: {refine}. Choose one of: {', '.join(REFINE_MODES)}")
+    if input_image.mode != 'RGB':
+        input_image = input_image.convert('RGB')
+    print(f"Input image size: {input_image.size}", file=sys.stderr)
+
+    with metrics.stage('resize'):
+        proxy = make_proxy(input_image, proxy_size)
+    if proxy is not input_image:
+        print(f"Segmenting on proxy image: {proxy.size}", file=sys.stderr)
+
+    # Segment with pooled rembg session
+    print("Removing background with rembg...", file=sys.stderr)
+    alpha = get_engine().mask(proxy, model_name)
+    rgb = np.asarray(input_image)
+    if proxy is not input_image:
+        with metrics.stage('resize'):
+            alpha = upsample_mask(alpha, np.asarray(proxy), rgb, refine)
+    return rgb, alpha
+
+
+def composite(rgb: np.ndarray, alpha: np.ndarray, background, refine_edges: bool = False,
+              decontaminate: bool = False) -> np.ndarray:
+    """合成阶段：按 alpha 把前景混合到背景色、渐变或背景图上（见 compositor），返回 RGB uint8 数组"""
+    from compositor import composite as composite_many
+
+    return composite_many(rgb, alpha, [background], refine_edges, decontaminate)[0]
+
+
+def replace_background(input_image: Image.Image, bg_color: str, model_name: str = None) -> Image.Image:
+    """移除背景并合成新背景，返回 RGB 图像"""
+    from compositor import parse_background
+
+    background = parse_background(bg_color)  # 先校验颜色，避免无效参数时白跑一次分割
+    rgb, alpha = segment(input_image, model_name)
+    print("Compositing image with new background...", file=sys.stderr)
+    return Image.fromarray(composite(rgb, alpha, background))
+
+
+def process_image(input_path: str, output_path: str, bg_color: str, model_name: str = None):
+    """处理图片：移除背景并添加新背景色"""
+    try:
+        # Read input image（像素预算内解码并按 EXIF 方向摆正）
+        from image_io import open_image
+        input_image = open_image(input_path, modes=('RGB',))
+        result = replace_background(input_image, bg_color, model_name)
 
         # Save result
         result.save(output_path, 'PNG', quality=95)
@@ -88,25 +293,26 @@ def process_image(input_path: str, output_path: str, bg_color: str):
         return False
 
 def main():
-    if len(sys.argv) != 4:
-        print("Usage: python remove_background.py <input_path> <output_path> <bg_color>", file=sys.stderr)
+    if len(sys.argv) not in (4, 5):
+        print("Usage: python remove_background.py <input_path> <output_path> <bg_color> [model]", file=sys.stderr)
         sys.exit(1)
-    
+
     input_path = sys.argv[1]
     output_path = sys.argv[2]
     bg_color = sys.argv[3]
-    
+    model_name = sys.argv[4] if len(sys.argv) == 5 else None
+
     # Check dependencies
     missing_deps = check_dependencies()
     if missing_deps:
         print(f"Missing dependencies: {', '.join(missing_deps)}", file=sys.stderr)
         sys.exit(1)
-    
+
     # Process image
-    success = process_image(input_path, output_path, bg_color)
+    success = process_image(input_path, output_path, bg_color, model_name)
     if not success:
         sys.exit(1)
-    
+
     print("Background removal completed successfully", file=sys.stderr)
 
 if __name__ == "__main__":
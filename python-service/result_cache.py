@@ -0,0 +1,211 @@
+"""
+推理结果缓存 - 以图片内容哈希 + 处理参数为键
+
+两级缓存：
+- 内存 LRU，按字节数限制总大小（RESULT_CACHE_MB，默认 256）
+- 可选的磁盘缓存（设置 RESULT_CACHE_DIR 后启用），按 TTL 和总大小淘汰
+  （RESULT_CACHE_TTL 秒，默认 7 天；RESULT_CACHE_DISK_MB，默认 1024）
+
+缓存值统一为 bytes，调用方负责序列化。
+
+键取上传的原始字节（编码后的文件）而不是解码后的像素：命中时不需要解码，
+哈希一张 10MB 的 JPEG 约 10ms，而解码再哈希像素要 300ms 以上，比很多缩放 / 压缩请求本身还慢。
+像素相同、编码不同的上传（重新保存、去掉 EXIF）由近似重复索引（near_duplicate.py）处理（OCR 需打开 NEAR_DUP_OCR）。
+缓存只在服务进程里（service.py 的 ocr / segment / remove_background 前面），
+scripts/ 下的本地脚本每次请求一个新进程（抠图）或不导入服务模块（OCR 常驻进程），不经过这里。
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# 结果格式变化时修改版本号，使旧缓存失效
+CACHE_VERSION = 2
+
+
+def make_key(operation: str, image_bytes: bytes, params: dict = None) -> str:
+    """计算缓存键：sha256(版本 + 操作名 + 参数 + 图片内容)"""
+    digest = hashlib.sha256()
+    digest.update(f"{CACHE_VERSION}:{operation}:".encode('utf-8'))
+    digest.update(json.dumps(params or {}, sort_keys=True).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+
+class MemoryTier:
+    """按字节预算淘汰的 LRU"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items = OrderedDict()
+
+    def get(self, key: str):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        self._items[key] = value
+        self.bytes += len(value)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskTier:
+    """每个键一个文件；读取时检查 TTL，写入时按总大小淘汰最旧的文件"""
+
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.bytes = sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.is_file() and not entry.name.endswith('.tmp')]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > self.ttl_seconds:
+                with self._lock:
+                    self._remove(path, stat.st_size)
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(value)
+        with self._lock:
+            try:
+                self.bytes -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            # 原子替换，避免并发读到写了一半的文件
+            os.replace(temp_path, path)
+            self.bytes += len(value)
+            if self.bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """删除过期文件，再从最旧的开始删除直到低于大小上限（调用方持有锁）"""
+        now = time.time()
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        self.bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            stat = entry.stat()
+            if self.bytes <= self.max_bytes and now - stat.st_mtime <= self.ttl_seconds:
+                break
+            self._remove(entry.path, stat.st_size)
+
+    def _remove(self, path: str, size: int):
+        try:
+            os.unlink(path)
+            self.bytes -= size
+        except FileNotFoundError:
+            pass
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int, disk_dir: str = None, disk_max_bytes: int = 0, disk_ttl: float = 0):
+        self._lock = threading.Lock()
+        self.memory = MemoryTier(max_bytes)
+        self.disk = DiskTier(disk_dir, disk_max_bytes, disk_ttl) if disk_dir else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+        # 磁盘读写不占用内存层的锁
+        value = None
+        if self.disk is not None:
+            with metrics.stage('io'):
+                value = self.disk.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self.memory.put(key, value)
+            return value
+
+    def put(self, key: str, value: bytes):
+        with self._lock:
+            self.memory.put(key, value)
+        if self.disk is not None:
+            with metrics.stage('io'):
+                self.disk.put(key, value)
+
+    def get_or_compute(self, key: str, compute):
+        """命中则返回缓存，否则调用 compute() 计算并写入缓存；推理期间不持有锁"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory.bytes,
+                "disk_bytes": self.disk.bytes if self.disk is not None else 0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResultCache:
+    """返回进程级单例缓存，配置来自环境变量"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(
+                    max_bytes=int(float(os.environ.get('RESULT_CACHE_MB', '256')) * 1024 * 1024),
+                    disk_dir=os.environ.get('RESULT_CACHE_DIR') or None,
+                    disk_max_bytes=int(float(os.environ.get('RESULT_CACHE_DISK_MB', '1024')) * 1024 * 1024),
+                    disk_ttl=float(os.environ.get('RESULT_CACHE_TTL', str(7 * 24 * 3600))),
+                )
+    return _cache
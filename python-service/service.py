@@ -0,0 +1,828 @@
+"""
+服务核心逻辑 - 与 Web 框架无关
+
+FastAPI 应用（app.py）和腾讯云云函数入口（main.py）都只是这里的适配层：
+负责解析请求、调用推理引擎，并把错误统一成 ServiceError。
+"""
+import io
+import os
+import re
+import json
+import math
+import base64
+import hashlib
+
+import metrics
+from result_cache import get_cache, make_key
+
+
+class ServiceError(Exception):
+    """带 HTTP 状态码的业务错误"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+    def __reduce__(self):
+        # 多进程模式下错误要从工作进程传回主进程
+        return ServiceError, (self.status_code, self.message)
+
+
+def infer(fn, *args, **kwargs):
+    """
+    执行纯推理函数：启用推理进程池（INFERENCE_WORKERS > 0）时在工作进程中执行，否则直接在当前线程执行。
+    缓存、原图和索引都留在主进程，fn 必须是模块级函数，参数和返回值可 pickle
+    """
+    from worker_pool import get_worker_pool
+
+    pool = get_worker_pool()
+    if pool is None:
+        return fn(*args, **kwargs)
+    return pool.call(fn, *args, **kwargs)
+
+
+def decode_base64_image(data: str) -> bytes:
+    """解码 Base64 图片数据，兼容 data URL 前缀"""
+    if not isinstance(data, str) or not data:
+        raise ServiceError(400, 'No image data provided')
+    if data.startswith('data:'):
+        data = data.split(',', 1)[1]
+    try:
+        return base64.b64decode(data)
+    except Exception as e:
+        raise ServiceError(400, f'Invalid base64 data: {str(e)}')
+
+
+def image_from_body(body: dict) -> bytes:
+    """从 JSON 请求体中取出图片，兼容 image_data（Next.js 路由）和 image（前端直连）"""
+    return decode_base64_image(body.get('image_data') or body.get('image'))
+
+
+# 二进制上传时图片所在的表单字段
+IMAGE_FIELDS = ('image', 'file', 'image_data')
+
+
+def parse_multipart(body: bytes, content_type: str):
+    """解析 multipart/form-data，返回 (文本字段字典, [(字段名, 文件字节), ...])，文件按上传顺序排列"""
+    match = re.search(r'boundary="?([^";]+)"?', content_type or '')
+    if not match:
+        raise ServiceError(400, 'Missing multipart boundary')
+    delimiter = b'--' + match.group(1).encode('latin-1')
+
+    fields, files = {}, []
+    for part in body.split(delimiter)[1:]:
+        if part.startswith(b'--'):
+            break
+        headers, _, content = part[2:].partition(b'\r\n\r\n')
+        if content.endswith(b'\r\n'):
+            content = content[:-2]
+        disposition = re.search(rb'content-disposition:([^\r\n]*)', headers, re.IGNORECASE)
+        name = disposition and re.search(rb'\bname="([^"]*)"', disposition.group(1))
+        if not name:
+            continue
+        name = name.group(1).decode('utf-8')
+        if re.search(rb'\bfilename="', disposition.group(1)):
+            files.append((name, content))
+        else:
+            fields[name] = content.decode('utf-8')
+    return fields, files
+
+
+def parse_image_request(content_type: str, body: bytes, query=None, require_image: bool = True):
+    """
+    统一解析带图片的请求，返回 (图片字节, 参数字典)
+
+    - application/octet-stream 或 image/*：请求体就是图片，参数放在查询字符串
+    - multipart/form-data：图片是 image/file 文件字段，参数是其他表单字段
+    - 其他情况按 JSON 处理，图片为 Base64（兼容旧客户端）
+
+    require_image 为 False 时允许不带图片（例如只传 image_id），此时图片为 None
+    """
+    params = dict(query or {})
+    media_type = (content_type or '').split(';', 1)[0].strip().lower()
+
+    if media_type == 'application/octet-stream' or media_type.startswith('image/'):
+        if not body:
+            if not require_image:
+                return None, params
+            raise ServiceError(400, 'No image data provided')
+        return body, params
+
+    if media_type == 'multipart/form-data':
+        fields, files = parse_multipart(body, content_type)
+        params.update(fields)
+        image_bytes = None
+        for name, content in files:
+            if name in IMAGE_FIELDS and content and image_bytes is None:
+                image_bytes = content
+            elif name not in IMAGE_FIELDS:
+                # 其他文件字段（例如背景图 bg_image）以原始字节放进参数
+                params[name] = content
+        if image_bytes is not None:
+            return image_bytes, params
+    else:
+        try:
+            payload = json.loads(body or b'{}')
+        except Exception:
+            raise ServiceError(400, 'Invalid JSON body')
+        if not isinstance(payload, dict):
+            raise ServiceError(400, 'JSON body must be an object')
+        params.update(payload)
+
+    if not require_image and not (params.get('image_data') or params.get('image')):
+        return None, params
+    return image_from_body(params), params
+
+
+def parse_batch_request(content_type: str, body: bytes, query=None):
+    """
+    解析批量请求，返回 (图片字节列表, 参数字典)
+
+    - multipart/form-data：所有文件字段按上传顺序作为一批
+    - JSON：{"images": [Base64 字符串或 {"image_data"/"image": Base64}, ...]}
+    """
+    params = dict(query or {})
+    media_type = (content_type or '').split(';', 1)[0].strip().lower()
+
+    if media_type == 'multipart/form-data':
+        fields, files = parse_multipart(body, content_type)
+        params.update(fields)
+        images = [content for _, content in files if content]
+    else:
+        try:
+            payload = json.loads(body or b'{}')
+        except Exception:
+            raise ServiceError(400, 'Invalid JSON body')
+        if not isinstance(payload, dict) or not isinstance(payload.get('images'), list):
+            raise ServiceError(400, 'JSON body must be {"images": [...]}')
+        images = payload.pop('images')
+        params.update(payload)
+        images = [image_from_body(item) if isinstance(item, dict) else decode_base64_image(item) for item in images]
+
+    if not images:
+        raise ServiceError(400, 'No images provided')
+    max_batch = int(os.environ.get('OCR_BATCH_MAX', '100'))
+    if len(images) > max_batch:
+        raise ServiceError(400, f'Too many images in one batch (max {max_batch})')
+    return images, params
+
+
+def check_image(image_bytes: bytes):
+    """只读文件头校验图片：非法图片返回 400，超出像素预算且不能缩小解码时返回 413"""
+    from image_io import check_image as check, ImageTooLarge
+
+    try:
+        return check(image_bytes)
+    except ImageTooLarge as e:
+        raise ServiceError(413, str(e))
+    except Exception as e:
+        raise ServiceError(400, f'Invalid image data: {str(e)}')
+
+
+def decode_image(image_bytes: bytes, modes: tuple = None, target: tuple = None):
+    """在像素预算内解码并按 EXIF 方向摆正（见 image_io），modes 为可接受的模式，其他模式转换为 modes[0]"""
+    from image_io import open_image
+
+    image = check_image(image_bytes)
+    try:
+        return open_image(image, target, modes)
+    except Exception as e:
+        raise ServiceError(400, f'Invalid image data: {str(e)}')
+
+
+def ocr(image_bytes: bytes, tiling: str = None, precision: str = None) -> dict:
+    """
+    识别图片中的文字，相同图片直接返回缓存结果；打开 NEAR_DUP_OCR 时缩放、转码过的同一张图（近似重复）
+    复用原图的结果，行框按尺寸换算，结果中的 near_duplicate 为原图 ID 和相似度
+    tiling 为 auto / on / off（超大图、长截图分块识别）；precision 为 fp32 / int8（量化模型）
+    """
+    from ocr_rapidocr import process_image_with_rapidocr, tiling_config, TILING, PRECISION, ORIENTATION
+    from near_duplicate import get_near_duplicates, rescale_lines
+
+    tiling = tiling or TILING
+    precision = precision or PRECISION
+
+    fresh = []  # 新推理的结果：get_or_compute 写入缓存后再登记为近似重复的原图，每个结果只写一次缓存
+
+    def compute():
+        header = check_image(image_bytes)  # 只读文件头，非法或超大图片直接返回 400 / 413
+        near, group = get_near_duplicates('ocr'), 'ocr:' + json.dumps(params, sort_keys=True)
+        if near:
+            fingerprint = ocr_fingerprint(header)
+            match = near.find(group, fingerprint)
+            if match:
+                result = rescale_lines(json.loads(match.data), match.size, fingerprint.size)
+                return json.dumps({**result, 'near_duplicate': match.info()}).encode('utf-8')
+        result = infer(process_image_with_rapidocr, image_bytes, tiling, precision)
+        if not result.get('success'):
+            raise ServiceError(500, result.get('error') or 'OCR failed')
+        data = json.dumps(result).encode('utf-8')
+        if near:
+            fresh.append((near, group, fingerprint))
+        return data
+
+    params = {'engine': 'rapidocr', 'tiling': tiling, 'tile': tiling_config()}
+    if precision != 'fp32':
+        params['precision'] = precision
+    if ORIENTATION != 'auto':
+        params['orientation'] = ORIENTATION
+    key = make_key('ocr', image_bytes, params)
+    data = get_cache().get_or_compute(key, compute)
+    for near, group, fingerprint in fresh:
+        near.add(group, fingerprint, key, image_id(image_bytes))
+    return json.loads(data)
+
+
+def ocr_fingerprint(header):
+    """
+    OCR 用的近似重复指纹：JPEG 缩小解码到校验缩略图所需的分辨率，
+    尺寸取 OCR 结果坐标所在的尺寸（像素预算内解码后的尺寸）
+    """
+    from image_io import budget_size
+    from near_duplicate import Fingerprint, TEXT_VERIFY_SIZE
+
+    size = budget_size(header)
+    scale = min(1.0, TEXT_VERIFY_SIZE / max(size))
+    target = (math.ceil(size[0] * scale), math.ceil(size[1] * scale))
+    with metrics.stage('hash'):
+        return Fingerprint.of(decode_image(header, target=target), size, TEXT_VERIFY_SIZE)
+
+
+def ocr_batch(images: list, submit):
+    """
+    批量 OCR：按完成顺序逐个产出 {"index", "success", ...}，最后产出 {"done": true}
+    submit(fn, *args) 返回 Future（通常是推理线程池），同一时间最多提交 CPU 核数个任务。
+    所有图片共用同一个已加载的 RapidOCR 实例：解码、近似重复指纹等并行，
+    检测 / 分类 / 识别按实例的推理名额执行（默认串行，见 ocr_rapidocr.run_ocr），线程数不会超过核数
+    """
+    from concurrent.futures import wait, FIRST_COMPLETED
+    from inference_pool import QueueFullError
+
+    window = max(1, min(os.cpu_count() or 1, len(images)))
+    pending = {}
+    next_index = 0
+    succeeded = 0
+
+    def result_line(index, future):
+        try:
+            return {'index': index, **future.result()}
+        except ServiceError as e:
+            return {'index': index, 'success': False, 'error': e.message}
+        except Exception as e:
+            return {'index': index, 'success': False, 'error': str(e)}
+
+    while next_index < len(images) or pending:
+        while next_index < len(images) and len(pending) < window:
+            try:
+                future = submit(ocr, images[next_index])
+            except QueueFullError as e:
+                if pending:
+                    break  # 等已提交的任务完成后再重试
+                yield {'index': next_index, 'success': False, 'error': str(e)}
+                next_index += 1
+                continue
+            pending[future] = next_index
+            next_index += 1
+        if not pending:
+            continue
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for future in done:
+            line = result_line(pending.pop(future), future)
+            succeeded += 1 if line.get('success') else 0
+            yield line
+
+    yield {'done': True, 'count': len(images), 'succeeded': succeeded}
+
+
+def index_image(image_bytes: bytes = None, key: str = None, lines=None) -> dict:
+    """
+    把一张图片的 OCR 结果加入关键词索引，同一 ID 再次添加会覆盖
+    可以上传图片（先识别，结果走缓存），也可以带 image_id 直接提交已有的 lines
+    """
+    from ocr_index import get_index
+
+    if image_bytes is not None:
+        lines = ocr(image_bytes).get('lines') or []
+        key = key or image_id(image_bytes)
+    elif not isinstance(lines, list):
+        raise ServiceError(400, 'Provide either an image or image_id with lines')
+    if not isinstance(key, str) or not 0 < len(key) <= 256:
+        raise ServiceError(400, 'Invalid image_id')
+    if not all(isinstance(line, dict) for line in lines):
+        raise ServiceError(400, 'lines must be a list of {text, box, score}')
+    return {'success': True, 'image_id': key, 'lines': get_index().add(key, lines)}
+
+
+def index_request(content_type: str, body: bytes, query=None) -> dict:
+    """解析加入索引的请求：图片（可选 image_id），或 JSON {image_id, lines}"""
+    image_bytes, params = parse_image_request(content_type, body, query, require_image=False)
+    return {'image_bytes': image_bytes, 'key': params.get('image_id'), 'lines': params.get('lines')}
+
+
+def search_index(query: str, limit=20) -> dict:
+    """按关键词搜索已索引的图片，返回命中的图片和需要高亮的行框"""
+    from ocr_index import get_index
+
+    if not isinstance(query, str) or not query.strip():
+        raise ServiceError(400, 'Missing query')
+    try:
+        limit = max(1, min(int(limit), 200))
+    except (TypeError, ValueError):
+        raise ServiceError(400, f'Invalid limit: {limit}')
+    return {'success': True, **get_index().search(query.strip(), limit)}
+
+
+def remove_from_index(key: str) -> dict:
+    from ocr_index import get_index
+
+    if not get_index().remove(key):
+        raise ServiceError(404, 'Image not found in index')
+    return {'success': True, 'image_id': key}
+
+
+def image_id(image_bytes: bytes) -> str:
+    """图片 ID 即图片内容的 sha256，后续请求可以只传 ID 而不再上传图片"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def remember_image(image_bytes: bytes) -> str:
+    """把原图放入缓存，返回图片 ID"""
+    key = image_id(image_bytes)
+    get_cache().put(make_key('source', key.encode('ascii')), image_bytes)
+    return key
+
+
+def recall_image(key: str) -> bytes:
+    """按图片 ID 取回原图；已被淘汰时需要客户端重新上传"""
+    if not isinstance(key, str) or not re.fullmatch(r'[0-9a-f]{64}', key):
+        raise ServiceError(400, 'Invalid image_id')
+    image_bytes = get_cache().get(make_key('source', key.encode('ascii')))
+    if image_bytes is None:
+        raise ServiceError(404, 'Image not found, please upload it again')
+    return image_bytes
+
+
+def segment_matte(image, model_name: str = None) -> bytes:
+    """计算 alpha 蒙版并编码为 PNG；可能在推理工作进程中执行，image 为 PIL 图像或图片字节"""
+    from PIL import Image
+    from remove_background import segment as run_segment
+
+    if not isinstance(image, Image.Image):
+        with metrics.stage('decode'):
+            image = decode_image(image, ('RGB',))
+    try:
+        _, alpha = run_segment(image, model_name)
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+    except Exception as e:
+        raise ServiceError(500, f'Background removal failed: {str(e)}')
+    output = io.BytesIO()
+    Image.fromarray(alpha).save(output, 'PNG', compress_level=1)
+    return output.getvalue()
+
+
+def segment(image_bytes: bytes, model_name: str = None):
+    """
+    分割阶段：返回 (RGB 像素数组, alpha 蒙版)
+    蒙版按 (图片, 模型, 代理图尺寸, 细化方式) 缓存，同一张图换背景色时不再重新分割；
+    缓存未命中时先按感知哈希查找近似重复
+    """
+    import numpy as np
+    from PIL import Image
+    from image_io import MAX_PIXELS
+    from near_duplicate import get_near_duplicates, Fingerprint, rescale_matte
+    from remove_background import DEFAULT_PROXY_SIZE, DEFAULT_REFINE
+    from worker_pool import enabled as workers_enabled
+
+    with metrics.stage('decode'):
+        input_image = decode_image(image_bytes, ('RGB',))
+        rgb = np.asarray(input_image)
+
+    fresh = []  # 新推理的蒙版：get_or_compute 写入缓存后再登记为近似重复的原图
+
+    def compute():
+        # 缩放、转码过的同一张图（近似重复）复用原图的蒙版，缩放到当前尺寸
+        near, group = get_near_duplicates('matte'), 'matte:' + json.dumps(params, sort_keys=True)
+        if near:
+            with metrics.stage('hash'):
+                fingerprint = Fingerprint.of(input_image)
+            match = near.find(group, fingerprint)
+            if match:
+                with metrics.stage('resize'):
+                    return rescale_matte(match.data, input_image.size)
+        # 工作进程只收原始字节（比像素数组小得多），单进程模式直接复用已解码的图像
+        data = infer(segment_matte, image_bytes if workers_enabled() else input_image, model_name)
+        if near:
+            fresh.append((near, group, fingerprint))
+        return data
+
+    params = {'model': resolve_model(model_name), 'proxy_size': DEFAULT_PROXY_SIZE, 'refine': DEFAULT_REFINE,
+              'max_pixels': MAX_PIXELS}
+    key = make_key('matte', image_bytes, params)
+    data = get_cache().get_or_compute(key, compute)
+    for near, group, fingerprint in fresh:
+        near.add(group, fingerprint, key, image_id(image_bytes))
+    alpha = np.asarray(Image.open(io.BytesIO(data)))
+    return rgb, alpha
+
+
+def resolve_model(model_name: str = None) -> str:
+    from remove_background import get_engine
+
+    try:
+        return get_engine().resolve_model(model_name)
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+
+
+def parse_background(bg_color: str, bg_image=None):
+    """
+    背景参数 -> compositor 背景对象：bg_image（图片字节或 Base64）优先，
+    否则 bg_color 为 #RRGGBB 或 linear-gradient(180deg, #RRGGBB, #RRGGBB)
+    """
+    from compositor import parse_background as parse, ImageBackground
+
+    if bg_image:
+        if isinstance(bg_image, str):
+            bg_image = decode_base64_image(bg_image)
+        return ImageBackground(decode_image(bg_image, ('RGB',)), hashlib.sha256(bg_image).hexdigest())
+    try:
+        return parse(bg_color)
+    except (ValueError, TypeError, AttributeError):
+        raise ServiceError(400, f'Invalid color: {bg_color}')
+
+
+def parse_flag(value) -> bool:
+    """表单 / 查询字符串 / JSON 中的开关参数"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+@metrics.timed('encode')
+def encode_png(pixels) -> bytes:
+    from PIL import Image
+
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, 'PNG')
+    return output.getvalue()
+
+
+def remove_background(image_bytes: bytes, bg_color: str = '#FFFFFF', model_name: str = None, bg_image=None,
+                      refine_edges: bool = False, decontaminate: bool = False) -> bytes:
+    """移除背景并合成新背景（颜色、渐变或背景图），返回 PNG 字节；相同图片和参数直接返回缓存结果"""
+    from image_io import MAX_PIXELS
+    from remove_background import composite
+
+    background = parse_background(bg_color, bg_image)
+    params = {'bg_color': background.key(), 'model': resolve_model(model_name),
+              'refine_edges': refine_edges, 'decontaminate': decontaminate, 'max_pixels': MAX_PIXELS}
+    # 记住原图，之后换颜色时客户端只需传 image_id
+    remember_image(image_bytes)
+
+    def compute():
+        rgb, alpha = segment(image_bytes, model_name)
+        return encode_png(composite(rgb, alpha, background, refine_edges, decontaminate))
+
+    return get_cache().get_or_compute(make_key('remove-background', image_bytes, params), compute)
+
+
+def remove_background_as(image_bytes: bytes, output: dict, bg_color: str = '#FFFFFF', model_name: str = None,
+                         bg_image=None, refine_edges: bool = False, decontaminate: bool = False) -> dict:
+    """
+    换背景后直接按输出配置编码（例如证件照换底后压到 200KB 以内的 JPEG），
+    合成结果不经过 PNG 中转，返回 compress.encode_output 的结果
+    """
+    from PIL import Image
+    from compress import render
+    from remove_background import composite
+
+    background = parse_background(bg_color, bg_image)
+    remember_image(image_bytes)
+    rgb, alpha = segment(image_bytes, model_name)
+    return render(Image.fromarray(composite(rgb, alpha, background, refine_edges, decontaminate)), output)
+
+
+def id_photo(image_bytes: bytes, preset: str = None, bg_color: str = '#FFFFFF', model_name: str = None,
+             bg_image=None, refine_edges: bool = False, decontaminate: bool = False, output: dict = None) -> dict:
+    """
+    证件照：检测人脸，按 preset（1inch / 2inch）的比例裁出头肩区域，只分割这一块，换背景后输出成片尺寸。
+    裁剪区域的蒙版按 (图片, 模型, 尺寸, 裁剪框) 缓存，换背景色时不再分割。
+    返回 {data, media_type, width, height, preset, face, crop}；output 为 compress 的输出配置，默认 PNG
+    """
+    import numpy as np
+    from PIL import Image
+    from compress import encode_output
+    from remove_background import composite
+    from id_photo import PRESETS, resolve_preset, detect_face, crop_box, extract_roi, place
+
+    try:
+        preset = resolve_preset(preset)
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+    target = PRESETS[preset]
+    background = parse_background(bg_color, bg_image)
+    model = resolve_model(model_name)
+
+    with metrics.stage('decode'):
+        image = decode_image(image_bytes, ('RGB', 'L'))
+    face = detect_face(image)
+    box = crop_box(image.size, face, target)
+    region, offset = extract_roi(image, box, target)
+    if region is None:
+        raise ServiceError(422, 'Crop area is outside the image')
+
+    def compute():
+        return infer(segment_matte, region, model_name)
+
+    key = make_key('id-photo-matte', image_bytes, {'model': model, 'size': list(target), 'crop': list(box)})
+    alpha = np.asarray(Image.open(io.BytesIO(get_cache().get_or_compute(key, compute))))
+    rgb, alpha = place(np.asarray(region), alpha, offset, target)
+    pixels = composite(rgb, alpha, background, refine_edges, decontaminate)
+    if output:
+        result = encode_output(Image.fromarray(pixels), output)
+    else:
+        result = {'data': encode_png(pixels), 'media_type': 'image/png'}
+    return {**result, 'width': target[0], 'height': target[1], 'preset': preset,
+            'face': list(face) if face else None, 'crop': list(box)}
+
+
+def id_photo_headers(result: dict) -> dict:
+    """证件照的尺寸、是否检测到人脸和裁剪框（原图坐标）放在响应头"""
+    headers = {
+        'X-Image-Width': str(result['width']),
+        'X-Image-Height': str(result['height']),
+        'X-Face-Detected': 'true' if result['face'] else 'false',
+        'X-Crop-Box': ','.join(str(v) for v in result['crop']),
+    }
+    if 'quality' in result:
+        headers['X-Compressed-Size'] = str(result['size'])
+        headers['X-Quality'] = str(result['quality'])
+        if 'target_met' in result:
+            headers['X-Target-Met'] = str(result['target_met']).lower()
+    return headers
+
+
+def output_params(params: dict):
+    """换背景请求里带 format 或 targetBytes 时按 compress 的输出配置编码结果，否则返回 None（PNG）"""
+    from compress import parse_output
+
+    if not (params.get('format') or params.get('targetBytes')):
+        return None
+    try:
+        return parse_output(params)
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+
+
+def background_variants(colors, image_bytes: bytes = None, image_key: str = None, model_name: str = None,
+                        refine_edges: bool = False, decontaminate: bool = False) -> dict:
+    """
+    一次分割、多种背景（颜色或渐变）：一次合成写出全部结果，返回每种背景的 PNG（Base64）
+    可以直接上传图片，也可以只传之前请求返回的 image_id
+    """
+    from compositor import composite
+
+    if isinstance(colors, str):
+        # 渐变参数里也有逗号，只按括号外的逗号拆分
+        colors = [c.strip() for c in re.split(r',(?![^(]*\))', colors) if c.strip()]
+    if not colors or not isinstance(colors, list):
+        raise ServiceError(400, 'No colors provided')
+    backgrounds = [parse_background(c) for c in colors]
+
+    if image_bytes is None:
+        image_bytes = recall_image(image_key)
+    key = remember_image(image_bytes)
+
+    rgb, alpha = segment(image_bytes, model_name)
+    variants = []
+    for color, pixels in zip(colors, composite(rgb, alpha, backgrounds, refine_edges, decontaminate)):
+        png = encode_png(pixels)
+        variants.append({'color': color, 'image': 'data:image/png;base64,' + base64.b64encode(png).decode('ascii')})
+    return {'success': True, 'image_id': key, 'variants': variants}
+
+
+def ocr_params(body: dict) -> dict:
+    """OCR 请求参数：tile=auto|on|off，precision=fp32|int8"""
+    from ocr_rapidocr import TILING_MODES
+    from inference_config import PRECISIONS, rapidocr_model_paths
+
+    params = {}
+    tiling = body.get('tile')
+    if tiling not in (None, ''):
+        params['tiling'] = str(tiling).strip().lower()
+        if params['tiling'] not in TILING_MODES:
+            raise ServiceError(400, f"tile must be one of {', '.join(TILING_MODES)}")
+    precision = body.get('precision')
+    if precision not in (None, ''):
+        params['precision'] = str(precision).strip().lower()
+        if params['precision'] not in PRECISIONS:
+            raise ServiceError(400, f"precision must be one of {', '.join(PRECISIONS)}")
+        try:
+            rapidocr_model_paths(params['precision'])
+        except ValueError as e:
+            raise ServiceError(400, str(e))
+    return params
+
+
+def background_params(body: dict) -> dict:
+    """从请求参数中取出背景移除参数，兼容几种历史字段名"""
+    return {
+        'bg_color': body.get('new_bg_color') or body.get('newBgColor') or body.get('backgroundColor') or '#FFFFFF',
+        'model_name': body.get('model'),
+        'bg_image': body.get('bg_image') or body.get('backgroundImage'),
+        'refine_edges': parse_flag(body.get('refine_edges') or body.get('refineEdges')),
+        'decontaminate': parse_flag(body.get('decontaminate')),
+    }
+
+
+def id_photo_params(body: dict) -> dict:
+    """证件照参数：size（1inch / 2inch）加背景移除参数"""
+    return {**background_params(body), 'preset': body.get('size') or body.get('preset')}
+
+
+def variants_request(content_type: str, body: bytes, query=None) -> dict:
+    """解析多背景色请求：可以带图片，也可以只带之前返回的 image_id"""
+    image_bytes, params = parse_image_request(content_type, body, query, require_image=False)
+    if image_bytes is None and not params.get('image_id'):
+        raise ServiceError(400, 'Provide either an image or an image_id')
+    return {
+        'colors': params.get('colors'),
+        'image_bytes': image_bytes,
+        'image_key': params.get('image_id'),
+        'model_name': params.get('model'),
+        'refine_edges': parse_flag(params.get('refine_edges') or params.get('refineEdges')),
+        'decontaminate': parse_flag(params.get('decontaminate')),
+    }
+
+
+# 异步任务类型 -> 需要的引擎
+JOB_KINDS = {'remove-background': 'rembg', 'ocr': 'ocr'}
+
+
+def job_request(content_type: str, body: bytes, query=None) -> dict:
+    """解析异步任务提交请求：图片 + type（默认 remove-background）+ priority + 对应任务的参数"""
+    image_bytes, params = parse_image_request(content_type, body, query)
+    kind = params.get('type') or 'remove-background'
+    if kind not in JOB_KINDS:
+        raise ServiceError(400, f"Unsupported job type: {kind}. Choose one of: {', '.join(JOB_KINDS)}")
+    try:
+        priority = int(params.get('priority') or 0)
+    except (TypeError, ValueError):
+        raise ServiceError(400, f"Invalid priority: {params.get('priority')}")
+    job_params = {}
+    if kind == 'remove-background':
+        job_params = {**background_params(params), 'output': output_params(params)}
+        # 提交时就校验参数，不合法的任务不进入队列
+        parse_background(job_params['bg_color'], job_params['bg_image'])
+        resolve_model(job_params['model_name'])
+        if isinstance(job_params['bg_image'], bytes):
+            # 任务参数以 JSON 持久化，上传的背景图转成 Base64
+            job_params['bg_image'] = base64.b64encode(job_params['bg_image']).decode('ascii')
+    elif kind == 'ocr':
+        job_params = ocr_params(params)
+    return {'kind': kind, 'image_bytes': image_bytes, 'params': job_params, 'priority': priority}
+
+
+def run_job(kind: str, image_bytes: bytes, params: dict) -> tuple:
+    """执行一个异步任务，返回 (结果字节, 媒体类型)；耗时和阶段记在 job:<类型> 路由下"""
+    with metrics.request(f'job:{kind}', event='job'):
+        if kind == 'ocr':
+            return json.dumps(ocr(image_bytes, **params), ensure_ascii=False).encode('utf-8'), 'application/json'
+        params = dict(params)
+        output = params.pop('output', None)
+        if output:
+            result = remove_background_as(image_bytes, output, **params)
+            return result['data'], result['media_type']
+        return remove_background(image_bytes, **params), 'image/png'
+
+
+def job_status(job_id: str) -> dict:
+    """任务状态；JSON 结果直接内联，图片结果给出下载地址"""
+    from job_queue import get_job_queue
+
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        raise ServiceError(404, 'Job not found or expired')
+    response = {'success': job['status'] != 'failed', **job}
+    if job['status'] == 'done':
+        if job['media_type'] == 'application/json':
+            # 结果可能在两次查询之间被过期清理删除，由 job_result 返回 404 / 409
+            response['result'] = json.loads(job_result(job_id)[0])
+        else:
+            response['result_url'] = f'/jobs/{job_id}/result'
+    return response
+
+
+def job_result(job_id: str) -> tuple:
+    """已完成任务的 (结果字节, 媒体类型)"""
+    from job_queue import get_job_queue
+
+    queue = get_job_queue()
+    result = queue.result(job_id)
+    if result is None:
+        job = queue.get(job_id)
+        if job is None:
+            raise ServiceError(404, 'Job not found or expired')
+        raise ServiceError(409, f"Job is {job['status']}")
+    return result
+
+
+def compress_request(content_type: str, body: bytes, query=None, resize: bool = False) -> dict:
+    """
+    解析压缩 / 缩放请求。单个输出的参数直接放在请求里（quality、format、maxWidth/maxHeight 或 width/height）；
+    多个输出用 outputs（JSON 列表，或 multipart 表单中的 JSON 字符串），一次解码生成全部结果
+    """
+    from compress import parse_output
+
+    image_bytes, params = parse_image_request(content_type, body, query)
+    outputs = params.get('outputs')
+    if isinstance(outputs, str):
+        try:
+            outputs = json.loads(outputs)
+        except ValueError:
+            raise ServiceError(400, 'outputs must be a JSON list')
+    multiple = outputs is not None
+    if not multiple:
+        outputs = [params]
+    if not isinstance(outputs, list) or not outputs or not all(isinstance(o, dict) for o in outputs):
+        raise ServiceError(400, 'outputs must be a non-empty list of objects')
+    max_outputs = int(os.environ.get('COMPRESS_MAX_OUTPUTS', '16'))
+    if len(outputs) > max_outputs:
+        raise ServiceError(400, f'Too many outputs (max {max_outputs})')
+    try:
+        outputs = [parse_output(output, resize) for output in outputs]
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+    return {'image_bytes': image_bytes, 'outputs': outputs, 'multiple': multiple}
+
+
+def compress(image_bytes: bytes, outputs: list) -> dict:
+    """压缩 / 缩放，返回 compress.process 的结果（输出内容为字节）"""
+    from compress import process
+
+    check_image(image_bytes)
+    try:
+        return process(image_bytes, outputs)
+    except (ValueError, OSError) as e:
+        raise ServiceError(400, f'Invalid image data: {str(e)}')
+
+
+def compress_json(result: dict) -> dict:
+    """多输出结果转为 JSON：每个输出的内容为 data URL"""
+    outputs = []
+    for output in result['outputs']:
+        data = base64.b64encode(output['data']).decode('ascii')
+        outputs.append({**{k: v for k, v in output.items() if k != 'data'},
+                        'image': f"data:{output['media_type']};base64,{data}"})
+    return {'success': True, 'original': result['original'], 'outputs': outputs}
+
+
+def compress_headers(result: dict) -> dict:
+    """单输出时直接返回图片，尺寸信息放在响应头"""
+    output = result['outputs'][0]
+    return {
+        'X-Original-Size': str(result['original']['size']),
+        'X-Compressed-Size': str(output['size']),
+        'X-Image-Width': str(output['width']),
+        'X-Image-Height': str(output['height']),
+        'X-Quality': str(output['quality']),
+        'X-Encode-Passes': str(output['passes']),
+        **({'X-Target-Met': str(output['target_met']).lower()} if 'target_met' in output else {}),
+    }
+
+
+def metrics_text(include_jobs: bool = False) -> str:
+    """/metrics：请求和阶段耗时直方图、模型加载次数，加上抓取时读取的缓存、队列和内存状态"""
+    from inference_pool import get_pool
+    from worker_pool import current_rss_mb, enabled as workers_enabled, get_worker_pool
+
+    cache, pool = get_cache().stats(), get_pool().stats()
+    extra = [
+        metrics.snapshot('photobox_cache_hits_total', 'Result cache hits (memory or disk)', cache['hits'], kind='counter'),
+        metrics.snapshot('photobox_cache_disk_hits_total', 'Result cache hits served from disk', cache['disk_hits'],
+                         kind='counter'),
+        metrics.snapshot('photobox_cache_misses_total', 'Result cache misses', cache['misses'], kind='counter'),
+        metrics.snapshot('photobox_cache_hit_ratio', 'Result cache hit ratio since start', cache['hit_rate']),
+        metrics.snapshot('photobox_cache_memory_bytes', 'Result cache memory tier size', cache['memory_bytes']),
+        metrics.snapshot('photobox_inference_pending', 'Inference tasks running or queued', pool['pending']),
+        metrics.snapshot('photobox_inference_capacity', 'Inference concurrency plus queue slots',
+                         pool['max_workers'] + pool['max_queue']),
+        metrics.snapshot('process_resident_memory_bytes', 'Resident memory of the service process',
+                         int(current_rss_mb() * 1024 * 1024)),
+    ]
+    if workers_enabled():
+        workers = get_worker_pool().stats()['workers']
+        extra.append(metrics.snapshot('photobox_worker_in_flight', 'Tasks in flight per inference worker',
+                                      [((w['slot'],), w['in_flight']) for w in workers], ('slot',)))
+        extra.append(metrics.snapshot('photobox_worker_resident_memory_bytes', 'Resident memory per inference worker',
+                                      [((w['slot'],), int(w['rss_mb'] * 1024 * 1024)) for w in workers], ('slot',)))
+    if include_jobs:
+        from job_queue import get_job_queue, STATUSES
+
+        jobs = get_job_queue().stats()
+        extra.append(metrics.snapshot('photobox_jobs', 'Async jobs by status',
+                                      [((status,), jobs[status]) for status in STATUSES], ('status',)))
+    return metrics.render(extra)
@@ -0,0 +1,111 @@
+"""
+启动优化 - 缩短云函数冷启动和服务首个请求的耗时
+
+- 依赖检查只用 importlib.util.find_spec 查找模块，不真正导入；
+  检查通过后写入标记文件，同一 Python 环境下之后的进程直接跳过
+- rembg / onnxruntime / cv2 等重型依赖只在第一个需要它们的路由中导入，健康检查不触发
+- preload() 在容器初始化阶段（云函数 initializer、服务启动）导入引擎并加载、预热模型，
+  要预加载的引擎由 PRELOAD_MODELS 指定（逗号分隔，默认 ocr,rembg，设为空则完全按需加载）
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import importlib
+import importlib.util
+
+# 引擎名 -> (需要的模块, 导入时要加载的重型模块)
+ENGINES = {
+    'ocr': {'requires': ('rapidocr_onnxruntime', 'PIL', 'numpy'), 'module': 'rapidocr_onnxruntime'},
+    'rembg': {'requires': ('rembg', 'PIL', 'numpy'), 'module': 'rembg'},
+}
+
+# 模块名与 pip 包名不同的依赖，用于提示安装命令
+PACKAGE_NAMES = {'PIL': 'Pillow', 'rapidocr_onnxruntime': 'rapidocr-onnxruntime'}
+
+_imported = set()
+_import_lock = threading.Lock()
+
+
+def marker_path(name: str) -> str:
+    """标记文件路径，按 Python 解释器和环境前缀区分，换了虚拟环境会重新检查"""
+    env = f"{sys.executable}:{sys.prefix}:{sys.version}".encode('utf-8')
+    directory = os.environ.get('DEPS_MARKER_DIR') or tempfile.gettempdir()
+    return os.path.join(directory, f"photobox-deps-{name}-{hashlib.sha1(env).hexdigest()[:12]}.json")
+
+
+def check_dependencies(name: str, modules) -> tuple:
+    """返回缺失依赖的 pip 包名；全部存在时写入标记文件，之后直接读取标记"""
+    path = marker_path(name)
+    try:
+        with open(path) as f:
+            if json.load(f).get('modules') == list(modules):
+                return ()
+    except (OSError, ValueError):
+        pass
+
+    missing = tuple(PACKAGE_NAMES.get(m, m) for m in modules if importlib.util.find_spec(m) is None)
+    if not missing:
+        try:
+            with open(path, 'w') as f:
+                json.dump({'modules': list(modules), 'checked_at': time.time()}, f)
+        except OSError as e:
+            print(f"Could not write dependency marker {path}: {e}", file=sys.stderr)
+    return missing
+
+
+def require(engine: str):
+    """
+    按需导入引擎的重型模块。rembg 依赖的 pymatting（numba）如果首次在推理线程中导入，
+    进程退出时会卡住，因此要在主线程（事件循环）中调用。
+    多进程模式下模型只在推理工作进程中加载，主进程不导入
+    """
+    from worker_pool import enabled as workers_enabled
+
+    if engine in _imported or workers_enabled():
+        return
+    with _import_lock:
+        if engine not in _imported:
+            importlib.import_module(ENGINES[engine]['module'])
+            _imported.add(engine)
+
+
+def preload_engines() -> list:
+    value = os.environ.get('PRELOAD_MODELS', 'ocr,rembg')
+    engines = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in engines if name not in ENGINES]
+    if unknown:
+        print(f"Ignoring unknown PRELOAD_MODELS entries: {', '.join(unknown)}", file=sys.stderr)
+    return [name for name in engines if name in ENGINES]
+
+
+def warm_up(engine: str):
+    """加载模型并做一次推理"""
+    if engine == 'ocr':
+        from ocr_rapidocr import warm_up as warm_up_ocr
+        warm_up_ocr()
+    elif engine == 'rembg':
+        from remove_background import get_engine
+        get_engine().warm_up()
+
+
+def preload(engines=None, warm: bool = True) -> dict:
+    """导入并预热引擎，返回每个引擎的耗时（毫秒）；单个引擎失败只记录日志，不影响其他引擎"""
+    timings = {}
+    for engine in preload_engines() if engines is None else engines:
+        start = time.perf_counter()
+        try:
+            missing = check_dependencies(engine, ENGINES[engine]['requires'])
+            if missing:
+                raise ImportError(f"Missing dependencies: {', '.join(missing)}")
+            require(engine)
+            if warm:
+                warm_up(engine)
+            timings[engine] = round((time.perf_counter() - start) * 1000, 1)
+            print(f"Preloaded {engine} in {timings[engine]} ms", file=sys.stderr)
+        except Exception as e:
+            print(f"Preloading {engine} failed: {e}", file=sys.stderr)
+    return timings
@@ -0,0 +1,340 @@
+"""
+推理进程池 - 多进程（prefork）模式，INFERENCE_WORKERS > 0 时启用
+
+- 启动时创建 INFERENCE_WORKERS 个工作进程，每个进程各自加载并预热 PRELOAD_MODELS 中的模型
+- WORKER_CPU_SETS 可把工作进程绑定到 CPU 集合：auto 为把可用核平均分给各进程，
+  也可以显式写成 "0-1;2-3"（分号分隔每个进程，逗号/连字符表示核）。
+  未单独配置 ORT_INTRA_OP_THREADS 时，每个进程的算子线程数等于分到的核数，避免进程之间争抢
+- 任务发给当前未完成任务最少的进程
+- 进程处理满 WORKER_MAX_REQUESTS 个任务，或 RSS 超过 WORKER_MAX_RSS_MB 后被回收：
+  先启动替换进程，旧进程处理完已排队的任务后退出。进程崩溃时其未完成任务报错并立即补齐进程
+
+只有纯推理函数（模块级函数，参数和返回值可 pickle）在工作进程中执行；
+结果缓存、原图缓存和关键词索引仍在主进程，见 service.infer。
+"""
+import os
+import sys
+import time
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future
+
+import metrics
+
+
+def parse_cpu_sets(value: str, workers: int) -> list:
+    """解析 WORKER_CPU_SETS，返回每个工作进程的 CPU 集合（None 表示不绑定）"""
+    value = (value or '').strip().lower()
+    if not value or not hasattr(os, 'sched_setaffinity'):
+        return [None] * workers
+    if value == 'auto':
+        cpus = sorted(os.sched_getaffinity(0))
+        if len(cpus) < workers:
+            # 核比进程少时轮流分配，每个进程一个核
+            return [{cpus[i % len(cpus)]} for i in range(workers)]
+        size = len(cpus) // workers
+        return [set(cpus[i * size:(i + 1) * size]) for i in range(workers)]
+
+    sets = []
+    for group in value.split(';'):
+        cpus = set()
+        for part in group.split(','):
+            part = part.strip()
+            if '-' in part:
+                start, end = part.split('-', 1)
+                cpus.update(range(int(start), int(end) + 1))
+            elif part:
+                cpus.add(int(part))
+        sets.append(cpus)
+    if len(sets) != workers:
+        raise ValueError(f"WORKER_CPU_SETS has {len(sets)} groups but INFERENCE_WORKERS is {workers}")
+    return sets
+
+
+def current_rss_mb() -> float:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def worker_main(conn, index: int, cpus, intra_threads: int, engines: list):
+    """工作进程入口：绑定 CPU、预热模型，然后逐个执行任务"""
+    # 工作进程内部按单进程模式运行，每次只执行一个任务
+    os.environ['INFERENCE_WORKERS'] = '0'
+    os.environ['INFERENCE_CONCURRENCY'] = '1'
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    if intra_threads and not os.environ.get('ORT_INTRA_OP_THREADS'):
+        os.environ['ORT_INTRA_OP_THREADS'] = str(intra_threads)
+
+    import startup
+
+    # 预热和每个任务的阶段耗时、模型加载都随消息传回主进程，由主进程统一计入 /metrics
+    with metrics.collect() as trace:
+        startup.preload(engines)
+    try:
+        conn.send(('ready', os.getpid(), current_rss_mb(), trace))
+    except OSError:
+        return  # 主进程已退出
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        task_id, fn, args, kwargs = message
+        with metrics.collect() as trace:
+            try:
+                result = ('ok', fn(*args, **kwargs))
+            except Exception as e:
+                result = ('error', e)
+        try:
+            conn.send((task_id, *result, current_rss_mb(), trace))
+        except Exception as e:
+            # 异常对象无法 pickle 时退化为 RuntimeError
+            conn.send((task_id, 'error', RuntimeError(f"{type(e).__name__}: {e}"), current_rss_mb(), trace))
+    conn.close()
+
+
+class Worker:
+    """主进程中对一个工作进程的记录"""
+
+    def __init__(self, slot: int, cpus):
+        self.slot = slot
+        self.cpus = cpus
+        self.process = None
+        self.conn = None
+        self.pid = None
+        self.ready = False
+        self.draining = False
+        self.in_flight = {}
+        self.handled = 0
+        self.rss_mb = 0.0
+        self.send_lock = threading.Lock()
+
+
+class WorkerPool:
+    def __init__(self, workers: int = None, cpu_sets: str = None, max_requests: int = None, max_rss_mb: float = None):
+        self.size = workers or int(os.environ.get('INFERENCE_WORKERS', '0')) or 1
+        self.cpu_sets = parse_cpu_sets(
+            os.environ.get('WORKER_CPU_SETS', '') if cpu_sets is None else cpu_sets, self.size)
+        self.max_requests = max_requests if max_requests is not None else int(os.environ.get('WORKER_MAX_REQUESTS', '0'))
+        self.max_rss_mb = max_rss_mb if max_rss_mb is not None else float(os.environ.get('WORKER_MAX_RSS_MB', '0'))
+        self.engines = None
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = []
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._startup_failures = {}
+        self.recycled = 0
+
+    def start(self, engines=None):
+        """预先创建全部工作进程；engines 为每个进程要预热的引擎（默认 PRELOAD_MODELS）"""
+        import startup
+
+        self.engines = startup.preload_engines() if engines is None else list(engines)
+        with self._lock:
+            for slot in range(self.size):
+                self._workers.append(self._spawn(slot))
+        return self
+
+    def _intra_threads(self, cpus) -> int:
+        if cpus:
+            return len(cpus)
+        from inference_config import cpu_count
+        return max(1, cpu_count() // self.size)
+
+    def _spawn(self, slot: int) -> Worker:
+        """启动一个工作进程（调用方持有锁）"""
+        worker = Worker(slot, self.cpu_sets[slot])
+        parent_conn, child_conn = self._context.Pipe()
+        worker.conn = parent_conn
+        worker.process = self._context.Process(
+            target=worker_main,
+            args=(child_conn, slot, worker.cpus, self._intra_threads(worker.cpus), self.engines),
+            name=f"inference-worker-{slot}",
+            daemon=True,
+        )
+        worker.process.start()
+        child_conn.close()
+        worker.pid = worker.process.pid
+        threading.Thread(target=self._read_results, args=(worker,), name=f"worker-reader-{slot}", daemon=True).start()
+        print(f"Started inference worker {slot} (pid {worker.pid}, cpus {sorted(worker.cpus) if worker.cpus else 'any'})",
+              file=sys.stderr)
+        return worker
+
+    def _read_results(self, worker: Worker):
+        while True:
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == 'ready':
+                worker.ready = True
+                self._startup_failures.pop(worker.slot, None)
+                worker.rss_mb = message[2]
+                metrics.merge(message[3])
+                continue
+            task_id, status, value, rss_mb, trace = message
+            with self._lock:
+                future = worker.in_flight.pop(task_id, None)
+                worker.handled += 1
+                worker.rss_mb = rss_mb
+                self._maybe_recycle(worker)
+            if future is not None:
+                # 由等待结果的请求线程计入（见 call）
+                future.trace = trace
+                if status == 'ok':
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        self._on_exit(worker)
+
+    def _maybe_recycle(self, worker: Worker):
+        """达到请求数或内存上限时启动替换进程，旧进程处理完已排队的任务后退出（调用方持有锁）"""
+        if worker.draining or self._closed:
+            return
+        over_requests = self.max_requests and worker.handled >= self.max_requests
+        over_rss = self.max_rss_mb and worker.rss_mb >= self.max_rss_mb
+        if not (over_requests or over_rss):
+            return
+        reason = f"{worker.handled} requests" if over_requests else f"RSS {worker.rss_mb:.0f} MB"
+        print(f"Recycling inference worker {worker.slot} (pid {worker.pid}) after {reason}", file=sys.stderr)
+        worker.draining = True
+        self.recycled += 1
+        self._workers[self._workers.index(worker)] = self._spawn(worker.slot)
+        with worker.send_lock:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+
+    def _on_exit(self, worker: Worker):
+        """
+        进程退出：未完成的任务报错；非回收导致的退出（崩溃、被 OOM 杀掉）补齐进程。
+        预热完成前就退出的进程（依赖缺失、入口脚本没有 __main__ 保护等）按失败次数延迟重启，避免空转
+        """
+        worker.process.join(timeout=5)
+        restart = not worker.draining and not self._closed and worker in self._workers
+        if restart and not worker.ready:
+            failures = self._startup_failures[worker.slot] = self._startup_failures.get(worker.slot, 0) + 1
+            time.sleep(min(30, 2 ** (failures - 1)))
+        with self._lock:
+            orphaned = list(worker.in_flight.values())
+            worker.in_flight.clear()
+            if restart and not self._closed:
+                print(f"Inference worker {worker.slot} (pid {worker.pid}) exited with code "
+                      f"{worker.process.exitcode}, restarting", file=sys.stderr)
+                self._workers[self._workers.index(worker)] = self._spawn(worker.slot)
+        for future in orphaned:
+            future.set_exception(RuntimeError(f"Inference worker {worker.pid} exited unexpectedly"))
+        worker.conn.close()
+
+    def _pick(self) -> Worker:
+        """选择未完成任务最少的进程，已预热的优先（调用方持有锁）"""
+        return min(self._workers, key=lambda w: (not w.ready, len(w.in_flight), w.slot))
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("Worker pool is shut down")
+                worker = self._pick()
+                task_id = next(self._task_ids)
+                worker.in_flight[task_id] = future
+            error = None
+            with worker.send_lock:
+                # 回收时先标记 draining 再发送退出信号，持有 send_lock 时未标记说明任务一定排在退出信号之前
+                if not worker.draining:
+                    try:
+                        worker.conn.send((task_id, fn, args, kwargs))
+                        return future
+                    except Exception as e:
+                        error = e
+            # 释放 send_lock 之后再取 _lock：_maybe_recycle 持有 _lock 时会获取 send_lock，顺序相反会死锁
+            with self._lock:
+                worker.in_flight.pop(task_id, None)
+            if error is not None:
+                raise error
+
+    def call(self, fn, *args, **kwargs):
+        """在工作进程中执行并等待结果，子进程里的阶段耗时计入当前请求"""
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result()
+        finally:
+            metrics.merge(getattr(future, 'trace', None))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": [
+                    {
+                        "slot": w.slot,
+                        "pid": w.pid,
+                        "cpus": sorted(w.cpus) if w.cpus else None,
+                        "ready": w.ready,
+                        "in_flight": len(w.in_flight),
+                        "handled": w.handled,
+                        "rss_mb": round(w.rss_mb, 1),
+                    }
+                    for w in self._workers
+                ],
+                "recycled": self.recycled,
+                "max_requests": self.max_requests,
+                "max_rss_mb": self.max_rss_mb,
+            }
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not all(w.ready for w in self._workers):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            workers = list(self._workers)
+        for worker in workers:
+            with worker.send_lock:
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+        for worker in workers:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+
+def enabled() -> bool:
+    return int(os.environ.get('INFERENCE_WORKERS', '0')) > 0
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """返回进程级单例进程池（首次调用时启动全部工作进程）；未启用多进程模式时返回 None"""
+    global _pool
+    if not enabled():
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WorkerPool().start()
+    return _pool
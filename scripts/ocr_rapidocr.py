@@ -1,7 +1,28 @@
+"""
+RapidOCR 脚本
+
+三种运行方式：
+- 单次模式（默认）：从 stdin 读取一个 JSON 请求（或原始图片字节），输出一行 JSON 结果后退出
+- 常驻模式（--worker）：只加载一次模型并预热，之后循环处理请求。
+  请求/响应都是一行一个 JSON（NDJSON），默认走 stdin/stdout，
+  也可以用 --socket 监听 Unix socket。
+- 批量模式（--batch）：stdin 为 {"images": [...]}，所有图片共用一个 RapidOCR 实例，
+  解码按 CPU 核数并行、推理串行（每个 ONNX 会话本身已用满所有核），
+  每完成一张就输出一行 NDJSON 结果，最后输出 {"done": true}
+
+识别前按 EXIF 方向摆正图片；空白图不做检测，检测不到文字时不做分类和识别；
+文字方向默认先用最宽的几行判断整页方向（OCR_ORIENTATION=auto），整页一致时不再逐行分类。
+常驻模式下发送 {"type": "stats"} 可查看各路径的次数。
+"""
 import sys
 import json
 import base64
 import os
+import argparse
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
     from rapidocr_onnxruntime import RapidOCR
@@ -9,101 +30,297 @@ except Exception as e:
     print(json.dumps({"success": False, "error": f"Import RapidOCR failed: {str(e)}"}))
     sys.exit(1)
 
+# auto：整页方向一致时跳过逐行分类；always：逐行分类（RapidOCR 默认）；off：不分类
+ORIENTATION = os.environ.get('OCR_ORIENTATION', 'auto').strip().lower()
+ORIENTATION_PROBE = int(os.environ.get('OCR_ORIENTATION_PROBE', '6'))
+BLANK_RANGE = 16
+# 单张图片解码后的最大像素数：超出的 JPEG 缩小解码，其他格式直接拒绝（与 python-service 的 MAX_IMAGE_PIXELS 相同）
+MAX_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', str(40_000_000)))
+
+# 各识别路径（blank / no_text / upright / flipped / per_box / skipped）及 EXIF 摆正的次数
+STATS = Counter()
+STATS_LOCK = threading.Lock()
+
 
-def read_stdin_json():
+def count(name: str):
+    with STATS_LOCK:
+        STATS[name] += 1
+
+
+def read_stdin_payload():
+    """读取 stdin：JSON 请求（Base64 图片），或直接是原始图片字节"""
     try:
-        data = sys.stdin.read()
+        data = sys.stdin.buffer.read()
+        if data.lstrip()[:1] != b'{':
+            return {"image_bytes": data}
         return json.loads(data)
     except Exception as e:
         print(json.dumps({"success": False, "error": f"Invalid JSON input: {str(e)}"}))
         sys.exit(1)
 
 
-def save_base64_to_file(data_url: str, out_path: str):
+def decode_base64_image(data_url: str) -> bytes:
+    """将Base64图片数据解码为字节，失败时抛出 ValueError"""
     try:
         if data_url.startswith('data:'):
             base64_part = data_url.split(',', 1)[1]
         else:
             base64_part = data_url
-        with open(out_path, 'wb') as f:
-            f.write(base64.b64decode(base64_part))
+        return base64.b64decode(base64_part)
     except Exception as e:
-        print(json.dumps({"success": False, "error": f"Base64 decode failed: {str(e)}"}))
-        sys.exit(1)
+        raise ValueError(f"Base64 decode failed: {str(e)}")
 
 
-def main():
-    payload = read_stdin_json()
-    image_b64 = payload.get('image')
-    filename = payload.get('filename', 'image.png')
+def load_image(image_bytes: bytes):
+    """
+    在内存中把图片字节解码为 RGB ndarray，不经过临时文件。超出 MAX_IMAGE_PIXELS 的 JPEG 缩小解码，
+    其他格式直接拒绝（ValueError）；按 EXIF 方向摆正
+    """
+    import io
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(image_bytes))
+    width, height = image.size
+    if width * height > MAX_PIXELS:
+        scale = next((s for s in (2, 4, 8) if -(-width // s) * -(-height // s) <= MAX_PIXELS), 0)
+        if image.format != 'JPEG' or not scale:
+            raise ValueError(f"Image too large: {width}x{height} exceeds the {MAX_PIXELS} pixel limit")
+        image.draft(image.mode, (width // scale, height // scale))
+    image.load()
+    if image.getexif().get(0x0112, 1) != 1:
+        ImageOps.exif_transpose(image, in_place=True)
+        count('exif_rotated')
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    # RapidOCR 对 ndarray 输入按 BGR 处理
+    return np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
 
-    if not image_b64:
-        print(json.dumps({"success": False, "error": "No image provided"}))
-        sys.exit(1)
 
-    temp_path = os.path.join(os.getcwd(), f"_rapidocr_{os.getpid()}_{filename}")
+def warm_up(ocr):
+    """用一张空白小图跑一次推理，让 ONNX 会话完成首次分配"""
     try:
-        save_base64_to_file(image_b64, temp_path)
+        import numpy as np
+        blank = np.full((48, 160, 3), 255, dtype=np.uint8)
+        ocr(blank)
+        print("Debug: RapidOCR warm-up done", file=sys.stderr)
+    except Exception as e:
+        print(f"Debug: RapidOCR warm-up failed: {e}", file=sys.stderr)
 
-        ocr = RapidOCR()
-        
-        # 初始化文本列表
-        text_parts = []
-        
-        # 使用RapidOCR进行文本识别
-        # 根据测试结果，RapidOCR返回的是检测结果
-        # 我们需要使用不同的方法来获取文本
-        try:
-            # 方法1: 尝试使用ocr方法获取文本
-            text_result = ocr.ocr(temp_path, cls=True)
-            print(f"Debug: OCR text result: {text_result}", file=sys.stderr)
-            
-            if text_result and len(text_result) > 0:
-                for line in text_result[0]:
-                    if len(line) >= 2:
-                        # line[1] 是识别的文本
-                        text_content = str(line[1]).strip()
-                        if text_content:
-                            text_parts.append(text_content)
-                            print(f"Debug: Found text via OCR: '{text_content}'", file=sys.stderr)
-        except Exception as e:
-            print(f"Debug: OCR method failed: {e}", file=sys.stderr)
-            
-            # 方法2: 如果OCR方法失败，尝试直接调用
-            try:
-                result, _ = ocr(temp_path)
-                print(f"Debug: Direct call result: {result}", file=sys.stderr)
-                
-                if result:
-                    for i, item in enumerate(result):
-                        print(f"Debug: Item {i}: {item}", file=sys.stderr)
-                        
-                        # 尝试从结果中提取文本
-                        if isinstance(item, (list, tuple)):
-                            for sub_item in item:
-                                if isinstance(sub_item, str) and sub_item.strip():
-                                    # 这可能是文本内容
-                                    text_content = sub_item.strip()
-                                    if text_content and not text_content.startswith('['):
-                                        text_parts.append(text_content)
-                                        print(f"Debug: Found text via direct call: '{text_content}'", file=sys.stderr)
-            except Exception as e2:
-                print(f"Debug: Direct call also failed: {e2}", file=sys.stderr)
-        
-        # 用空格连接所有文本
-        text = ' '.join(text_parts) if text_parts else ""
-
-        print(json.dumps({"success": True, "text": text}))
+
+def is_blank(image) -> bool:
+    """隔行隔列抽样后几乎没有明暗变化（纯色背景、空白页），不可能有文字"""
+    step = max(1, max(image.shape[:2]) // 256)
+    sample = image[::step, ::step]
+    return int(sample.max()) - int(sample.min()) < BLANK_RANGE
+
+
+def orient_crops(ocr, crops: list) -> tuple:
+    """文字行方向分类，返回 (摆正后的文字行, 路径)；auto 模式先对最宽的几行分类，整页一致时其余行不再分类"""
+    import cv2
+
+    if ORIENTATION == 'off':
+        return crops, 'skipped'
+    if ORIENTATION == 'always':
+        crops, _, _ = ocr.text_cls(crops)
+        return crops, 'per_box'
+
+    crops = list(crops)
+    probe = sorted(range(len(crops)), key=lambda i: crops[i].shape[1] / max(crops[i].shape[0], 1),
+                   reverse=True)[:max(1, ORIENTATION_PROBE)]
+    _, results, _ = ocr.text_cls([crops[i] for i in probe])
+    flipped = [('180' in label and score > ocr.text_cls.cls_thresh) for label, score in results]
+    for i, flip in zip(probe, flipped):
+        if flip:
+            crops[i] = cv2.rotate(crops[i], cv2.ROTATE_180)
+    probed = set(probe)
+    rest = [i for i in range(len(crops)) if i not in probed]
+    if not any(flipped):
+        return crops, 'upright'
+    if all(flipped):
+        for i in rest:
+            crops[i] = cv2.rotate(crops[i], cv2.ROTATE_180)
+        return crops, 'flipped'
+    if rest:
+        rotated, _, _ = ocr.text_cls([crops[i] for i in rest])
+        for i, crop in zip(rest, rotated):
+            crops[i] = crop
+    return crops, 'per_box'
+
+
+def extract_text(ocr, image) -> str:
+    """对单张图片（已解码的 ndarray）执行 检测 -> 按需方向分类 -> 识别，返回用空格连接的文本"""
+    if is_blank(image):
+        count('blank')
+        return ""
+    img, padding_h = ocr.maybe_add_letterbox(ocr.load_img(image))
+    dt_boxes, _ = ocr.auto_text_det(img)
+    if dt_boxes is None:
+        count('no_text')
+        return ""
+    crops, path = orient_crops(ocr, ocr.get_crop_img_list(img, dt_boxes))
+    count(path)
+    rec_res, _ = ocr.text_rec(crops)
+    # 按检测框的阅读顺序输出，丢弃低于 RapidOCR 文本阈值的结果
+    text_parts = [text.strip() for text, score in rec_res if text.strip() and score >= ocr.text_score]
+    return ' '.join(text_parts)
+
+
+def run_ocr(ocr, payload: dict, lock: threading.Lock = None) -> dict:
+    """
+    处理一个请求，所有错误都转换为 success=False 的结果而不是退出进程。
+    lock 只包住推理：共享的 RapidOCR 实例上推理串行执行，解码可以与其他请求的推理并行
+    """
+    # 只接受 read_stdin_payload 产生的字节，JSON 请求里的同名字段不会被使用
+    image_bytes = payload.get('image_bytes')
+    try:
+        if not isinstance(image_bytes, bytes) or not image_bytes:
+            image_b64 = payload.get('image')
+            if not image_b64:
+                return {"success": False, "error": "No image provided"}
+            image_bytes = decode_base64_image(image_b64)
+        image = load_image(image_bytes)
+        with lock or nullcontext():
+            text = extract_text(ocr, image)
+        return {"success": True, "text": text}
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
     except Exception as e:
-        print(json.dumps({"success": False, "error": f"RapidOCR failed: {str(e)}"}))
-        sys.exit(1)
+        return {"success": False, "error": f"RapidOCR failed: {str(e)}"}
+
+
+def handle_message(ocr, line: str, lock: threading.Lock) -> dict:
+    """解析一行请求并返回响应；响应会带回请求中的 id 方便调用方对应"""
+    try:
+        payload = json.loads(line)
+    except Exception as e:
+        return {"success": False, "error": f"Invalid JSON input: {str(e)}"}
+    if not isinstance(payload, dict):
+        return {"success": False, "error": "Request must be a JSON object"}
+
+    request_id = payload.get('id')
+    if payload.get('type') == 'ping':
+        response = {"success": True, "pong": True}
+    elif payload.get('type') == 'stats':
+        with STATS_LOCK:
+            response = {"success": True, "stats": dict(STATS)}
+    else:
+        # 同一个模型实例在多个连接间共享，推理串行执行
+        response = run_ocr(ocr, payload, lock)
+    if request_id is not None:
+        response["id"] = request_id
+    return response
+
+
+def run_batch(ocr, images: list, jobs: int = None):
+    """
+    批量识别：images 中每项为 Base64 字符串或 {"image": ..., "id": ...}
+    按完成顺序逐行输出结果，index 为图片在输入中的位置。
+    jobs 个线程并行解码（Base64、图片解码、EXIF 摆正），推理在共享实例上串行：
+    每个 ONNX 会话的算子线程已用满所有核，并发推理只会让线程数变成核数的平方
+    """
+    items = [item if isinstance(item, dict) else {"image": item} for item in images]
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(items) or 1))
+    lock = threading.Lock()
+    succeeded = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(run_ocr, ocr, item, lock): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            index = futures[future]
+            response = future.result()
+            response["index"] = index
+            if items[index].get('id') is not None:
+                response["id"] = items[index]['id']
+            succeeded += 1 if response.get("success") else 0
+            sys.stdout.write(json.dumps(response, ensure_ascii=False) + '\n')
+            sys.stdout.flush()
+    sys.stdout.write(json.dumps({"done": True, "count": len(items), "succeeded": succeeded}) + '\n')
+    sys.stdout.flush()
+
+
+def serve_stdio(ocr):
+    """常驻模式：stdin 每行一个请求，stdout 每行一个响应"""
+    lock = threading.Lock()
+    # 通知调用方模型已就绪
+    sys.stdout.write(json.dumps({"ready": True}) + '\n')
+    sys.stdout.flush()
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        response = handle_message(ocr, line, lock)
+        sys.stdout.write(json.dumps(response, ensure_ascii=False) + '\n')
+        sys.stdout.flush()
+
+
+def serve_socket(ocr, socket_path: str):
+    """常驻模式：在 Unix socket 上提供与 stdin/stdout 相同的 NDJSON 协议"""
+    import socketserver
+
+    lock = threading.Lock()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw in self.rfile:
+                line = raw.decode('utf-8').strip()
+                if not line:
+                    continue
+                response = handle_message(ocr, line, lock)
+                self.wfile.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+                self.wfile.flush()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    server.daemon_threads = True
+    print(f"Debug: RapidOCR worker listening on {socket_path}", file=sys.stderr)
+    try:
+        server.serve_forever()
     finally:
+        server.server_close()
         try:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            os.unlink(socket_path)
         except Exception:
             pass
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="RapidOCR 识别脚本")
+    parser.add_argument('--worker', action='store_true', help="常驻模式，循环处理 NDJSON 请求")
+    parser.add_argument('--socket', help="常驻模式下监听的 Unix socket 路径（默认使用 stdin/stdout）")
+    parser.add_argument('--no-warmup', action='store_true', help="跳过启动时的预热推理")
+    parser.add_argument('--batch', action='store_true', help="批量模式，stdin 为 {\"images\": [...]}")
+    parser.add_argument('--jobs', type=int, help="批量模式下并行解码的图片数（默认 CPU 核数），推理串行")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.worker or args.socket:
+        ocr = RapidOCR()
+        if not args.no_warmup:
+            warm_up(ocr)
+        if args.socket:
+            serve_socket(ocr, args.socket)
+        else:
+            serve_stdio(ocr)
+        return
+
+    payload = read_stdin_payload()
+    if args.batch:
+        images = payload.get('images') if isinstance(payload, dict) else payload
+        if not isinstance(images, list):
+            print(json.dumps({"success": False, "error": "Batch input must be {\"images\": [...]}"}))
+            sys.exit(1)
+        run_batch(RapidOCR(), images, args.jobs)
+        return
+
+    result = run_ocr(RapidOCR(), payload)
+    print(json.dumps(result))
+    if not result.get("success"):
+        sys.exit(1)
+
+
 if __name__ == '__main__':
     main()
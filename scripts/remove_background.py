@@ -7,33 +7,38 @@ import sys
 import json
 import base64
 import os
+import io
+import argparse
+import hashlib
 import tempfile
+import importlib.util
 from pathlib import Path
 
+# 单张图片解码后的最大像素数：超出的 JPEG 缩小解码，其他格式直接拒绝（与 python-service 的 MAX_IMAGE_PIXELS 相同）
+MAX_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', str(40_000_000)))
+
+def dependency_marker_path():
+    """依赖检查通过后写入的标记文件，按 Python 解释器和环境区分，换了虚拟环境会重新检查"""
+    env = f"{sys.executable}:{sys.prefix}:{sys.version}".encode('utf-8')
+    return os.path.join(tempfile.gettempdir(), f"photobox-deps-remove-background-{hashlib.sha1(env).hexdigest()[:12]}.ok")
+
 def check_dependencies():
-    """检查必要的依赖是否已安装"""
-    missing_deps = []
-    
-    try:
-        import rembg
-        print("✅ rembg available", file=sys.stderr)
-    except ImportError:
-        missing_deps.append("rembg")
-        print("❌ rembg not found", file=sys.stderr)
+    """
+    检查必要的依赖是否已安装
+    只用 find_spec 查找模块而不导入（rembg 导入很慢，只在 process_image 中导入一次），
+    检查通过后写入标记文件，之后的调用直接跳过
+    """
+    marker_path = dependency_marker_path()
+    if os.path.exists(marker_path):
+        return []
     
-    try:
-        from PIL import Image
-        print("✅ PIL (Pillow) available", file=sys.stderr)
-    except ImportError:
-        missing_deps.append("PIL (Pillow)")
-        print("❌ PIL (Pillow) not found", file=sys.stderr)
-    
-    try:
-        import numpy as np  # noqa: F401 - used by rembg internals sometimes
-        print("✅ numpy available", file=sys.stderr)
-    except ImportError:
-        missing_deps.append("numpy")
-        print("❌ numpy not found", file=sys.stderr)
+    missing_deps = []
+    for module, package in (('rembg', 'rembg'), ('PIL', 'PIL (Pillow)'), ('numpy', 'numpy')):
+        if importlib.util.find_spec(module) is None:
+            missing_deps.append(package)
+            print(f"❌ {package} not found", file=sys.stderr)
+        else:
+            print(f"✅ {package} available", file=sys.stderr)
     
     # 放宽模型文件检查：仅提示，不作为阻断条件
     model_path = os.path.join(os.path.expanduser("~"), ".u2net", "u2net.onnx")
@@ -46,22 +51,43 @@ def check_dependencies():
     else:
         print("⚠️ 未找到AI模型文件，将由rembg按默认逻辑尝试加载/下载", file=sys.stderr)
     
+    if not missing_deps:
+        try:
+            with open(marker_path, 'w'):
+                pass
+        except OSError:
+            pass
     return missing_deps
 
-def save_base64_to_file(data_url: str, out_path: str):
-    """将Base64图片数据保存到文件"""
+def decode_base64_image(data_url: str):
+    """将Base64图片数据解码为字节，失败返回None"""
     try:
         if data_url.startswith('data:'):
             base64_part = data_url.split(',', 1)[1]
         else:
             base64_part = data_url
-        
-        with open(out_path, 'wb') as f:
-            f.write(base64.b64decode(base64_part))
-        return True
+        return base64.b64decode(base64_part)
     except Exception as e:
         print(f"Base64 decode failed: {e}", file=sys.stderr)
-        return False
+        return None
+
+def read_input(bg_color_arg: str):
+    """
+    读取 stdin：
+    - JSON（兼容旧方式）：{"image": Base64, "newBgColor": "#FFFFFF"}
+    - 原始图片字节：背景色通过 --bg-color 参数传入
+    返回 (图片字节, 背景色)
+    """
+    data = sys.stdin.buffer.read()
+    if data.lstrip()[:1] == b'{':
+        payload = json.loads(data)
+        image_b64 = payload.get('image')
+        image_bytes = decode_base64_image(image_b64) if image_b64 else None
+        if image_b64 and image_bytes is None:
+            print(json.dumps({"success": False, "error": "Failed to decode image data"}))
+            sys.exit(1)
+        return image_bytes, payload.get('newBgColor', bg_color_arg)
+    return data or None, bg_color_arg
 
 def hex_to_rgb(hex_color: str) -> tuple:
     """将十六进制颜色转换为RGB元组，支持#RGB/#RRGGBB"""
@@ -73,40 +99,66 @@ def hex_to_rgb(hex_color: str) -> tuple:
         c = ''.join([ch*2 for ch in c])
     return tuple(int(c[i:i+2], 16) for i in (0, 2, 4))
 
-def process_image(input_path: str, output_path: str, bg_color: str):
-    """处理图片：移除背景并添加新背景色"""
+def open_image(source):
+    """
+    在像素预算内解码为 RGB：超出 MAX_IMAGE_PIXELS 的 JPEG 用 draft() 按 1/2、1/4、1/8 缩小解码，
+    其他格式（PNG 解压炸弹等）在分配像素内存前拒绝；按 EXIF 方向原地摆正，已是 RGB 时不再转换
+    """
+    from PIL import Image, ImageOps
+
+    image = Image.open(source)
+    width, height = image.size
+    if width * height > MAX_PIXELS:
+        scale = next((s for s in (2, 4, 8) if -(-width // s) * -(-height // s) <= MAX_PIXELS), 0)
+        if image.format != 'JPEG' or not scale:
+            raise ValueError(f"Image too large: {width}x{height} exceeds the {MAX_PIXELS} pixel limit")
+        image.draft(image.mode, (width // scale, height // scale))
+        print(f"Image over pixel budget, decoding JPEG at 1/{scale}: {image.size}", file=sys.stderr)
+    image.load()
+    if image.getexif().get(0x0112, 1) != 1:
+        ImageOps.exif_transpose(image, in_place=True)
+    return image if image.mode == 'RGB' else image.convert('RGB')
+
+def process_image(input_path, output_path, bg_color: str, proxy_size: int = 0):
+    """
+    处理图片：移除背景并添加新背景色
+    input_path / output_path 可以是文件路径，也可以是内存中的文件对象（BytesIO）
+    proxy_size > 0 时先把图片最长边缩小到 proxy_size 再分割，蒙版放大回原尺寸后在原分辨率上合成
+    """
     try:
         from rembg import remove
         from PIL import Image
+        import numpy as np
         
-        print(f"Processing image: {input_path}", file=sys.stderr)
+        print(f"Processing image: {input_path if isinstance(input_path, str) else '<memory>'}", file=sys.stderr)
         print(f"Background color: {bg_color}", file=sys.stderr)
         
-        # 读取输入图片（以PIL Image形式传给rembg，确保得到RGBA）
-        input_image = Image.open(input_path).convert('RGBA')
+        # 在像素预算内读取输入图片并转为RGB
+        input_image = open_image(input_path)
         print(f"Input image size: {input_image.size}", file=sys.stderr)
         
-        # 使用rembg移除背景，输出应为RGBA（带alpha）
-        print("Removing background with rembg...", file=sys.stderr)
-        fg_image = remove(input_image)
-        if not isinstance(fg_image, Image.Image):
-            fg_image = Image.fromarray(fg_image)
-        if fg_image.mode != 'RGBA':
-            fg_image = fg_image.convert('RGBA')
-        print(f"Foreground image mode: {fg_image.mode}", file=sys.stderr)
+        # U²-Net 只在 320x320 上推理，大图先缩小，省去 rembg 在全分辨率上的前后处理
+        proxy = input_image
+        if proxy_size > 0 and max(input_image.size) > proxy_size:
+            scale = proxy_size / max(input_image.size)
+            proxy_dims = tuple(max(1, round(v * scale)) for v in input_image.size)
+            proxy = input_image.resize(proxy_dims, Image.BILINEAR, reducing_gap=3.0)
+            print(f"Segmenting on proxy image: {proxy.size}", file=sys.stderr)
         
-        # 创建新的背景图像
-        bg_rgb = hex_to_rgb(bg_color)
-        background = Image.new('RGBA', fg_image.size, bg_rgb + (255,))
+        # 使用rembg只生成蒙版，直接以ndarray传入
+        print("Removing background with rembg...", file=sys.stderr)
+        mask = Image.fromarray(np.asarray(remove(np.asarray(proxy), only_mask=True))).convert('L')
+        if mask.size != input_image.size:
+            mask = mask.resize(input_image.size, Image.BILINEAR)
         
-        # 使用alpha通道进行合成
+        # 按蒙版把原图合成到新背景上（等价于抠图后 alpha_composite）
         print("Compositing image with new background...", file=sys.stderr)
-        result = Image.alpha_composite(background, fg_image)
+        background = Image.new('RGB', input_image.size, hex_to_rgb(bg_color))
+        result_rgb = Image.composite(input_image, background, mask)
         
         # 最终保存为PNG（保留RGB，不需要透明）
-        result_rgb = result.convert('RGB')
         result_rgb.save(output_path, 'PNG', quality=95)
-        print(f"Result saved to: {output_path}", file=sys.stderr)
+        print(f"Result saved to: {output_path if isinstance(output_path, str) else '<memory>'}", file=sys.stderr)
         
         return True
         
@@ -116,8 +168,18 @@ def process_image(input_path: str, output_path: str, bg_color: str):
         traceback.print_exc(file=sys.stderr)
         return False
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="背景移除和背景色合成")
+    parser.add_argument('--bg-color', default='#FFFFFF', help="stdin 为原始图片字节时使用的背景色")
+    parser.add_argument('--output', choices=('file', 'stdout'), default='file',
+                        help="file：结果写入临时文件并返回 tempFilePath（旧方式）；stdout：PNG 字节直接写到 stdout")
+    parser.add_argument('--proxy-size', type=int, default=int(os.environ.get('REMBG_PROXY_SIZE', '1024')),
+                        help="分割时代理图的最长边，0 表示直接分割原图（默认 1024，或环境变量 REMBG_PROXY_SIZE）")
+    return parser.parse_args()
+
 def main():
     """主函数"""
+    args = parse_args()
     try:
         # 检查依赖（不阻断模型文件缺失/不完整）
         missing_deps = check_dependencies()
@@ -127,13 +189,9 @@ def main():
             sys.exit(1)
         
         # 读取输入
-        input_data = sys.stdin.read()
-        payload = json.loads(input_data)
-        
-        image_b64 = payload.get('image')
-        new_bg_color = payload.get('newBgColor', '#FFFFFF')
+        image_bytes, new_bg_color = read_input(args.bg_color)
         
-        if not image_b64:
+        if not image_bytes:
             print(json.dumps({"success": False, "error": "No image data provided"}))
             sys.exit(1)
         
@@ -141,36 +199,30 @@ def main():
             print(json.dumps({"success": False, "error": "No background color provided"}))
             sys.exit(1)
         
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_input:
-            input_path = temp_input.name
+        # 结果直接以PNG字节写到stdout，不落盘；出错时stdout为JSON且退出码非0
+        if args.output == 'stdout':
+            output = io.BytesIO()
+            if not process_image(io.BytesIO(image_bytes), output, new_bg_color, args.proxy_size):
+                print(json.dumps({"success": False, "error": "Image processing failed"}))
+                sys.exit(1)
+            sys.stdout.buffer.write(output.getvalue())
+            sys.stdout.buffer.flush()
+            return
         
+        # 结果写入临时文件，由调用方读取后删除
         with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_output:
             output_path = temp_output.name
         
-        try:
-            # 保存Base64图片到临时文件
-            if not save_base64_to_file(image_b64, input_path):
-                print(json.dumps({"success": False, "error": "Failed to decode image data"}))
-                sys.exit(1)
-            
-            # 处理图片
-            if process_image(input_path, output_path, new_bg_color):
-                print(json.dumps({
-                    "success": True, 
-                    "tempFilePath": output_path,
-                    "message": "Background removal and color change completed successfully"
-                }))
-            else:
-                print(json.dumps({"success": False, "error": "Image processing failed"}))
-                sys.exit(1)
-                
-        finally:
-            # 清理输入临时文件
-            try:
-                os.unlink(input_path)
-            except:
-                pass
+        # 直接从内存解码输入图片，不再写入临时文件
+        if process_image(io.BytesIO(image_bytes), output_path, new_bg_color, args.proxy_size):
+            print(json.dumps({
+                "success": True, 
+                "tempFilePath": output_path,
+                "message": "Background removal and color change completed successfully"
+            }))
+        else:
+            print(json.dumps({"success": False, "error": "Image processing failed"}))
+            sys.exit(1)
         
     except json.JSONDecodeError as e:
         print(json.dumps({"success": False, "error": f"Invalid JSON input: {e}"}))
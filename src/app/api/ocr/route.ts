@@ -1,35 +1,9 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { spawn } from 'child_process';
+import { getOCRWorker } from '@/lib/ocrWorker';
 
-function runRapidOCR(payload: unknown): Promise<{ success: boolean; text?: string; error?: string }>{
-	return new Promise((resolve) => {
-		const py = spawn('python', ['scripts/ocr_rapidocr.py'], { stdio: ['pipe', 'pipe', 'pipe'] });
-
-		let stdout = '';
-		let stderr = '';
-
-		py.stdout.on('data', (data) => {
-			stdout += data.toString();
-		});
-		py.stderr.on('data', (data) => {
-			stderr += data.toString();
-		});
-		py.on('error', (err) => {
-			resolve({ success: false, error: `Failed to start Python: ${err.message}` });
-		});
-		py.on('close', () => {
-			try {
-				// Python prints a single JSON line
-				const result = JSON.parse(stdout.trim());
-				resolve(result);
-			} catch (e) {
-				resolve({ success: false, error: `Invalid Python output: ${stdout || stderr}` });
-			}
-		});
-
-		py.stdin.write(JSON.stringify(payload));
-		py.stdin.end();
-	});
+function runRapidOCR(payload: { image: string; filename?: string }): Promise<{ success: boolean; text?: string; error?: string }>{
+	// 复用常驻的 Python 进程，模型只加载一次
+	return getOCRWorker().run(payload);
 }
 
 async function callRemoteOCRService(payload: { image: string }): Promise<{ success: boolean; text?: string; error?: string }> {
@@ -40,14 +14,14 @@ async function callRemoteOCRService(payload: { image: string }): Promise<{ succe
   }
 
   try {
+    // 以原始字节发送，避免 Base64 带来的体积膨胀
+    const commaIndex = payload.image.startsWith('data:') ? payload.image.indexOf(',') : -1;
     const response = await fetch(`${pythonServiceUrl}/ocr`, {
       method: 'POST',
       headers: {
-        'Content-Type': 'application/json',
+        'Content-Type': 'application/octet-stream',
       },
-      body: JSON.stringify({
-        image_data: payload.image
-      })
+      body: Buffer.from(commaIndex >= 0 ? payload.image.slice(commaIndex + 1) : payload.image, 'base64')
     });
 
     if (!response.ok) {
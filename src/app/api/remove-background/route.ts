@@ -1,8 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { spawn } from 'child_process';
-import { writeFile, unlink } from 'fs/promises';
-import { join } from 'path';
-import { tmpdir } from 'os';
 
 export const runtime = 'nodejs';
 export const dynamic = 'force-dynamic';
@@ -13,11 +10,24 @@ interface RemoveBackgroundRequest {
   newBgColor: string; // Hex color code
 }
 
-function runRembgPython(payload: RemoveBackgroundRequest, timeoutMs = 120000): Promise<{ success: boolean; tempFilePath?: string; error?: string }> {
+// 去掉 data URL 前缀并解码为原始字节，后续各跳都直接传二进制
+function decodeImage(image: string): Buffer {
+  const commaIndex = image.startsWith('data:') ? image.indexOf(',') : -1;
+  return Buffer.from(commaIndex >= 0 ? image.slice(commaIndex + 1) : image, 'base64');
+}
+
+interface RemoveBackgroundResult {
+  success: boolean;
+  image?: Buffer; // PNG bytes
+  error?: string;
+}
+
+function runRembgPython(payload: RemoveBackgroundRequest, timeoutMs = 120000): Promise<RemoveBackgroundResult> {
   return new Promise((resolve) => {
-    const py = spawn('python', ['scripts/remove_background.py'], { stdio: ['pipe', 'pipe', 'pipe'] });
+    // 结果 PNG 直接从 stdout 读回，不经过临时文件
+    const py = spawn('python', ['scripts/remove_background.py', '--bg-color', payload.newBgColor, '--output', 'stdout'], { stdio: ['pipe', 'pipe', 'pipe'] });
 
-    let stdout = '';
+    const stdoutChunks: Buffer[] = [];
     let stderr = '';
     let finished = false;
 
@@ -29,8 +39,8 @@ function runRembgPython(payload: RemoveBackgroundRequest, timeoutMs = 120000): P
       }
     }, timeoutMs);
 
-    py.stdout.on('data', (data) => {
-      stdout += data.toString();
+    py.stdout.on('data', (data: Buffer) => {
+      stdoutChunks.push(data);
     });
     
     py.stderr.on('data', (data) => {
@@ -48,24 +58,22 @@ function runRembgPython(payload: RemoveBackgroundRequest, timeoutMs = 120000): P
       if (finished) return;
       finished = true;
       clearTimeout(timeout);
-      if (code === 0) {
-        try {
-          const result = JSON.parse(stdout.trim());
-          if (result.success && result.tempFilePath) {
-            resolve({ success: true, tempFilePath: result.tempFilePath });
-          } else {
-            resolve({ success: false, error: result.error || 'Python processing failed' });
-          }
-        } catch (e) {
-          resolve({ success: false, error: `Invalid Python output: ${stdout || stderr}` });
-        }
-      } else {
+      const stdout = Buffer.concat(stdoutChunks);
+      if (code === 0 && stdout.length > 0) {
+        resolve({ success: true, image: stdout });
+        return;
+      }
+      try {
+        // 失败时 Python 在 stdout 输出一行 JSON
+        const result = JSON.parse(stdout.toString().trim());
+        resolve({ success: false, error: result.error || 'Python processing failed' });
+      } catch (e) {
         resolve({ success: false, error: `Python process failed with code ${code}: ${stderr}` });
       }
     });
 
     try {
-      py.stdin.write(JSON.stringify(payload));
+      py.stdin.write(decodeImage(payload.image));
       py.stdin.end();
     } catch (e: any) {
       clearTimeout(timeout);
@@ -74,7 +82,7 @@ function runRembgPython(payload: RemoveBackgroundRequest, timeoutMs = 120000): P
   });
 }
 
-async function callRemotePythonService(payload: RemoveBackgroundRequest): Promise<{ success: boolean; tempFilePath?: string; error?: string }> {
+async function callRemotePythonService(payload: RemoveBackgroundRequest): Promise<RemoveBackgroundResult> {
   const pythonServiceUrl = process.env.PYTHON_SERVICE_URL;
   
   if (!pythonServiceUrl) {
@@ -82,15 +90,13 @@ async function callRemotePythonService(payload: RemoveBackgroundRequest): Promis
   }
 
   try {
-    const response = await fetch(`${pythonServiceUrl}/remove-background`, {
+    const query = new URLSearchParams({ new_bg_color: payload.newBgColor });
+    const response = await fetch(`${pythonServiceUrl}/remove-background?${query}`, {
       method: 'POST',
       headers: {
-        'Content-Type': 'application/json',
+        'Content-Type': 'application/octet-stream',
       },
-      body: JSON.stringify({
-        image_data: payload.image,
-        new_bg_color: payload.newBgColor
-      })
+      body: decodeImage(payload.image)
     });
 
     if (!response.ok) {
@@ -99,13 +105,7 @@ async function callRemotePythonService(payload: RemoveBackgroundRequest): Promis
     }
 
     const imageBuffer = await response.arrayBuffer();
-    
-    // 创建临时文件保存远程返回的图片
-    const fs = await import('fs/promises');
-    const tempFilePath = join(tmpdir(), `remote_output_${Date.now()}.png`);
-    await fs.writeFile(tempFilePath, Buffer.from(imageBuffer));
-    
-    return { success: true, tempFilePath };
+    return { success: true, image: Buffer.from(imageBuffer) };
 
   } catch (error) {
     return { success: false, error: `Failed to call remote Python service: ${error instanceof Error ? error.message : 'Unknown error'}` };
@@ -162,34 +162,14 @@ export async function POST(request: NextRequest) {
       );
     }
 
-    try {
-      const fs = await import('fs/promises');
-      const imageBuffer = await fs.readFile(result.tempFilePath!);
-      const response = new NextResponse(imageBuffer, {
-        status: 200,
-        headers: {
-          'Content-Type': 'image/png',
-          'Content-Disposition': 'attachment; filename="processed-image.png"',
-          'Cache-Control': 'no-cache',
-        },
-      });
-
-      try {
-        await fs.unlink(result.tempFilePath!);
-      } catch (cleanupError) {
-        console.warn('Failed to clean up temporary file:', cleanupError);
-      }
-
-      return response;
-
-    } catch (readError) {
-      console.error('Failed to read processed image:', readError);
-      return NextResponse.json(
-        { success: false, error: 'Failed to read processed image' },
-        { status: 500 }
-      );
-    }
-
+    return new NextResponse(result.image!, {
+      status: 200,
+      headers: {
+        'Content-Type': 'image/png',
+        'Content-Disposition': 'attachment; filename="processed-image.png"',
+        'Cache-Control': 'no-cache',
+      },
+    });
   } catch (error) {
     console.error('API error:', error);
     return NextResponse.json(
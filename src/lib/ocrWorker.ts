@@ -0,0 +1,103 @@
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+
+export interface OCRWorkerResult {
+  success: boolean;
+  text?: string;
+  error?: string;
+}
+
+interface PendingRequest {
+  resolve: (result: OCRWorkerResult) => void;
+  timer: ReturnType<typeof setTimeout>;
+}
+
+/**
+ * 常驻的 RapidOCR 子进程（scripts/ocr_rapidocr.py --worker）
+ * 模型只在进程启动时加载一次，请求和响应都是一行一个 JSON，通过 id 对应
+ */
+class OCRWorker {
+  private proc: ChildProcessWithoutNullStreams | null = null;
+  private buffer = '';
+  private nextId = 1;
+  private pending = new Map<number, PendingRequest>();
+
+  private start(): ChildProcessWithoutNullStreams {
+    const py = spawn('python', ['scripts/ocr_rapidocr.py', '--worker'], { stdio: ['pipe', 'pipe', 'pipe'] });
+
+    py.stdout.on('data', (data) => {
+      this.buffer += data.toString();
+      let newline = this.buffer.indexOf('\n');
+      while (newline >= 0) {
+        const line = this.buffer.slice(0, newline).trim();
+        this.buffer = this.buffer.slice(newline + 1);
+        if (line) this.handleLine(line);
+        newline = this.buffer.indexOf('\n');
+      }
+    });
+    // 调试输出必须持续读取，否则管道写满会阻塞 Python 进程
+    py.stderr.on('data', () => {});
+    py.on('error', (err) => this.fail(`Failed to start Python: ${err.message}`, py));
+    py.on('close', (code) => this.fail(`OCR worker exited with code ${code}`, py));
+
+    this.proc = py;
+    this.buffer = '';
+    return py;
+  }
+
+  private handleLine(line: string) {
+    let message: OCRWorkerResult & { id?: number; ready?: boolean };
+    try {
+      message = JSON.parse(line);
+    } catch {
+      return;
+    }
+    if (message.id === undefined) return;
+    const request = this.pending.get(message.id);
+    if (!request) return;
+    this.pending.delete(message.id);
+    clearTimeout(request.timer);
+    request.resolve({ success: message.success, text: message.text, error: message.error });
+  }
+
+  private fail(error: string, py: ChildProcessWithoutNullStreams) {
+    if (this.proc !== py) return;
+    this.proc = null;
+    this.pending.forEach((request) => {
+      clearTimeout(request.timer);
+      request.resolve({ success: false, error });
+    });
+    this.pending.clear();
+  }
+
+  run(payload: { image: string; filename?: string }, timeoutMs = 60000): Promise<OCRWorkerResult> {
+    const py = this.proc ?? this.start();
+    const id = this.nextId++;
+
+    return new Promise((resolve) => {
+      const timer = setTimeout(() => {
+        if (!this.pending.delete(id)) return;
+        resolve({ success: false, error: 'OCR worker timed out' });
+        // 超时的进程状态不可信，结束它，下次请求时重新拉起
+        try { py.kill('SIGKILL'); } catch {}
+      }, timeoutMs);
+      this.pending.set(id, { resolve, timer });
+
+      try {
+        py.stdin.write(JSON.stringify({ id, image: payload.image, filename: payload.filename }) + '\n');
+      } catch (e: any) {
+        this.pending.delete(id);
+        clearTimeout(timer);
+        resolve({ success: false, error: `Failed to send data to Python: ${e?.message || e}` });
+      }
+    });
+  }
+}
+
+let worker: OCRWorker | null = null;
+
+export function getOCRWorker(): OCRWorker {
+  if (!worker) {
+    worker = new OCRWorker();
+  }
+  return worker;
+}